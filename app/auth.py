@@ -4,24 +4,65 @@
 - управления сессиями БД
 - аутентификации пользователей
 - генерации JWT-токенов
+- кеширования аутентифицированных пользователей
 """
 
+import time
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import NamedTuple, Optional
 from jose import jwt
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi.security import OAuth2PasswordBearer
-from . import crud
-from .database import SessionLocal
+from . import credentials, crud
+from .cache import TTLCache
+from .database import AsyncSessionLocal
 from .config import settings
 
 # Схема OAuth2 для работы с токенами
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
 
-def authenticate_user(db_session: Session, username: str, password: str):
+class UserSnapshot(NamedTuple):
+    """Снимок пользователя, не привязанный к сессии БД.
+
+    Attributes:
+        id: Идентификатор пользователя
+        username: Логин пользователя
+        email: Электронная почта
+        is_active: Флаг активности аккаунта
+        is_admin: Флаг администратора
+    """
+    id: int
+    username: str
+    email: str
+    is_active: bool
+    is_admin: bool
+
+    @classmethod
+    def from_model(cls, user) -> "UserSnapshot":
+        """Создание снимка из модели User."""
+        return cls(
+            id=user.id,
+            username=user.username,
+            email=user.email,
+            is_active=bool(user.is_active),
+            is_admin=bool(user.is_admin)
+        )
+
+
+# Кеш пользователей по паре (sub, токен)
+user_cache = TTLCache(
+    max_entries=settings.USER_CACHE_SIZE,
+    ttl=settings.USER_CACHE_TTL
+)
+
+
+async def authenticate_user(db_session: AsyncSession, username: str, password: str):
     """Аутентификация пользователя по логину и паролю.
 
+    Проверка bcrypt выполняется вне цикла событий. Если хеш пароля
+    создан с устаревшей стоимостью, он прозрачно пересчитывается.
+
     Args:
         db_session: Сессия базы данных
         username: Логин пользователя
@@ -29,11 +70,19 @@ def authenticate_user(db_session: Session, username: str, password: str):
 
     Returns:
         User: Объект пользователя при успехе
-        False: При неудачной аутентификации
+        False: При неудачной аутентификации или деактивированном аккаунте
+
+    Raises:
+        credentials.PasswordHashBusyError: Если очередь хеширования заполнена
     """
-    user = crud.get_user(db_session, username)
-    if not user or not crud.verify_password(password, user.hashed_password):
+    user = await db_session.run_sync(crud.get_user, username)
+    if not user or not user.is_active:
         return False
+    is_valid, new_hash = await credentials.verify_password(password, user.hashed_password)
+    if not is_valid:
+        return False
+    if new_hash:
+        await db_session.run_sync(crud.update_password_hash, user, new_hash)
     return user
 
 
@@ -54,3 +103,45 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
         expire = datetime.utcnow() + timedelta(minutes=15)
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
+
+
+async def get_principal(username: str, token: str, expires_at: Optional[float] = None):
+    """Получение пользователя для проверенного JWT токена.
+
+    Сначала проверяется кеш, при промахе пользователь читается из БД.
+    Запись в кеше живёт не дольше самого токена.
+
+    Args:
+        username: Логин из поля sub токена
+        token: Токен целиком
+        expires_at: Время истечения токена (поле exp, unix time)
+
+    Returns:
+        UserSnapshot: Снимок пользователя или None, если он не найден
+    """
+    key = (username, token)
+    principal = user_cache.get(key)
+    if principal is not None:
+        return principal
+
+    async with AsyncSessionLocal() as db_session:
+        user = await db_session.run_sync(crud.get_user, username)
+        if not user:
+            return None
+        principal = UserSnapshot.from_model(user)
+
+    ttl = expires_at - time.time() if expires_at else None
+    user_cache.set(key, principal, ttl=ttl)
+    return principal
+
+
+def invalidate_user(username: str) -> int:
+    """Удаление всех закешированных записей пользователя.
+
+    Args:
+        username: Логин пользователя
+
+    Returns:
+        int: Количество удалённых записей
+    """
+    return user_cache.discard_where(lambda key: key[0] == username)
@@ -0,0 +1,103 @@
+"""Модуль кешей в памяти процесса.
+
+Содержит:
+- LRU-кеш с ограничением по количеству записей и временем жизни записей
+- Счётчики попаданий и промахов для контроля эффективности
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+
+class TTLCache:
+    """LRU-кеш с временем жизни записей.
+
+    При переполнении вытесняется давно не использованная запись,
+    просроченные записи удаляются при обращении к ним.
+
+    Attributes:
+        max_entries: Максимальное количество записей
+        ttl: Время жизни записи по умолчанию в секундах
+        hits: Количество попаданий
+        misses: Количество промахов
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 60.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Получение значения по ключу.
+
+        Args:
+            key: Ключ записи
+
+        Returns:
+            Any: Значение или None при промахе
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """Сохранение значения.
+
+        Args:
+            key: Ключ записи
+            value: Значение
+            ttl: Время жизни в секундах (не больше ttl кеша)
+        """
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0 or self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, key: Hashable):
+        """Удаление записи по ключу (отсутствующий ключ не ошибка)."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def discard_where(self, predicate: Callable[[Hashable], bool]) -> int:
+        """Удаление записей, ключи которых удовлетворяют условию.
+
+        Args:
+            predicate: Функция проверки ключа
+
+        Returns:
+            int: Количество удалённых записей
+        """
+        with self._lock:
+            keys = [key for key in self._entries if predicate(key)]
+            for key in keys:
+                del self._entries[key]
+            return len(keys)
+
+    def clear(self):
+        """Очистка кеша."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """Статистика использования кеша.
+
+        Returns:
+            dict: Количество записей, попаданий и промахов
+        """
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
@@ -3,11 +3,38 @@
 Содержит настройки:
 - Безопасности (секретные ключи, алгоритмы)
 - Времени жизни токенов
+- Подключения к базе данных и её миграции при запуске
+- Хеширования паролей
+- Приёма загрузок
+- Пула обработки изображений
+- Хранилища изображений
+- Миниатюр
+- Очереди заданий
+- Оценки качества
+- Групповой фиксации записей
+- Фонового удаления пользователей и сборки мусора в хранилище
+- Выгрузки набора данных
+- Кешей
+- Метрик и профилирования
 - Окружения (загрузка из .env файла)
+
+Относительные пути (файл SQLite, хранилище, профили, .env) отсчитываются
+от корня проекта, а не от текущего каталога процесса.
 """
 
+from pathlib import Path
+from typing import Dict, List
+
 from pydantic_settings import BaseSettings
 
+# Корень проекта: каталог с app/, static/ и templates/
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+
+def project_path(path: str) -> Path:
+    """Путь относительно корня проекта (абсолютный путь не меняется)."""
+    return BASE_DIR / path
+
 
 class Settings(BaseSettings):
     """Основные настройки приложения.
@@ -16,19 +43,164 @@ class Settings(BaseSettings):
         SECRET_KEY: Секретный ключ для подписи JWT токенов
         ALGORITHM: Алгоритм подписи токенов
         ACCESS_TOKEN_EXPIRE_MINUTES: Время жизни токена в минутах
+        DATABASE_URL: URL базы данных (sqlite:/// или postgresql://)
+        AUTO_MIGRATE: Приводить схему БД к моделям при запуске приложения
+            (иначе схема создаётся только через python -m app.migrate)
+        DB_POOL_SIZE: Размер пула подключений
+        DB_MAX_OVERFLOW: Дополнительные подключения сверх пула
+        DB_POOL_TIMEOUT: Ожидание свободного подключения в секундах
+        SQLITE_BUSY_TIMEOUT_MS: Ожидание блокировки SQLite в миллисекундах
+        SQLITE_MMAP_SIZE: Размер отображения файла SQLite в память в байтах
+        BCRYPT_ROUNDS: Стоимость bcrypt (log2 числа раундов)
+        PASSWORD_HASH_WORKERS: Размер пула потоков для bcrypt
+        PASSWORD_HASH_CONCURRENCY: Максимум принятых операций bcrypt - выполняемых и
+            ожидающих потока (не меньше PASSWORD_HASH_WORKERS); сверх него вход и
+            регистрация сразу отвечают 503
+        PASSWORD_HASH_RETRY_AFTER: Значение Retry-After при переполнении очереди bcrypt
+        MAX_UPLOAD_BYTES: Максимальный размер загружаемого изображения
+        UPLOAD_SPOOL_BYTES: Размер, до которого загрузка держится в памяти
+        MAX_TILED_UPLOAD_BYTES: Максимальный размер изображения для потайловой обработки
+        SEGMENTATION_EXECUTOR: Тип пула сегментации ("thread" или "process")
+        SEGMENTATION_WORKERS: Размер пула (0 - по числу ядер)
+        SEGMENTATION_QUEUE_SIZE: Максимум задач, ожидающих свободного воркера
+        SEGMENTATION_TIMEOUT: Таймаут сегментации одного изображения в секундах
+        SEGMENTATION_RETRY_AFTER: Значение Retry-After при переполнении очереди
+        SEGMENTATION_DEFAULT_ENGINE: Движок сегментации, если в запросе он не указан
+        SEGMENTATION_WORKING_MEGAPIXELS: Рабочее разрешение по движкам в мегапикселях
+            (JSON, например {"otsu": 2}; 0 - исходное), переопределяет значения движков
+        SEGMENTATION_TILED_TIMEOUT: Таймаут потайловой сегментации в секундах
+        TILE_SIZE: Сторона тайла в пикселях (кратна 8)
+        TILE_WORKERS: Потоков обработки тайлов (0 - по числу ядер)
+        BATCH_MAX_FILES: Максимум изображений в пакетной загрузке
+        BATCH_MAX_BYTES: Максимальный размер пакетной загрузки (тело и распакованные архивы)
+        BATCH_CHUNK_SIZE: Изображений в одной задаче пула при пакетной обработке
+        BLOB_STORAGE_BACKEND: Бэкенд хранилища изображений
+        BLOB_STORAGE_PATH: Каталог локального хранилища изображений
+        THUMBNAIL_SIZES: Наибольшие стороны миниатюр в пикселях
+        THUMBNAIL_QUALITY: Качество WebP миниатюр
+        THUMBNAIL_MAX_PIXELS: Наибольший источник миниатюр, декодируемый целиком, в пикселях
+            (упакованные маски и несжатый TIFF прореживаются без ограничения,
+            JPEG - до 64 раз больше за счёт уменьшения при декодировании; 0 - без ограничения)
+        DERIVATIVE_WORKERS: Потоков фоновой генерации миниатюр
+        DERIVATIVE_QUEUE_SIZE: Максимальная длина очереди генерации миниатюр
+        JOB_WORKERS: Воркеров очереди заданий в процессе
+        JOB_USER_CONCURRENCY: Максимум одновременно выполняющихся заданий пользователя
+        JOB_MAX_ACTIVE_PER_USER: Максимум незавершённых заданий пользователя
+        JOB_POLL_INTERVAL: Период опроса очереди заданий в секундах
+        JOB_MAX_ATTEMPTS: Максимум попыток выполнения задания
+        JOB_LEASE_MARGIN: Запас аренды задания сверх таймаута сегментации в секундах
+        EVAL_BOUNDARY_TOLERANCE: Допуск совпадения границ для граничной F-меры в пикселях
+        EVAL_BATCH_SIZE: Масок в одном пакете расчёта метрик
+        WRITE_BATCH_ENABLED: Групповая фиксация вставок сегментаций и оценок
+        WRITE_BATCH_MAX_SIZE: Максимум записей в одной транзакции
+        WRITE_BATCH_MAX_DELAY_MS: Ожидание следующих записей после первой в мс
+            (0 - пакет составляют записи, накопившиеся за время предыдущей фиксации)
+        USER_DELETE_BATCH_SIZE: Сегментаций, удаляемых одной транзакцией
+        USER_DELETE_PAUSE: Пауза между пачками удаления в секундах
+        USER_DELETE_LEASE: Аренда выполняющегося удаления в секундах
+        SQLITE_VACUUM_PAGES: Страниц, освобождаемых incremental_vacuum после каждой пачки
+        BLOB_GC_GRACE: Отсрочка удаления освобождённых объектов хранилища в секундах
+            (больше RESULT_CACHE_TTL: кеши других процессов успевают устареть)
+        BLOB_GC_INTERVAL: Период сборки помеченных объектов в секундах
+        EXPORT_YIELD_PER: Строк, читаемых курсором выгрузки за раз
+        EXPORT_MANIFEST_SPOOL_BYTES: Размер манифеста выгрузки, после которого он пишется на диск
+        USER_CACHE_SIZE: Максимум пользователей в кеше аутентификации
+        USER_CACHE_TTL: Время жизни записи кеша аутентификации в секундах
+        RESULT_CACHE_SIZE: Максимум результатов сегментации в кеше памяти
+        RESULT_CACHE_TTL: Время жизни записи кеша результатов в секундах
+        METRICS_ENABLED: Замеры стадий, метрики запросов и /metrics
+        METRICS_TOKEN: Bearer-токен для /metrics (пусто - только для администратора)
+        PROFILE_SLOW_REQUEST_MS: Порог профилирования медленных запросов в мс (0 - выключено)
+        PROFILE_SAMPLE_INTERVAL: Период снятия стеков профилировщиком в секундах
+        PROFILE_DIR: Каталог профилей медленных запросов
     """
 
     SECRET_KEY: str = "your-secret-key-here"
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
 
+    DATABASE_URL: str = "sqlite:///./sql_app.db"
+    AUTO_MIGRATE: bool = False
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 30.0
+    SQLITE_BUSY_TIMEOUT_MS: int = 5000
+    SQLITE_MMAP_SIZE: int = 256 * 1024 * 1024
+
+    BCRYPT_ROUNDS: int = 12
+    PASSWORD_HASH_WORKERS: int = 2
+    PASSWORD_HASH_CONCURRENCY: int = 8
+    PASSWORD_HASH_RETRY_AFTER: int = 1
+
+    MAX_UPLOAD_BYTES: int = 10 * 1024 * 1024
+    UPLOAD_SPOOL_BYTES: int = 1024 * 1024
+    MAX_TILED_UPLOAD_BYTES: int = 2 * 1024 * 1024 * 1024
+
+    SEGMENTATION_EXECUTOR: str = "thread"
+    SEGMENTATION_WORKERS: int = 0
+    SEGMENTATION_QUEUE_SIZE: int = 16
+    SEGMENTATION_TIMEOUT: float = 30.0
+    SEGMENTATION_RETRY_AFTER: int = 5
+    SEGMENTATION_DEFAULT_ENGINE: str = "threshold"
+    SEGMENTATION_WORKING_MEGAPIXELS: Dict[str, float] = {}
+    SEGMENTATION_TILED_TIMEOUT: float = 600.0
+    TILE_SIZE: int = 1024
+    TILE_WORKERS: int = 0
+    BATCH_MAX_FILES: int = 500
+    BATCH_MAX_BYTES: int = 256 * 1024 * 1024
+    BATCH_CHUNK_SIZE: int = 8
+
+    BLOB_STORAGE_BACKEND: str = "local"
+    BLOB_STORAGE_PATH: str = "./blobs"
+
+    THUMBNAIL_SIZES: List[int] = [128, 256, 512]
+    THUMBNAIL_QUALITY: int = 80
+    THUMBNAIL_MAX_PIXELS: int = 16_000_000
+    DERIVATIVE_WORKERS: int = 1
+    DERIVATIVE_QUEUE_SIZE: int = 256
+
+    JOB_WORKERS: int = 2
+    JOB_USER_CONCURRENCY: int = 1
+    JOB_MAX_ACTIVE_PER_USER: int = 20
+    JOB_POLL_INTERVAL: float = 1.0
+    JOB_MAX_ATTEMPTS: int = 3
+    JOB_LEASE_MARGIN: float = 60.0
+
+    EVAL_BOUNDARY_TOLERANCE: int = 2
+    EVAL_BATCH_SIZE: int = 256
+
+    WRITE_BATCH_ENABLED: bool = True
+    WRITE_BATCH_MAX_SIZE: int = 64
+    WRITE_BATCH_MAX_DELAY_MS: float = 0.0
+
+    USER_DELETE_BATCH_SIZE: int = 500
+    USER_DELETE_PAUSE: float = 0.05
+    USER_DELETE_LEASE: float = 300.0
+    SQLITE_VACUUM_PAGES: int = 1024
+    BLOB_GC_GRACE: float = 7200.0
+    BLOB_GC_INTERVAL: float = 300.0
+
+    EXPORT_YIELD_PER: int = 500
+    EXPORT_MANIFEST_SPOOL_BYTES: int = 8 * 1024 * 1024
+
+    USER_CACHE_SIZE: int = 1024
+    USER_CACHE_TTL: float = 60.0
+    RESULT_CACHE_SIZE: int = 4096
+    RESULT_CACHE_TTL: float = 3600.0
+
+    METRICS_ENABLED: bool = True
+    METRICS_TOKEN: str = ""
+    PROFILE_SLOW_REQUEST_MS: float = 0.0
+    PROFILE_SAMPLE_INTERVAL: float = 0.005
+    PROFILE_DIR: str = "./profiles"
+
     class Config:
         """Конфигурация загрузки настроек.
 
         Attributes:
             env_file: Путь к файлу .env для загрузки переменных окружения
         """
-        env_file = ".env"
+        env_file = BASE_DIR / ".env"
 
 
 settings = Settings()
@@ -0,0 +1,98 @@
+"""Модуль работы с паролями.
+
+Содержит функции для:
+- хеширования и проверки паролей bcrypt вне цикла событий
+- ограничения числа принятых операций bcrypt с быстрым отказом при переполнении
+- прозрачного перехеширования при смене стоимости bcrypt
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+from passlib.context import CryptContext
+
+from .config import settings
+
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__rounds=settings.BCRYPT_ROUNDS
+)
+
+# Отдельный пул, чтобы всплеск входов не занимал потоки сегментации
+# и общий пул run_in_threadpool. Семафор ограничивает число принятых
+# операций: PASSWORD_HASH_WORKERS выполняются, остальные ждут потока в
+# очереди пула, а сверх PASSWORD_HASH_CONCURRENCY запрос сразу отклоняется
+_executor: Optional[ThreadPoolExecutor] = None
+_semaphore: Optional[asyncio.Semaphore] = None
+
+
+class PasswordHashBusyError(Exception):
+    """Очередь хеширования паролей заполнена, операция не принята.
+
+    Attributes:
+        retry_after: Рекомендуемая пауза перед повтором в секундах
+    """
+
+    def __init__(self, retry_after: int):
+        super().__init__("Password hashing queue is full")
+        self.retry_after = retry_after
+
+
+async def _run(func, *args):
+    global _executor, _semaphore
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.PASSWORD_HASH_WORKERS,
+            thread_name_prefix="bcrypt"
+        )
+        _semaphore = asyncio.Semaphore(
+            max(settings.PASSWORD_HASH_CONCURRENCY, settings.PASSWORD_HASH_WORKERS)
+        )
+    # Без ожидания: при свободном месте acquire не уступает цикл событий
+    if _semaphore.locked():
+        raise PasswordHashBusyError(settings.PASSWORD_HASH_RETRY_AFTER)
+    async with _semaphore:
+        return await asyncio.get_running_loop().run_in_executor(_executor, func, *args)
+
+
+async def hash_password(password: str) -> str:
+    """Хеширование пароля.
+
+    Args:
+        password: Пароль в чистом виде
+
+    Returns:
+        str: Хеш пароля
+
+    Raises:
+        PasswordHashBusyError: Если очередь хеширования заполнена
+    """
+    return await _run(pwd_context.hash, password)
+
+
+async def verify_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Проверка пароля с возможным перехешированием.
+
+    Args:
+        plain_password: Пароль в чистом виде
+        hashed_password: Хеш пароля из БД
+
+    Returns:
+        tuple: Результат проверки и новый хеш, если хеш устарел
+            (например, изменилась стоимость BCRYPT_ROUNDS), иначе None
+
+    Raises:
+        PasswordHashBusyError: Если очередь хеширования заполнена
+    """
+    return await _run(pwd_context.verify_and_update, plain_password, hashed_password)
+
+
+def shutdown():
+    """Остановка пула хеширования."""
+    global _executor, _semaphore
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+    _executor = None
+    _semaphore = None
@@ -1,16 +1,24 @@
 """Модуль для операций с базой данных (CRUD).
 
 Содержит функции для:
-- работы с пользователями
-- хеширования паролей
-- проверки учетных данных
+- работы с пользователями и их фонового удаления
+- точечного чтения и обновления сегментаций
+- постраничного чтения истории сегментаций
+- кеша результатов сегментации
+- производных изображений (миниатюр)
+- очереди заданий асинхронной обработки
+- оценок качества по эталонным маскам
+- счётчиков оценок (feedback_stats)
 """
 
-from passlib.context import CryptContext
-from sqlalchemy.orm import Session
-from . import models, schemas
+from datetime import date, datetime
+from typing import Optional, Tuple
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+from sqlalchemy import (and_, case, delete, func, insert, or_, select, tuple_,
+                        update)
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session, aliased
+from . import models, schemas
 
 
 def get_user(database_session: Session, username: str):
@@ -43,17 +51,17 @@ def get_user_by_email(database_session: Session, email: str):
     ).first()
 
 
-def create_user(database_session: Session, user: schemas.UserCreate):
+def create_user(database_session: Session, user: schemas.UserCreate, hashed_password: str):
     """Создание нового пользователя.
 
     Args:
         database_session: Сессия подключения к БД
         user: Данные для создания пользователя
+        hashed_password: Хеш пароля (см. credentials.hash_password)
 
     Returns:
         models.User: Созданный пользователь
     """
-    hashed_password = pwd_context.hash(user.password)
     db_user = models.User(
         username=user.username,
         email=user.email,
@@ -65,14 +73,1044 @@ def create_user(database_session: Session, user: schemas.UserCreate):
     return db_user
 
 
-def verify_password(plain_password: str, hashed_password: str):
-    """Проверка соответствия пароля и его хеша.
+def update_password_hash(database_session: Session, user: models.User, hashed_password: str):
+    """Замена хеша пароля пользователя.
+
+    Args:
+        database_session: Сессия подключения к БД
+        user: Пользователь
+        hashed_password: Новый хеш пароля
+    """
+    user.hashed_password = hashed_password
+    database_session.commit()
+
+
+def start_user_deletion(database_session: Session, user: models.User, token: str):
+    """Деактивация пользователя и постановка удаления его данных в очередь.
+
+    Повторный запрос возвращает незавершённое удаление; неудавшееся
+    удаление ставится в очередь заново.
+
+    Args:
+        database_session: Сессия подключения к БД
+        user: Удаляемый пользователь
+        token: Случайный токен URL состояния
+
+    Returns:
+        UserDeletion: Запись удаления
+    """
+    user.is_active = False
+    deletion = database_session.scalars(
+        select(models.UserDeletion)
+        .where(models.UserDeletion.user_id == user.id)
+        .order_by(models.UserDeletion.id.desc())
+    ).first()
+    if deletion is not None and deletion.status in (models.JOB_QUEUED, models.JOB_RUNNING):
+        database_session.commit()
+        return deletion
+    if deletion is None or deletion.status == models.JOB_DONE:
+        deletion = models.UserDeletion(
+            token=token, user_id=user.id, username=user.username, deleted=0, blobs_deleted=0
+        )
+        database_session.add(deletion)
+    deletion.status = models.JOB_QUEUED
+    deletion.error = None
+    deletion.finished_at = None
+    deletion.total = deletion.deleted + database_session.scalar(
+        select(func.count()).select_from(models.Segmentation)
+        .where(models.Segmentation.user_id == user.id)
+    )
+    database_session.commit()
+    return deletion
+
+
+def get_user_deletion(database_session: Session, token: str):
+    """Удаление пользователя по токену или None."""
+    return database_session.scalars(
+        select(models.UserDeletion).where(models.UserDeletion.token == token)
+    ).first()
+
+
+def claim_user_deletion(database_session: Session, now, lease_until):
+    """Захват удаления из очереди или с истёкшей арендой.
 
     Args:
-        plain_password: Пароль в чистом виде
-        hashed_password: Хеш пароля из БД
+        database_session: Сессия подключения к БД
+        now: Текущее время
+        lease_until: Срок аренды
 
     Returns:
-        bool: Результат проверки
+        UserDeletion: Захваченное удаление или None
     """
-    return pwd_context.verify(plain_password, hashed_password)
+    deletion = models.UserDeletion
+    candidates = database_session.scalars(
+        select(deletion.id).where(or_(
+            deletion.status == models.JOB_QUEUED,
+            and_(deletion.status == models.JOB_RUNNING, deletion.lease_expires_at < now)
+        )).order_by(deletion.id).limit(5)
+    ).all()
+    for deletion_id in candidates:
+        result = database_session.execute(
+            update(deletion)
+            .where(deletion.id == deletion_id, or_(
+                deletion.status == models.JOB_QUEUED,
+                and_(deletion.status == models.JOB_RUNNING, deletion.lease_expires_at < now)
+            ))
+            .values(status=models.JOB_RUNNING, lease_expires_at=lease_until)
+        )
+        database_session.commit()
+        if result.rowcount:
+            return database_session.get(deletion, deletion_id)
+    return None
+
+
+def delete_user_segmentations(database_session: Session, deletion_id: int, user_id: int,
+                              limit: int, lease_until) -> Tuple[int, set]:
+    """Удаление одной пачки сегментаций пользователя вместе с их оценками.
+
+    Args:
+        database_session: Сессия подключения к БД
+        deletion_id: ID записи удаления (для прогресса и продления аренды)
+        user_id: ID пользователя
+        limit: Размер пачки
+        lease_until: Новый срок аренды
+
+    Returns:
+        tuple: Количество удалённых сегментаций и хеши объектов, на которые они ссылались
+    """
+    rows = database_session.execute(
+        select(
+            models.Segmentation.id,
+            models.Segmentation.original_digest,
+            models.Segmentation.segmented_digest,
+        ).where(models.Segmentation.user_id == user_id).limit(limit)
+    ).all()
+    ids = [row.id for row in rows]
+    digests = {row.original_digest for row in rows} | {row.segmented_digest for row in rows}
+    if ids:
+        digests.update(database_session.scalars(
+            select(models.Evaluation.truth_digest)
+            .where(models.Evaluation.segmentation_id.in_(ids))
+        ))
+        database_session.execute(
+            delete(models.Evaluation).where(models.Evaluation.segmentation_id.in_(ids))
+        )
+        database_session.execute(
+            delete(models.Segmentation).where(models.Segmentation.id.in_(ids))
+        )
+    database_session.execute(
+        update(models.UserDeletion)
+        .where(models.UserDeletion.id == deletion_id)
+        .values(deleted=models.UserDeletion.deleted + len(ids), lease_expires_at=lease_until)
+    )
+    database_session.commit()
+    digests.discard(None)
+    return len(ids), digests
+
+
+def finish_user_deletion(database_session: Session, deletion_id: int, user_id: int, now) -> set:
+    """Удаление оставшихся данных и самого пользователя.
+
+    Вызывается после удаления сегментаций пачками; оставшиеся строки
+    (задания, оценки, счётчики и сегментации, созданные за время удаления)
+    удаляются одной короткой транзакцией.
+
+    Returns:
+        set: Хеши объектов, на которые ссылались удалённые строки
+    """
+    digests = set(database_session.scalars(
+        select(models.Job.input_digest).where(models.Job.user_id == user_id)
+    ))
+    digests.update(database_session.scalars(
+        select(models.Evaluation.truth_digest).where(models.Evaluation.user_id == user_id)
+    ))
+    for row in database_session.execute(
+            select(models.Segmentation.original_digest, models.Segmentation.segmented_digest)
+            .where(models.Segmentation.user_id == user_id)
+    ):
+        digests.update(row)
+    for model in (models.Job, models.Evaluation, models.FeedbackStat, models.Segmentation):
+        database_session.execute(delete(model).where(model.user_id == user_id))
+    database_session.execute(delete(models.User).where(models.User.id == user_id))
+    database_session.execute(
+        update(models.UserDeletion)
+        .where(models.UserDeletion.id == deletion_id)
+        .values(status=models.JOB_DONE, finished_at=now, lease_expires_at=None)
+    )
+    database_session.commit()
+    digests.discard(None)
+    return digests
+
+
+def fail_user_deletion(database_session: Session, deletion_id: int, error: str, now):
+    """Отметка удаления как неудавшегося (его можно запросить повторно)."""
+    database_session.execute(
+        update(models.UserDeletion)
+        .where(models.UserDeletion.id == deletion_id)
+        .values(status=models.JOB_FAILED, error=error, finished_at=now, lease_expires_at=None)
+    )
+    database_session.commit()
+
+
+def add_deleted_blobs(database_session: Session, deletion_id: int, count: int):
+    """Учёт удалённых объектов хранилища в прогрессе удаления."""
+    database_session.execute(
+        update(models.UserDeletion)
+        .where(models.UserDeletion.id == deletion_id)
+        .values(blobs_deleted=models.UserDeletion.blobs_deleted + count)
+    )
+    database_session.commit()
+
+
+# Колонки, через которые строки ссылаются на объекты хранилища
+BLOB_REFERENCES = (
+    models.Segmentation.original_digest,
+    models.Segmentation.segmented_digest,
+    models.Evaluation.truth_digest,
+    models.Job.input_digest,
+    models.SegmentationResult.result_digest,
+    models.Derivative.digest,
+)
+
+
+def _referenced(database_session: Session, digests: set, columns=BLOB_REFERENCES) -> set:
+    found = set()
+    candidates = list(digests)
+    for column in columns:
+        found.update(database_session.scalars(
+            select(column).where(column.in_(candidates)).distinct()
+        ))
+    return found
+
+
+def referenced_blobs(database_session: Session, digests: set) -> set:
+    """Хеши объектов хранилища, на которые ссылается хотя бы одна строка."""
+    if not digests:
+        return set()
+    return _referenced(database_session, set(digests))
+
+
+def release_blobs(database_session: Session, digests: set) -> Tuple[list, set]:
+    """Освобождение объектов хранилища, на которые больше никто не ссылается.
+
+    Объекты адресуются содержимым и могут быть общими у разных
+    пользователей, поэтому освобождаются только те, на которые не ссылается
+    ни одна строка. Вместе с ними удаляются запомненные результаты для
+    входов, которых больше нет, и миниатюры освобождённых объектов.
+    Сами объекты здесь не удаляются: их помечают к удалению, а сборка
+    удаляет их после отсрочки, ещё раз проверив ссылки (referenced_blobs).
+
+    Args:
+        database_session: Сессия подключения к БД
+        digests: Хеши объектов, на которые ссылались удалённые строки
+
+    Returns:
+        tuple: Хеши объектов для пометки к удалению и хеши входов,
+        чьи запомненные результаты удалены
+    """
+    if not digests:
+        return [], set()
+
+    orphan_inputs = digests - _referenced(
+        database_session, digests, (models.Segmentation.original_digest, models.Job.input_digest)
+    )
+    candidates = set(digests)
+    if orphan_inputs:
+        candidates.update(database_session.scalars(
+            select(models.SegmentationResult.result_digest)
+            .where(models.SegmentationResult.input_digest.in_(orphan_inputs))
+        ))
+        database_session.execute(
+            delete(models.SegmentationResult)
+            .where(models.SegmentationResult.input_digest.in_(orphan_inputs))
+        )
+
+    free = candidates - _referenced(database_session, candidates)
+    if free:
+        thumbnails = set(database_session.scalars(
+            select(models.Derivative.digest).where(models.Derivative.source_digest.in_(free))
+        ))
+        database_session.execute(
+            delete(models.Derivative).where(models.Derivative.source_digest.in_(free))
+        )
+        # Одинаковые миниатюры (например, пустых масок) бывают у разных объектов
+        free |= thumbnails - _referenced(database_session, thumbnails)
+    database_session.commit()
+    return sorted(free), orphan_inputs
+
+
+# Колонки ссылки на изображение для каждого вида изображения
+IMAGE_COLUMNS = {
+    "original": (
+        models.Segmentation.original_digest.label("digest"),
+        models.Segmentation.original_media_type.label("media_type"),
+    ),
+    "segmented": (
+        models.Segmentation.segmented_digest.label("digest"),
+        models.Segmentation.segmented_media_type.label("media_type"),
+    ),
+}
+
+
+def get_image_ref(database_session: Session, segmentation_id: int, kind: str):
+    """Получение ссылки на одно изображение сегментации.
+
+    Читаются только хеш и медиатип нужного изображения,
+    сущность Segmentation целиком не загружается.
+
+    Args:
+        database_session: Сессия подключения к БД
+        segmentation_id: ID сегментации
+        kind: Вид изображения - "original" или "segmented"
+
+    Returns:
+        Row: Строка с полями digest и media_type или None
+    """
+    return database_session.execute(
+        select(*IMAGE_COLUMNS[kind]).where(
+            models.Segmentation.id == segmentation_id
+        )
+    ).first()
+
+
+# Колонки истории сегментаций: метаданные без содержимого изображений
+HISTORY_COLUMNS = (
+    models.Segmentation.id,
+    models.Segmentation.user_id,
+    models.Segmentation.created_at,
+    models.Segmentation.is_good,
+    models.Segmentation.engine,
+    models.Segmentation.engine_version,
+    models.Segmentation.original_digest,
+    models.Segmentation.original_size,
+    models.Segmentation.original_media_type,
+    models.Segmentation.segmented_digest,
+)
+
+# Значение is_good для фильтра истории по оценке
+FEEDBACK_FILTERS = {"good": True, "bad": False, "unrated": None}
+
+
+def list_segmentations(
+        database_session: Session,
+        user_id: int,
+        limit: int,
+        after: Optional[Tuple[datetime, int]] = None,
+        feedback: Optional[str] = None,
+        created_from: Optional[datetime] = None,
+        created_to: Optional[datetime] = None
+) -> list:
+    """Страница истории сегментаций пользователя от новых к старым.
+
+    Пагинация по ключу (created_at, id): следующая страница начинается
+    строго после последней строки предыдущей, поэтому стоимость запроса
+    не зависит от глубины страницы и размера истории (поиск по индексу
+    ix_segmentations_user_created или, с фильтром по оценке,
+    ix_segmentations_user_feedback).
+
+    Args:
+        database_session: Сессия подключения к БД
+        user_id: ID владельца
+        limit: Размер страницы
+        after: (created_at, id) последней строки предыдущей страницы
+        feedback: Фильтр по оценке - "good", "bad" или "unrated"
+        created_from: Нижняя граница даты создания (включительно)
+        created_to: Верхняя граница даты создания (не включительно)
+
+    Returns:
+        list: Строки с колонками HISTORY_COLUMNS
+    """
+    segmentation = models.Segmentation
+    statement = select(*HISTORY_COLUMNS).where(segmentation.user_id == user_id)
+    if feedback is not None:
+        statement = statement.where(segmentation.is_good.is_(FEEDBACK_FILTERS[feedback]))
+    if created_from is not None:
+        statement = statement.where(segmentation.created_at >= created_from)
+    if created_to is not None:
+        statement = statement.where(segmentation.created_at < created_to)
+    if after is not None:
+        statement = statement.where(
+            tuple_(segmentation.created_at, segmentation.id) < tuple_(*after)
+        )
+    statement = statement.order_by(
+        segmentation.created_at.desc(), segmentation.id.desc()
+    ).limit(limit)
+    return database_session.execute(statement).all()
+
+
+# Колонки выгрузки набора данных
+EXPORT_COLUMNS = (
+    models.Segmentation.id,
+    models.Segmentation.user_id,
+    models.User.username,
+    models.Segmentation.created_at,
+    models.Segmentation.is_good,
+    models.Segmentation.engine,
+    models.Segmentation.engine_version,
+    models.Segmentation.engine_params,
+    models.Segmentation.original_digest,
+    models.Segmentation.original_media_type,
+    models.Segmentation.segmented_digest,
+    models.Segmentation.segmented_media_type,
+)
+
+
+def export_segmentations(
+        database_session: Session,
+        user_id: Optional[int],
+        after: Optional[int] = None,
+        limit: Optional[int] = None,
+        feedback: Optional[str] = None,
+        engine: Optional[str] = None,
+        created_from: Optional[datetime] = None,
+        created_to: Optional[datetime] = None,
+        yield_per: int = 500
+):
+    """Потоковое чтение сегментаций для выгрузки по возрастанию ID.
+
+    Строки читаются серверным курсором пачками по yield_per, поэтому
+    память не зависит от количества строк.
+
+    Args:
+        database_session: Сессия подключения к БД
+        user_id: ID владельца или None - все пользователи
+        after: Продолжить после сегментации с этим ID
+        limit: Максимум строк
+        feedback: "good", "bad", "unrated" или "rated" (с любой оценкой)
+        engine: Имя движка
+        created_from: Нижняя граница даты создания (включительно)
+        created_to: Верхняя граница даты создания (не включительно)
+        yield_per: Размер пачки курсора
+
+    Returns:
+        Result: Итератор строк с колонками EXPORT_COLUMNS
+    """
+    segmentation = models.Segmentation
+    statement = select(*EXPORT_COLUMNS).join(models.User, models.User.id == segmentation.user_id)
+    if user_id is not None:
+        statement = statement.where(segmentation.user_id == user_id)
+    if feedback == "rated":
+        statement = statement.where(segmentation.is_good.is_not(None))
+    elif feedback is not None:
+        statement = statement.where(segmentation.is_good.is_(FEEDBACK_FILTERS[feedback]))
+    if engine is not None:
+        statement = statement.where(segmentation.engine == engine)
+    if created_from is not None:
+        statement = statement.where(segmentation.created_at >= created_from)
+    if created_to is not None:
+        statement = statement.where(segmentation.created_at < created_to)
+    if after is not None:
+        statement = statement.where(segmentation.id > after)
+    statement = statement.order_by(segmentation.id)
+    if limit is not None:
+        statement = statement.limit(limit)
+    return database_session.execute(
+        statement, execution_options={"yield_per": yield_per, "stream_results": True}
+    )
+
+
+def set_feedback(database_session: Session, segmentation_id: int, is_good: bool):
+    """Сохранение оценки сегментации и обновление счётчиков в одной транзакции.
+
+    Args:
+        database_session: Сессия подключения к БД
+        segmentation_id: ID сегментации
+        is_good: Оценка качества
+
+    Returns:
+        bool: True, если сегментация найдена и обновлена
+    """
+    updated = update_feedback(database_session, segmentation_id, is_good)
+    database_session.commit()
+    return updated
+
+
+def update_feedback(database_session: Session, segmentation_id: int, is_good: bool,
+                    stats: Optional[dict] = None) -> bool:
+    """Изменение оценки сегментации и счётчиков без фиксации транзакции.
+
+    Оценка меняется условным UPDATE (только если прежнее значение не
+    изменилось с момента чтения), поэтому одновременные оценки одной
+    сегментации не искажают счётчики feedback_stats.
+
+    Args:
+        database_session: Сессия подключения к БД
+        segmentation_id: ID сегментации
+        is_good: Оценка качества
+        stats: Накопитель приращений счётчиков (см. add_feedback_deltas);
+            без него счётчики обновляются сразу
+
+    Returns:
+        bool: True, если сегментация найдена и обновлена
+    """
+    while True:
+        row = database_session.execute(
+            select(
+                models.Segmentation.user_id,
+                models.Segmentation.engine,
+                models.Segmentation.created_at,
+                models.Segmentation.is_good,
+            ).where(models.Segmentation.id == segmentation_id)
+        ).first()
+        if row is None:
+            return False
+        result = database_session.execute(
+            update(models.Segmentation)
+            .where(
+                models.Segmentation.id == segmentation_id,
+                models.Segmentation.is_good.is_(row.is_good)
+            )
+            .values(is_good=is_good)
+        )
+        if result.rowcount > 0:
+            break
+
+    good = int(is_good is True) - int(row.is_good is True)
+    bad = int(is_good is False) - int(row.is_good is False)
+    if stats is not None:
+        _add_delta(stats, (row.user_id, row.created_at.date(), row.engine), good=good, bad=bad)
+    elif good or bad:
+        add_feedback_stats(
+            database_session, row.user_id, row.created_at.date(), row.engine,
+            good=good, bad=bad
+        )
+    return True
+
+
+def insert_ignore(database_session: Session, table, values: dict):
+    """INSERT, который молча пропускает конфликт уникальности.
+
+    Args:
+        database_session: Сессия подключения к БД
+        table: Таблица SQLAlchemy
+        values: Значения колонок
+    """
+    dialect = database_session.get_bind().dialect.name
+    if dialect == "sqlite":
+        statement = sqlite.insert(table).values(**values).on_conflict_do_nothing()
+    elif dialect == "postgresql":
+        statement = postgresql.insert(table).values(**values).on_conflict_do_nothing()
+    else:
+        statement = insert(table).prefix_with("IGNORE").values(**values)
+    database_session.execute(statement)
+
+
+def get_cached_result(database_session: Session, input_digest: str, params_key: str):
+    """Поиск запомненного результата сегментации.
+
+    Args:
+        database_session: Сессия подключения к БД
+        input_digest: SHA-256 входного изображения
+        params_key: Ключ алгоритма и параметров
+
+    Returns:
+        Row: Строка с полями result_digest, result_size, result_media_type или None
+    """
+    result = models.SegmentationResult
+    return database_session.execute(
+        select(result.result_digest, result.result_size, result.result_media_type)
+        .where(result.input_digest == input_digest, result.params_key == params_key)
+    ).first()
+
+
+def add_cached_result(database_session: Session, input_digest: str, params_key: str,
+                      result_digest: str, result_size: int, result_media_type: str):
+    """Запоминание результата сегментации без фиксации транзакции.
+
+    Параллельная запись того же результата не считается ошибкой.
+
+    Args:
+        database_session: Сессия подключения к БД
+        input_digest: SHA-256 входного изображения
+        params_key: Ключ алгоритма и параметров
+        result_digest: SHA-256 результата
+        result_size: Размер результата в байтах
+        result_media_type: Медиатип результата
+    """
+    insert_ignore(database_session, models.SegmentationResult.__table__, {
+        "input_digest": input_digest,
+        "params_key": params_key,
+        "result_digest": result_digest,
+        "result_size": result_size,
+        "result_media_type": result_media_type,
+    })
+
+
+def bulk_create_segmentations(database_session: Session, rows: list,
+                              cached_results: list) -> list:
+    """Запись пакета сегментаций, их результатов и счётчиков одной транзакцией.
+
+    Строки вставляются одним INSERT ... RETURNING с несколькими наборами
+    параметров, поэтому ID возвращаются в порядке rows.
+
+    Args:
+        database_session: Сессия подключения к БД
+        rows: Значения столбцов Segmentation
+        cached_results: Аргументы add_cached_result для новых результатов
+
+    Returns:
+        list: ID созданных сегментаций в порядке rows
+    """
+    stats = {}
+    ids = insert_segmentations(database_session, rows, cached_results, stats)
+    add_feedback_deltas(database_session, stats)
+    database_session.commit()
+    return ids
+
+
+def insert_segmentations(database_session: Session, rows: list, cached_results: list,
+                         stats: dict) -> list:
+    """Вставка сегментаций и их результатов без фиксации транзакции.
+
+    Args:
+        database_session: Сессия подключения к БД
+        rows: Значения столбцов Segmentation
+        cached_results: Аргументы add_cached_result для новых результатов
+        stats: Накопитель приращений счётчиков (см. add_feedback_deltas)
+
+    Returns:
+        list: ID созданных сегментаций в порядке rows
+    """
+    ids = []
+    if rows:
+        ids = database_session.scalars(
+            insert(models.Segmentation).returning(
+                models.Segmentation.id, sort_by_parameter_order=True
+            ),
+            rows
+        ).all()
+    for row in rows:
+        _add_delta(stats, (row["user_id"], row["created_at"].date(), row["engine"]), total=1)
+    for values in cached_results:
+        add_cached_result(database_session, *values)
+    return list(ids)
+
+
+def apply_write_batch(database_session: Session, rows: list, cached_results: list,
+                      feedback: list) -> Tuple[list, list]:
+    """Сегментации и оценки нескольких запросов одной транзакцией (групповая фиксация).
+
+    Сегментации вставляются раньше оценок, так что оценка сегментации
+    из того же пакета находит её строку; приращения счётчиков
+    feedback_stats складываются и записываются по строке на счётчик.
+
+    Args:
+        database_session: Сессия подключения к БД
+        rows: Значения столбцов Segmentation
+        cached_results: Аргументы add_cached_result для новых результатов
+        feedback: Пары (ID сегментации, оценка) в порядке поступления
+
+    Returns:
+        tuple: ID созданных сегментаций в порядке rows и признаки
+        обновления оценок в порядке feedback
+    """
+    stats = {}
+    ids = insert_segmentations(database_session, rows, cached_results, stats)
+    updated = [
+        update_feedback(database_session, segmentation_id, is_good, stats)
+        for segmentation_id, is_good in feedback
+    ]
+    add_feedback_deltas(database_session, stats)
+    database_session.commit()
+    return ids, updated
+
+
+def get_derivative(database_session: Session, source_digest: str, size: int):
+    """Поиск миниатюры объекта.
+
+    Args:
+        database_session: Сессия подключения к БД
+        source_digest: SHA-256 исходного объекта
+        size: Наибольшая сторона миниатюры
+
+    Returns:
+        Row: Строка с полями digest и media_type или None
+    """
+    derivative = models.Derivative
+    return database_session.execute(
+        select(derivative.digest, derivative.media_type)
+        .where(derivative.source_digest == source_digest, derivative.size == size)
+    ).first()
+
+
+def count_derivatives(database_session: Session, source_digest: str) -> int:
+    """Количество готовых миниатюр объекта."""
+    derivative = models.Derivative
+    return database_session.execute(
+        select(func.count()).select_from(derivative)
+        .where(derivative.source_digest == source_digest)
+    ).scalar_one()
+
+
+def add_derivatives(database_session: Session, source_digest: str, renditions):
+    """Запись миниатюр объекта с фиксацией транзакции.
+
+    Уже записанные параллельно миниатюры пропускаются.
+
+    Args:
+        database_session: Сессия подключения к БД
+        source_digest: SHA-256 исходного объекта
+        renditions: Миниатюры с полями size, digest, byte_size,
+            media_type, width, height
+    """
+    for rendition in renditions:
+        insert_ignore(database_session, models.Derivative.__table__, {
+            "source_digest": source_digest,
+            "size": rendition.size,
+            "digest": rendition.digest,
+            "byte_size": rendition.byte_size,
+            "media_type": rendition.media_type,
+            "width": rendition.width,
+            "height": rendition.height,
+        })
+    database_session.commit()
+
+
+def create_job(database_session: Session, user_id: int, input_digest: str,
+               input_media_type: str, engine: str, engine_params: str,
+               tiled: bool) -> models.Job:
+    """Постановка задания сегментации в очередь.
+
+    Args:
+        database_session: Сессия подключения к БД
+        user_id: ID владельца
+        input_digest: SHA-256 оригинала, уже сохранённого в хранилище
+        input_media_type: Медиатип оригинала
+        engine: Имя движка сегментации
+        engine_params: Параметры движка (JSON)
+        tiled: Потайловая обработка
+
+    Returns:
+        models.Job: Созданное задание
+    """
+    job = models.Job(
+        user_id=user_id,
+        status=models.JOB_QUEUED,
+        input_digest=input_digest,
+        input_media_type=input_media_type,
+        engine=engine,
+        engine_params=engine_params,
+        tiled=tiled,
+        attempts=0
+    )
+    database_session.add(job)
+    database_session.commit()
+    return job
+
+
+def get_job(database_session: Session, job_id: int):
+    """Получение задания по ID."""
+    return database_session.get(models.Job, job_id)
+
+
+def count_active_jobs(database_session: Session, user_id: int) -> int:
+    """Количество незавершённых заданий пользователя."""
+    job = models.Job
+    return database_session.execute(
+        select(func.count()).select_from(job).where(
+            job.user_id == user_id,
+            job.status.in_((models.JOB_QUEUED, models.JOB_RUNNING))
+        )
+    ).scalar_one()
+
+
+def _claimable(now):
+    job = models.Job
+    return or_(
+        job.status == models.JOB_QUEUED,
+        and_(job.status == models.JOB_RUNNING, job.lease_expires_at < now)
+    )
+
+
+def claim_job(database_session: Session, now, lease_for, user_concurrency: int):
+    """Взятие следующего задания в работу.
+
+    Пропускаются задания пользователей, у которых уже выполняется
+    user_concurrency заданий. Взятие - условный UPDATE, повторяющий обе
+    проверки (задание свободно, лимит пользователя не исчерпан), поэтому
+    одно задание не достанется двум воркерам, а воркер, выбравший
+    кандидатов до чужого взятия, не превысит лимит пользователя.
+
+    Args:
+        database_session: Сессия подключения к БД
+        now: Текущее время (UTC)
+        lease_for: Функция, возвращающая срок аренды для задания
+        user_concurrency: Максимум выполняющихся заданий одного пользователя
+
+    Returns:
+        models.Job: Взятое задание или None
+    """
+    job = models.Job
+    running = aliased(models.Job)
+    busy = (
+        select(func.count()).select_from(running).where(
+            running.user_id == job.user_id,
+            running.status == models.JOB_RUNNING,
+            running.lease_expires_at >= now
+        ).scalar_subquery()
+    )
+    candidates = database_session.execute(
+        select(job.id, job.tiled)
+        .where(_claimable(now), busy < user_concurrency)
+        .order_by(job.id)
+        .limit(16)
+    ).all()
+    for candidate in candidates:
+        claimed = database_session.execute(
+            update(job)
+            .where(job.id == candidate.id, _claimable(now), busy < user_concurrency)
+            .values(
+                status=models.JOB_RUNNING,
+                attempts=job.attempts + 1,
+                started_at=now,
+                lease_expires_at=lease_for(candidate)
+            )
+        ).rowcount
+        database_session.commit()
+        if claimed:
+            return database_session.get(models.Job, candidate.id)
+    return None
+
+
+def finish_job(database_session: Session, job_id: int, status: str, now,
+               segmentation_id=None, cached=None, error=None):
+    """Завершение или возврат задания в очередь.
+
+    Args:
+        database_session: Сессия подключения к БД
+        job_id: ID задания
+        status: Новое состояние (done, failed или queued)
+        now: Текущее время (UTC)
+        segmentation_id: ID созданной сегментации
+        cached: Результат взят из кеша
+        error: Текст ошибки
+    """
+    database_session.execute(
+        update(models.Job)
+        .where(models.Job.id == job_id)
+        .values(
+            status=status,
+            segmentation_id=segmentation_id,
+            cached=cached,
+            error=error,
+            lease_expires_at=None,
+            finished_at=None if status == models.JOB_QUEUED else now
+        )
+    )
+    database_session.commit()
+
+
+def get_segmented_refs(database_session: Session, user_id: int, segmentation_ids: list) -> dict:
+    """Хеши результатов сегментаций пользователя.
+
+    Args:
+        database_session: Сессия подключения к БД
+        user_id: ID владельца
+        segmentation_ids: ID сегментаций
+
+    Returns:
+        dict: ID сегментации -> SHA-256 результата (чужие и несуществующие пропускаются)
+    """
+    rows = database_session.execute(
+        select(models.Segmentation.id, models.Segmentation.segmented_digest).where(
+            models.Segmentation.user_id == user_id,
+            models.Segmentation.id.in_(segmentation_ids)
+        )
+    )
+    return {row.id: row.segmented_digest for row in rows}
+
+
+def save_evaluations(database_session: Session, rows: list):
+    """Запись оценок одной транзакцией с заменой прежних оценок тех же сегментаций.
+
+    Args:
+        database_session: Сессия подключения к БД
+        rows: Значения столбцов Evaluation
+    """
+    if not rows:
+        return
+    database_session.execute(
+        delete(models.Evaluation).where(
+            models.Evaluation.segmentation_id.in_([row["segmentation_id"] for row in rows])
+        )
+    )
+    database_session.execute(insert(models.Evaluation), rows)
+    database_session.commit()
+
+
+def get_evaluation(database_session: Session, segmentation_id: int, user_id: int):
+    """Оценка сегментации пользователя или None."""
+    return database_session.scalars(
+        select(models.Evaluation).where(
+            models.Evaluation.segmentation_id == segmentation_id,
+            models.Evaluation.user_id == user_id
+        )
+    ).first()
+
+
+def evaluation_summary(database_session: Session, user_id: int,
+                       engine: Optional[str] = None) -> list:
+    """Сводка оценок пользователя по движкам и их версиям.
+
+    Args:
+        database_session: Сессия подключения к БД
+        user_id: ID владельца
+        engine: Ограничить сводку одним движком
+
+    Returns:
+        list: Строки с полями engine, engine_version, count и
+        mean_/min_/max_ для каждой метрики
+    """
+    columns = [
+        models.Segmentation.engine,
+        models.Segmentation.engine_version,
+        func.count(models.Evaluation.id).label("count"),
+    ]
+    for metric in models.EVALUATION_METRICS:
+        column = getattr(models.Evaluation, metric)
+        columns += [
+            func.avg(column).label(f"mean_{metric}"),
+            func.min(column).label(f"min_{metric}"),
+            func.max(column).label(f"max_{metric}"),
+        ]
+    statement = (
+        select(*columns)
+        .join(models.Segmentation, models.Segmentation.id == models.Evaluation.segmentation_id)
+        .where(models.Evaluation.user_id == user_id)
+        .group_by(models.Segmentation.engine, models.Segmentation.engine_version)
+        .order_by(models.Segmentation.engine, models.Segmentation.engine_version)
+    )
+    if engine:
+        statement = statement.where(models.Segmentation.engine == engine)
+    return database_session.execute(statement).all()
+
+
+def add_feedback_stats(database_session: Session, user_id: int, day: date,
+                       engine: Optional[str], total: int = 0, good: int = 0, bad: int = 0):
+    """Приращение счётчиков feedback_stats без фиксации транзакции.
+
+    Строка счётчиков создаётся при первом обращении; в SQLite и
+    PostgreSQL приращение выполняется одним INSERT ... ON CONFLICT.
+
+    Args:
+        database_session: Сессия подключения к БД
+        user_id: ID владельца сегментаций
+        day: День создания сегментаций
+        engine: Движок сегментации
+        total: Приращение числа сегментаций
+        good: Приращение числа хороших оценок
+        bad: Приращение числа плохих оценок
+    """
+    table = models.FeedbackStat.__table__
+    deltas = {"total": total, "good": good, "bad": bad}
+    key = {"user_id": user_id, "day": day, "engine": engine or ""}
+    dialect = database_session.get_bind().dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        dialect_module = sqlite if dialect == "sqlite" else postgresql
+        statement = dialect_module.insert(table).values(**key, **deltas)
+        database_session.execute(statement.on_conflict_do_update(
+            index_elements=list(key),
+            set_={name: table.c[name] + statement.excluded[name] for name in deltas}
+        ))
+        return
+
+    result = database_session.execute(
+        update(table)
+        .where(*(table.c[name] == value for name, value in key.items()))
+        .values({name: table.c[name] + value for name, value in deltas.items()})
+    )
+    if result.rowcount == 0:
+        database_session.execute(insert(table).values(**key, **deltas))
+
+
+def _add_delta(stats: dict, bucket: tuple, total: int = 0, good: int = 0, bad: int = 0):
+    delta = stats.setdefault(bucket, [0, 0, 0])
+    delta[0] += total
+    delta[1] += good
+    delta[2] += bad
+
+
+def add_feedback_deltas(database_session: Session, stats: dict):
+    """Запись накопленных приращений feedback_stats без фиксации транзакции.
+
+    Args:
+        database_session: Сессия подключения к БД
+        stats: Приращения {(user_id, день, движок): [total, good, bad]}
+    """
+    for (user_id, day, engine), (total, good, bad) in stats.items():
+        if total or good or bad:
+            add_feedback_stats(database_session, user_id, day, engine,
+                               total=total, good=good, bad=bad)
+
+
+def _stat_columns():
+    stat = models.FeedbackStat
+    return (
+        func.sum(stat.total).label("total"),
+        func.sum(stat.good).label("good"),
+        func.sum(stat.bad).label("bad"),
+    )
+
+
+def feedback_stats(database_session: Session, user_id: Optional[int], since: date) -> dict:
+    """Статистика оценок из счётчиков feedback_stats.
+
+    Читаются только строки счётчиков (не больше дней x движков на
+    пользователя), таблица segmentations не просматривается.
+
+    Args:
+        database_session: Сессия подключения к БД
+        user_id: ID пользователя или None - по всем пользователям
+        since: Первый день разбивки по дням
+
+    Returns:
+        dict: Списки строк by_engine, by_day и (для всех пользователей) by_user
+        с полями total, good и bad
+    """
+    stat = models.FeedbackStat
+    scope = [stat.user_id == user_id] if user_id is not None else []
+
+    def grouped(*columns, where=()):
+        return database_session.execute(
+            select(*columns, *_stat_columns())
+            .where(*scope, *where)
+            .group_by(*columns)
+            .order_by(*columns)
+        ).all()
+
+    result = {
+        "by_engine": grouped(stat.engine),
+        "by_day": grouped(stat.day, where=[stat.day >= since]),
+    }
+    if user_id is None:
+        result["by_user"] = grouped(stat.user_id)
+    return result
+
+
+def rebuild_feedback_stats(database_session: Session) -> int:
+    """Пересчёт feedback_stats по всей таблице segmentations.
+
+    Нужен один раз для истории, накопленной до появления счётчиков
+    (см. migrate), и для сверки.
+
+    Returns:
+        int: Количество строк счётчиков
+    """
+    segmentation = models.Segmentation
+    day = func.date(segmentation.created_at)
+    engine = func.coalesce(segmentation.engine, "")
+    database_session.execute(delete(models.FeedbackStat))
+    database_session.execute(
+        insert(models.FeedbackStat).from_select(
+            ["user_id", "day", "engine", "total", "good", "bad"],
+            select(
+                segmentation.user_id, day, engine, func.count(),
+                func.sum(case((segmentation.is_good.is_(True), 1), else_=0)),
+                func.sum(case((segmentation.is_good.is_(False), 1), else_=0)),
+            )
+            .where(segmentation.user_id.is_not(None))
+            .group_by(segmentation.user_id, day, engine)
+        )
+    )
+    database_session.commit()
+    return database_session.scalar(select(func.count()).select_from(models.FeedbackStat))
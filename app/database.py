@@ -1,37 +1,136 @@
 """Модуль для работы с базой данных.
 
 Содержит:
-- Настройку подключения к БД
+- Настройку подключения к БД (синхронного и асинхронного)
+- Настройку SQLite: WAL, busy_timeout, synchronous и mmap
 - Базовую модель SQLAlchemy
-- Фабрику сессий
-- Генератор сессий для зависимостей
+- Фабрики сессий
+- Генератор асинхронных сессий для зависимостей
 """
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./sql_app.db"
+from .config import project_path, settings
 
+# Асинхронные драйверы для синхронных схем URL
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+
+
+def async_database_url(url: str) -> str:
+    """Преобразование URL БД к асинхронному драйверу.
+
+    Args:
+        url: URL вида sqlite:///... или postgresql://...
+
+    Returns:
+        str: URL с драйвером aiosqlite/asyncpg (явно указанный драйвер сохраняется)
+    """
+    scheme, separator, rest = url.partition("://")
+    return f"{ASYNC_DRIVERS.get(scheme, scheme)}{separator}{rest}"
+
+
+def _is_sqlite(url: str) -> bool:
+    return url.startswith("sqlite")
+
+
+def resolve_sqlite_path(url: str) -> str:
+    """Перевод относительного пути файла SQLite в абсолютный от корня проекта.
+
+    Args:
+        url: URL БД
+
+    Returns:
+        str: URL с абсолютным путём (прочие URL и :memory: не меняются)
+    """
+    if not _is_sqlite(url):
+        return url
+    parsed = make_url(url)
+    database = parsed.database
+    if not database or database == ":memory:" or database.startswith("file:"):
+        return url
+    return parsed.set(database=str(project_path(database))).render_as_string(hide_password=False)
+
+
+SQLALCHEMY_DATABASE_URL = resolve_sqlite_path(settings.DATABASE_URL)
+
+
+def _engine_options(url: str) -> dict:
+    if _is_sqlite(url) and ":memory:" in url:
+        return {}
+    options = {
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+    }
+    if not _is_sqlite(url):
+        options["pool_pre_ping"] = True
+    return options
+
+
+def _set_sqlite_pragmas(dbapi_connection, _connection_record):
+    """Настройка каждого нового подключения SQLite.
+
+    WAL позволяет читателям не ждать писателя, synchronous=NORMAL
+    убирает fsync на каждый коммит (в режиме WAL это безопасно для
+    целостности), busy_timeout заставляет ждать блокировку вместо
+    немедленной ошибки "database is locked". auto_vacuum=INCREMENTAL
+    действует для новой БД (существующую переводит migrate) и позволяет
+    возвращать место после удалений небольшими шагами.
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA busy_timeout={int(settings.SQLITE_BUSY_TIMEOUT_MS)}")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA mmap_size={int(settings.SQLITE_MMAP_SIZE)}")
+    cursor.close()
+
+
+# Синхронный движок: миграции, скрипты и бенчмарки
 engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+    SQLALCHEMY_DATABASE_URL,
+    connect_args={"check_same_thread": False} if _is_sqlite(SQLALCHEMY_DATABASE_URL) else {},
+    **_engine_options(SQLALCHEMY_DATABASE_URL)
 )
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Асинхронный движок: обработчики запросов
+async_engine = create_async_engine(
+    async_database_url(SQLALCHEMY_DATABASE_URL),
+    **_engine_options(SQLALCHEMY_DATABASE_URL)
+)
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine,
+    autoflush=False,
+    expire_on_commit=False
+)
+
+if _is_sqlite(SQLALCHEMY_DATABASE_URL):
+    event.listen(engine, "connect", _set_sqlite_pragmas)
+    event.listen(async_engine.sync_engine, "connect", _set_sqlite_pragmas)
+
 Base = declarative_base()
 
+
 # Функция для получения сессии
-def get_db():
-    """Генератор сессий базы данных.
+async def get_db():
+    """Генератор асинхронных сессий базы данных.
+
+    Синхронные функции crud вызываются через ``await session.run_sync(...)``:
+    первым аргументом они получают синхронный фасад этой же сессии.
 
     Yields:
-        Session: Сессия SQLAlchemy
+        AsyncSession: Асинхронная сессия SQLAlchemy
 
     Ensures:
         Сессия будет корректно закрыта после использования
     """
-    db_session = SessionLocal()
-    try:
+    async with AsyncSessionLocal() as db_session:
         yield db_session
-    finally:
-        db_session.close()
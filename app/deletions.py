@@ -0,0 +1,224 @@
+"""Модуль фонового удаления пользователей.
+
+Содержит:
+- Деактивацию пользователя и постановку удаления в очередь
+- Воркер, удаляющий сегментации небольшими пачками с паузами между ними
+- Сборку мусора в хранилище объектов и возврат места SQLite (incremental_vacuum)
+"""
+
+import asyncio
+import logging
+import secrets
+import time
+from datetime import timedelta
+from typing import Optional
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import crud, models
+from .config import settings
+from .database import AsyncSessionLocal, async_engine
+from .jobs import utcnow
+from .pipeline import result_cache
+from .storage import blob_store
+
+logger = logging.getLogger(__name__)
+
+
+class UserDeletionRunner:
+    """Воркер фонового удаления пользователей.
+
+    Каждая пачка удаляется своей короткой транзакцией, между пачками
+    воркер уступает цикл событий и блокировку записи SQLite, поэтому
+    удаление тяжёлого пользователя не останавливает загрузки других.
+    Прерванное удаление продолжается после истечения аренды.
+
+    Освободившиеся объекты хранилища только помечаются к удалению: между
+    проверкой ссылок и удалением файла та же картинка может быть загружена
+    снова, а кеши результатов других процессов ещё ссылаются на неё.
+    Помеченные объекты старше ``gc_grace`` удаляются сборкой (sweep_blobs)
+    после повторной проверки ссылок.
+
+    Attributes:
+        batch_size: Сегментаций в одной транзакции
+        pause: Пауза между пачками в секундах
+        lease: Аренда выполняющегося удаления в секундах
+        vacuum_pages: Страниц SQLite, освобождаемых после каждой пачки
+        poll_interval: Период опроса очереди в секундах
+        gc_grace: Отсрочка удаления помеченных объектов в секундах
+        gc_interval: Период сборки помеченных объектов в секундах
+    """
+
+    def __init__(self, batch_size: int = 500, pause: float = 0.05, lease: float = 300.0,
+                 vacuum_pages: int = 1024, poll_interval: float = 1.0,
+                 gc_grace: float = 7200.0, gc_interval: float = 300.0):
+        self.batch_size = batch_size
+        self.pause = pause
+        self.lease = lease
+        self.vacuum_pages = vacuum_pages
+        self.poll_interval = poll_interval
+        self.gc_grace = gc_grace
+        self.gc_interval = gc_interval
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._next_sweep = 0.0
+
+    @classmethod
+    def from_settings(cls) -> "UserDeletionRunner":
+        """Создание воркера по настройкам приложения."""
+        return cls(
+            batch_size=settings.USER_DELETE_BATCH_SIZE,
+            pause=settings.USER_DELETE_PAUSE,
+            lease=settings.USER_DELETE_LEASE,
+            vacuum_pages=settings.SQLITE_VACUUM_PAGES,
+            poll_interval=settings.JOB_POLL_INTERVAL,
+            gc_grace=settings.BLOB_GC_GRACE,
+            gc_interval=settings.BLOB_GC_INTERVAL
+        )
+
+    def start(self):
+        """Запуск воркера в текущем цикле событий."""
+        if self._task is not None:
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._worker())
+
+    async def shutdown(self):
+        """Остановка воркера; прерванное удаление продолжится после истечения аренды."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def request(self, database_session: AsyncSession,
+                      user: models.User) -> models.UserDeletion:
+        """Деактивация пользователя и постановка удаления в очередь."""
+        deletion = await database_session.run_sync(
+            crud.start_user_deletion, user, secrets.token_urlsafe(32)
+        )
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return deletion
+
+    def _lease_until(self):
+        return utcnow() + timedelta(seconds=self.lease)
+
+    async def _worker(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                async with AsyncSessionLocal() as database_session:
+                    deletion = await database_session.run_sync(
+                        crud.claim_user_deletion, utcnow(), self._lease_until()
+                    )
+            except asyncio.CancelledError:
+                raise
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Cannot claim a user deletion")
+                deletion = None
+            if deletion is None:
+                await self._maybe_sweep()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run(deletion.id, deletion.user_id)
+
+    async def _run(self, deletion_id: int, user_id: int):
+        try:
+            while True:
+                async with AsyncSessionLocal() as database_session:
+                    deleted, digests = await database_session.run_sync(
+                        crud.delete_user_segmentations, deletion_id, user_id,
+                        self.batch_size, self._lease_until()
+                    )
+                await self._release(deletion_id, digests)
+                if deleted < self.batch_size:
+                    break
+                await asyncio.sleep(self.pause)
+
+            async with AsyncSessionLocal() as database_session:
+                digests = await database_session.run_sync(
+                    crud.finish_user_deletion, deletion_id, user_id, utcnow()
+                )
+            await self._release(deletion_id, digests)
+        except asyncio.CancelledError:
+            raise
+        except Exception as deletion_error:  # pylint: disable=broad-except
+            logger.exception("User deletion %s failed", deletion_id)
+            async with AsyncSessionLocal() as database_session:
+                await database_session.run_sync(
+                    crud.fail_user_deletion, deletion_id,
+                    str(deletion_error) or "Deletion failed", utcnow()
+                )
+
+    async def _release(self, deletion_id: int, digests: set):
+        """Пометка освободившихся объектов к удалению и возврат места в SQLite."""
+        if digests:
+            async with AsyncSessionLocal() as database_session:
+                free, orphan_inputs = await database_session.run_sync(crud.release_blobs, digests)
+            if orphan_inputs:
+                result_cache.discard_where(lambda key: key[0] in orphan_inputs)
+            if free:
+                await run_in_threadpool(lambda: [blob_store.mark_deleted(digest) for digest in free])
+                async with AsyncSessionLocal() as database_session:
+                    await database_session.run_sync(crud.add_deleted_blobs, deletion_id, len(free))
+        await self.vacuum()
+
+    async def _maybe_sweep(self):
+        if time.monotonic() < self._next_sweep:
+            return
+        self._next_sweep = time.monotonic() + self.gc_interval
+        try:
+            await self.sweep_blobs()
+        except asyncio.CancelledError:
+            raise
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Blob garbage collection failed")
+
+    async def sweep_blobs(self) -> int:
+        """Удаление объектов, помеченных к удалению раньше чем gc_grace назад.
+
+        Ссылки проверяются заново: на объект могла сослаться строка,
+        созданная после пометки, - такой объект остаётся, пометка снимается.
+        Повторная загрузка того же содержимого во время сборки сама снимает
+        пометку (см. LocalBlobStore), поэтому файл под живой строкой не удаляется.
+
+        Returns:
+            int: Количество удалённых объектов
+        """
+        pending = await run_in_threadpool(
+            blob_store.pending_deletions, time.time() - self.gc_grace
+        )
+        if not pending:
+            return 0
+        async with AsyncSessionLocal() as database_session:
+            referenced = await database_session.run_sync(crud.referenced_blobs, set(pending))
+
+        def sweep() -> int:
+            swept = 0
+            for digest in pending:
+                if digest in referenced:
+                    blob_store.unmark(digest)
+                elif blob_store.sweep(digest):
+                    swept += 1
+            return swept
+
+        swept = await run_in_threadpool(sweep)
+        if swept:
+            logger.info("Removed %d unreferenced blobs", swept)
+        return swept
+
+    async def vacuum(self):
+        """Возврат освобождённых страниц SQLite небольшим шагом (auto_vacuum=INCREMENTAL)."""
+        if async_engine.dialect.name != "sqlite" or not self.vacuum_pages:
+            return
+        async with async_engine.begin() as connection:
+            await connection.execute(text(f"PRAGMA incremental_vacuum({int(self.vacuum_pages)})"))
+
+
+user_deletions = UserDeletionRunner.from_settings()
@@ -0,0 +1,334 @@
+"""Модуль производных изображений (миниатюр).
+
+Содержит:
+- Построение пирамиды миниатюр WebP для оригинала или маски
+- Фоновую очередь генерации, не задерживающую загрузку
+- Получение миниатюры с генерацией по первому запросу
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Callable, Dict, List, NamedTuple, Optional
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import crud, masks
+from .config import settings
+from .database import AsyncSessionLocal
+from .preprocess import decode_image, image_info
+from .storage import blob_store
+from .tiling import parse_tiff
+
+if TYPE_CHECKING:
+    import numpy as np
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_MEDIA_TYPE = "image/webp"
+
+
+class Rendition(NamedTuple):
+    """Закодированная миниатюра.
+
+    Attributes:
+        size: Наибольшая сторона, для которой строилась миниатюра
+        data: Содержимое WebP
+        width: Ширина
+        height: Высота
+    """
+    size: int
+    data: bytes
+    width: int
+    height: int
+
+
+class DerivativeRef(NamedTuple):
+    """Миниатюра, сохранённая в хранилище."""
+    size: int
+    digest: str
+    byte_size: int
+    media_type: str
+    width: int
+    height: int
+
+
+def _sample_step(height: int, width: int, size: int) -> int:
+    """Шаг прореживания, после которого сторона ещё не меньше двух миниатюр.
+
+    Запас в два раза оставляет INTER_AREA материал для сглаживания.
+    """
+    return max(1, max(height, width) // (2 * size))
+
+
+def _thumbnail_source(data, media_type: str, size: int, max_pixels: Optional[int],
+                      read_at: Optional[Callable[[int, int], bytes]]) -> np.ndarray:
+    """Изображение для наибольшей миниатюры с ограниченной памятью.
+
+    Упакованная маска и несжатый TIFF прореживаются по строкам без
+    полной распаковки; JPEG декодируется с уменьшением в DCT; остальные
+    форматы декодируются целиком, только если в них не больше max_pixels
+    пикселей. Цвет декодируется, только если он есть в источнике.
+    """
+    import numpy as np
+
+    is_mask = media_type == masks.MASK_MEDIA_TYPE
+    if is_mask and masks.is_packed_mask(data):
+        height, width = masks.mask_dimensions(data)
+        return masks.sample_mask(data, _sample_step(height, width, size)).view(np.uint8) * 255
+
+    tiff = parse_tiff(data, read_at)
+    if tiff is not None:
+        image = tiff.sample(_sample_step(tiff.height, tiff.width, size))
+    else:
+        info = image_info(data)
+        if info is None:
+            raise ValueError("Cannot decode image")
+        # JPEG уменьшается до 8 раз по каждой стороне прямо при декодировании
+        reduction = 64 if bytes(data[:2]) == b"\xff\xd8" else 1
+        if max_pixels and info.height * info.width > max_pixels * reduction:
+            raise ValueError("Image is too large for thumbnails")
+        image, _ = decode_image(data, color=info.color and not is_mask,
+                                max_pixels=size * size)
+    if is_mask:
+        # Маски, сохранённые изображениями до перехода на упакованный формат
+        image = (image > 127).view(np.uint8) * 255
+    return image
+
+
+def render_thumbnails(data, media_type: str, sizes: List[int], quality: int = 80,
+                      max_pixels: Optional[int] = None,
+                      read_at: Optional[Callable[[int, int], bytes]] = None) -> List[Rendition]:
+    """Построение пирамиды миниатюр.
+
+    Источник уменьшается до наибольшей миниатюры без полноразмерного
+    буфера (см. _thumbnail_source), меньшие уровни получаются из
+    предыдущих через INTER_AREA. Изображения меньше миниатюры не
+    увеличиваются.
+
+    Args:
+        data: Содержимое объекта (bytes, memoryview или mmap)
+        media_type: Медиатип объекта (упакованные маски поддерживаются)
+        sizes: Наибольшие стороны миниатюр
+        quality: Качество WebP
+        max_pixels: Наибольший размер источника, декодируемого целиком
+        read_at: Чтение участка объекта в обход буфера (см. storage.BlobView.read_at)
+
+    Returns:
+        list: Миниатюры в порядке убывания размера
+
+    Raises:
+        ValueError: Если объект не удалось декодировать или он слишком велик
+    """
+    import cv2
+
+    sizes = sorted(set(sizes), reverse=True)
+    image = _thumbnail_source(data, media_type, sizes[0], max_pixels, read_at)
+
+    renditions = []
+    for size in sizes:
+        height, width = image.shape[:2]
+        scale = size / max(height, width)
+        if scale < 1:
+            image = cv2.resize(
+                image, (max(1, round(width * scale)), max(1, round(height * scale))),
+                interpolation=cv2.INTER_AREA
+            )
+        ok, encoded = cv2.imencode(".webp", image, [cv2.IMWRITE_WEBP_QUALITY, quality])
+        if not ok:
+            raise ValueError("Cannot encode thumbnail")
+        renditions.append(Rendition(size, encoded.tobytes(), image.shape[1], image.shape[0]))
+    return renditions
+
+
+def build_derivatives(source_digest: str, media_type: str, sizes: List[int],
+                      quality: int, max_pixels: Optional[int] = None) -> List[DerivativeRef]:
+    """Построение миниатюр объекта и их запись в хранилище.
+
+    Объект не читается в память целиком: декодер получает отображение
+    файла, а строки несжатого TIFF читаются выборочно (BlobView.read_at).
+    """
+    with blob_store.open_view(source_digest) as blob:
+        renditions = render_thumbnails(blob.view, media_type, sizes, quality, max_pixels,
+                                       blob.read_at)
+    refs = []
+    for rendition in renditions:
+        blob = blob_store.put(rendition.data)
+        refs.append(DerivativeRef(
+            rendition.size, blob.digest, blob.size, THUMBNAIL_MEDIA_TYPE,
+            rendition.width, rendition.height
+        ))
+    return refs
+
+
+class DerivativeQueue:
+    """Фоновая очередь генерации миниатюр.
+
+    Задачи обрабатываются воркерами цикла событий, а сама генерация
+    идёт в отдельном небольшом пуле потоков, чтобы не занимать слоты
+    пула сегментации. Повторные запросы одного объекта объединяются.
+
+    Attributes:
+        sizes: Размеры миниатюр
+        quality: Качество WebP
+        workers: Количество воркеров
+        queue_size: Максимальная длина очереди
+        max_pixels: Наибольший размер источника, декодируемого целиком
+    """
+
+    def __init__(self, sizes: List[int], quality: int = 80, workers: int = 1,
+                 queue_size: int = 256, max_pixels: Optional[int] = None):
+        self.sizes = sorted(set(sizes))
+        self.quality = quality
+        self.max_pixels = max_pixels
+        self.workers = max(1, workers)
+        self.queue_size = queue_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    @classmethod
+    def from_settings(cls) -> "DerivativeQueue":
+        """Создание очереди по настройкам приложения."""
+        return cls(
+            sizes=settings.THUMBNAIL_SIZES,
+            quality=settings.THUMBNAIL_QUALITY,
+            workers=settings.DERIVATIVE_WORKERS,
+            queue_size=settings.DERIVATIVE_QUEUE_SIZE,
+            max_pixels=settings.THUMBNAIL_MAX_PIXELS or None
+        )
+
+    @property
+    def depth(self) -> int:
+        """Количество объектов, ожидающих генерации миниатюр."""
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def start(self):
+        """Запуск воркеров в текущем цикле событий."""
+        if self._queue is not None:
+            return
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="derivatives")
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def shutdown(self):
+        """Остановка воркеров; невыполненные задачи отбрасываются."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+    def enqueue(self, source_digest: str, media_type: str) -> bool:
+        """Постановка объекта в очередь без ожидания.
+
+        Returns:
+            bool: False, если очередь не запущена или заполнена; тогда
+            миниатюры будут построены при первом запросе
+        """
+        if self._queue is None:
+            return False
+        try:
+            self._queue.put_nowait((source_digest, media_type))
+        except asyncio.QueueFull:
+            return False
+        return True
+
+    async def _worker(self):
+        while True:
+            source_digest, media_type = await self._queue.get()
+            try:
+                async with AsyncSessionLocal() as database_session:
+                    ready = await database_session.run_sync(crud.count_derivatives, source_digest)
+                    if ready < len(self.sizes):
+                        await self.generate(database_session, source_digest, media_type)
+            except asyncio.CancelledError:
+                raise
+            except ValueError as render_error:
+                # Не декодируется или слишком велик: не ошибка сервиса
+                logger.info("No thumbnails for %s: %s", source_digest, render_error)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Thumbnail generation failed for %s", source_digest)
+            finally:
+                self._queue.task_done()
+
+    async def generate(self, database_session: AsyncSession, source_digest: str,
+                       media_type: str):
+        """Построение и запись всех миниатюр объекта.
+
+        Одновременные вызовы для одного объекта выполняют работу один раз.
+
+        Raises:
+            ValueError: Если объект не удалось декодировать
+        """
+        pending = self._inflight.get(source_digest)
+        if pending is not None:
+            try:
+                await asyncio.shield(pending)
+                return
+            except asyncio.CancelledError:
+                # Отменён сам вызывающий, а не построение, на которое он ждал
+                if not pending.cancelled():
+                    raise
+            if source_digest in self._inflight:
+                await self.generate(database_session, source_digest, media_type)
+                return
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._inflight[source_digest] = future
+        try:
+            if self._pool is not None:
+                refs = await loop.run_in_executor(
+                    self._pool, build_derivatives, source_digest, media_type,
+                    self.sizes, self.quality, self.max_pixels
+                )
+            else:
+                refs = await run_in_threadpool(
+                    build_derivatives, source_digest, media_type, self.sizes, self.quality,
+                    self.max_pixels
+                )
+            await database_session.run_sync(crud.add_derivatives, source_digest, refs)
+            future.set_result(None)
+        except Exception as error:
+            future.set_exception(error)
+            # Исключение уже передаётся вызывающему; ожидающим - через future
+            future.exception()
+            raise
+        except BaseException:
+            future.cancel()
+            raise
+        finally:
+            del self._inflight[source_digest]
+
+    async def get(self, database_session: AsyncSession, source_digest: str,
+                  media_type: str, size: int):
+        """Миниатюра объекта; при отсутствии строится сразу.
+
+        Args:
+            database_session: Сессия подключения к БД
+            source_digest: SHA-256 исходного объекта
+            media_type: Медиатип исходного объекта
+            size: Размер из THUMBNAIL_SIZES
+
+        Returns:
+            Row: Строка с полями digest и media_type
+
+        Raises:
+            ValueError: Если объект не удалось декодировать
+        """
+        row = await database_session.run_sync(crud.get_derivative, source_digest, size)
+        if row is None:
+            await self.generate(database_session, source_digest, media_type)
+            row = await database_session.run_sync(crud.get_derivative, source_digest, size)
+        return row
+
+
+derivative_queue = DerivativeQueue.from_settings()
@@ -0,0 +1,338 @@
+"""Модуль реестра алгоритмов сегментации.
+
+Содержит:
+- Общий интерфейс алгоритма (движка) сегментации с описанием параметров
+- Реестр движков и разбор параметров из запроса
+- Встроенные движки: порог, Otsu, адаптивный порог, k-means, watershed
+
+cv2 и numpy импортируются в методах сегментации: реестр и описания
+движков доступны без загрузки библиотек обработки изображений.
+"""
+
+from __future__ import annotations
+
+import json
+from typing import TYPE_CHECKING, Dict, NamedTuple, Optional, Tuple
+
+if TYPE_CHECKING:
+    import numpy as np
+
+# Классы стоимости: cheap - для синхронных загрузок, heavy - для пакетной обработки
+COST_CHEAP = "cheap"
+COST_HEAVY = "heavy"
+
+
+class EngineParam(NamedTuple):
+    """Описание параметра движка.
+
+    Attributes:
+        name: Имя параметра
+        type: Тип значения (int или float)
+        default: Значение по умолчанию
+        minimum: Минимально допустимое значение
+        maximum: Максимально допустимое значение
+        description: Описание
+    """
+    name: str
+    type: type
+    default: float
+    minimum: float
+    maximum: float
+    description: str = ""
+
+
+class SegmentationEngine:
+    """Базовый класс движка сегментации.
+
+    Attributes:
+        name: Имя движка в реестре и в запросе
+        version: Версия; меняется при любом изменении результата
+        cost: Класс стоимости (COST_CHEAP или COST_HEAVY)
+        color: Требуется ли цветное изображение (иначе - оттенки серого)
+        working_megapixels: Рабочее разрешение в мегапикселях (None - исходное);
+            маска возвращается к исходному размеру ближайшим соседом
+        params: Описание параметров
+    """
+    name = ""
+    version = "2"
+    cost = COST_CHEAP
+    color = False
+    working_megapixels: Optional[float] = None
+    params: Tuple[EngineParam, ...] = ()
+
+    def validate_params(self, params: dict) -> dict:
+        """Проверка параметров и подстановка значений по умолчанию.
+
+        Args:
+            params: Параметры из запроса
+
+        Returns:
+            dict: Полный набор параметров
+
+        Raises:
+            ValueError: Если параметр неизвестен или вне допустимого диапазона
+        """
+        known = {param.name: param for param in self.params}
+        unknown = set(params) - set(known)
+        if unknown:
+            raise ValueError(f"Unknown parameters for {self.name}: {', '.join(sorted(unknown))}")
+
+        validated = {}
+        for name, param in known.items():
+            value = params.get(name, param.default)
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                raise ValueError(f"Parameter {name} must be a number")
+            if param.type is int and value != int(value):
+                raise ValueError(f"Parameter {name} must be an integer")
+            value = param.type(value)
+            if not param.minimum <= value <= param.maximum:
+                raise ValueError(
+                    f"Parameter {name} must be between {param.minimum} and {param.maximum}"
+                )
+            validated[name] = value
+        return validated
+
+    def cache_key(self, params: dict) -> str:
+        """Ключ результата для кеша: имя, версия и параметры."""
+        encoded = ",".join(f"{name}={params[name]}" for name in sorted(params))
+        return f"{self.name}/{self.version}?{encoded}"
+
+    def tile_halo(self, params: dict) -> Optional[int]:
+        """Перекрытие тайлов, при котором потайловый результат совпадает с обычным.
+
+        Args:
+            params: Проверенные параметры
+
+        Returns:
+            int: Перекрытие в пикселях или None, если движку нужно всё изображение
+        """
+        return None
+
+    def describe(self) -> dict:
+        """Описание движка для API."""
+        return {
+            "name": self.name,
+            "version": self.version,
+            "cost": self.cost,
+            "color": self.color,
+            "tiled": self.tile_halo(self.validate_params({})) is not None,
+            "params": [
+                {
+                    "name": param.name,
+                    "type": param.type.__name__,
+                    "default": param.default,
+                    "minimum": param.minimum,
+                    "maximum": param.maximum,
+                    "description": param.description,
+                }
+                for param in self.params
+            ],
+        }
+
+    def segment(self, image: np.ndarray, **params) -> np.ndarray:
+        """Сегментация изображения.
+
+        Args:
+            image: Изображение BGR (если color) или в оттенках серого
+            **params: Проверенные параметры
+
+        Returns:
+            np.ndarray: Маска; ненулевые элементы - передний план
+        """
+        raise NotImplementedError
+
+    def segment_batch(self, images: np.ndarray, **params):
+        """Сегментация пакета изображений одного размера.
+
+        По умолчанию изображения обрабатываются по одному; поэлементные
+        движки переопределяют метод векторизованной версией.
+
+        Args:
+            images: Изображения, сложенные по первой оси
+            **params: Проверенные параметры
+
+        Returns:
+            Маски в том же порядке (массив или список)
+        """
+        return [self.segment(image, **params) for image in images]
+
+
+_REGISTRY: Dict[str, SegmentationEngine] = {}
+
+
+def register_engine(engine_class):
+    """Декоратор регистрации движка в реестре."""
+    engine = engine_class()
+    if engine.name in _REGISTRY:
+        raise ValueError(f"Engine {engine.name} is already registered")
+    _REGISTRY[engine.name] = engine
+    return engine_class
+
+
+def get_engine(name: str) -> SegmentationEngine:
+    """Получение движка по имени.
+
+    Raises:
+        ValueError: Если движок не зарегистрирован
+    """
+    try:
+        return _REGISTRY[name]
+    except KeyError as error:
+        raise ValueError(f"Unknown segmentation algorithm: {name}") from error
+
+
+def list_engines() -> list:
+    """Описания всех зарегистрированных движков."""
+    return [engine.describe() for engine in _REGISTRY.values()]
+
+
+def resolve(name: str, raw_params: Optional[str] = None) -> Tuple[SegmentationEngine, dict]:
+    """Выбор движка и разбор параметров из полей формы.
+
+    Args:
+        name: Имя движка
+        raw_params: Параметры в виде JSON-объекта (может отсутствовать)
+
+    Returns:
+        tuple: Движок и проверенные параметры
+
+    Raises:
+        ValueError: Если движок неизвестен или параметры некорректны
+    """
+    engine = get_engine(name)
+    params = {}
+    if raw_params:
+        try:
+            params = json.loads(raw_params)
+        except json.JSONDecodeError as error:
+            raise ValueError("Parameters must be a JSON object") from error
+        if not isinstance(params, dict):
+            raise ValueError("Parameters must be a JSON object")
+    return engine, engine.validate_params(params)
+
+
+@register_engine
+class ThresholdEngine(SegmentationEngine):
+    """Глобальный порог по яркости."""
+    name = "threshold"
+    params = (
+        EngineParam("threshold", int, 127, 0, 255, "Порог яркости"),
+    )
+
+    def tile_halo(self, params):
+        return 0
+
+    def segment(self, image, threshold=127):
+        import cv2
+
+        _, mask = cv2.threshold(image, threshold, 255, cv2.THRESH_BINARY)
+        return mask
+
+    def segment_batch(self, images, threshold=127):
+        # То же условие, что у THRESH_BINARY, одним проходом по всему пакету
+        return images > threshold
+
+
+@register_engine
+class OtsuEngine(SegmentationEngine):
+    """Порог, автоматически выбранный методом Otsu."""
+    name = "otsu"
+    params = (
+        EngineParam("blur", int, 0, 0, 31, "Размер ядра гауссова размытия (0 - без размытия)"),
+    )
+
+    def segment(self, image, blur=0):
+        import cv2
+
+        if blur:
+            kernel = blur | 1
+            image = cv2.GaussianBlur(image, (kernel, kernel), 0)
+        _, mask = cv2.threshold(image, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+        return mask
+
+
+@register_engine
+class AdaptiveEngine(SegmentationEngine):
+    """Адаптивный порог по гауссовой окрестности."""
+    name = "adaptive"
+    params = (
+        EngineParam("block_size", int, 35, 3, 255, "Размер окрестности (нечётный)"),
+        EngineParam("offset", float, 5.0, -50.0, 50.0, "Смещение порога от среднего"),
+    )
+
+    def tile_halo(self, params):
+        # Радиус гауссова окна с запасом
+        return params["block_size"] | 1
+
+    def segment(self, image, block_size=35, offset=5.0):
+        import cv2
+
+        return cv2.adaptiveThreshold(
+            image, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY,
+            block_size | 1, offset
+        )
+
+
+@register_engine
+class KMeansEngine(SegmentationEngine):
+    """Кластеризация цветов k-means; передний план - самый яркий кластер."""
+    name = "kmeans"
+    cost = COST_HEAVY
+    color = True
+    working_megapixels = 1.0
+    params = (
+        EngineParam("clusters", int, 2, 2, 8, "Количество кластеров"),
+        EngineParam("attempts", int, 3, 1, 10, "Количество итераций уточнения"),
+    )
+
+    def segment(self, image, clusters=2, attempts=3):
+        import cv2
+        import numpy as np
+
+        pixels = image.reshape(-1, 3).astype(np.float32)
+        # Детерминированная начальная разметка по квантилям яркости,
+        # чтобы результат не зависел от случайной инициализации
+        brightness = pixels.sum(axis=1)
+        edges = np.quantile(brightness, np.linspace(0, 1, clusters + 1)[1:-1])
+        labels = np.searchsorted(edges, brightness).astype(np.int32).reshape(-1, 1)
+        criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 20 * attempts, 0.5)
+        _, labels, centers = cv2.kmeans(
+            pixels, clusters, labels, criteria, 1, cv2.KMEANS_USE_INITIAL_LABELS
+        )
+        foreground = int(np.argmax(centers.sum(axis=1)))
+        return (labels.reshape(image.shape[:2]) == foreground)
+
+
+@register_engine
+class WatershedEngine(SegmentationEngine):
+    """Watershed по маркерам из преобразования расстояний."""
+    name = "watershed"
+    cost = COST_HEAVY
+    color = True
+    working_megapixels = 4.0
+    params = (
+        EngineParam("foreground_fraction", float, 0.5, 0.05, 0.95,
+                    "Доля максимума расстояния для уверенного переднего плана"),
+        EngineParam("open_iterations", int, 2, 0, 10, "Итерации морфологического открытия"),
+    )
+
+    def segment(self, image, foreground_fraction=0.5, open_iterations=2):
+        import cv2
+        import numpy as np
+
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+        kernel = np.ones((3, 3), np.uint8)
+        opened = cv2.morphologyEx(binary, cv2.MORPH_OPEN, kernel, iterations=open_iterations)
+        sure_background = cv2.dilate(opened, kernel, iterations=3)
+        distance = cv2.distanceTransform(opened, cv2.DIST_L2, 5)
+        _, sure_foreground = cv2.threshold(
+            distance, foreground_fraction * distance.max(), 255, cv2.THRESH_BINARY
+        )
+        sure_foreground = sure_foreground.astype(np.uint8)
+        unknown = cv2.subtract(sure_background, sure_foreground)
+        _, markers = cv2.connectedComponents(sure_foreground)
+        markers = markers + 1
+        markers[unknown == 255] = 0
+        markers = cv2.watershed(image, markers)
+        return markers > 1
@@ -0,0 +1,223 @@
+"""Модуль оценки качества сегментации по эталонным маскам.
+
+Содержит функции для:
+- подсчёта матрицы ошибок по упакованным маскам (1 бит на пиксель)
+- граничной F-меры с допуском в пикселях
+- пакетного расчёта IoU, Dice, точности, полноты и доли верных пикселей
+
+Все операции выполняются над пакетами упакованных масок одного размера
+целиком: сдвиги, морфология и подсчёт битов векторизованы по всему
+пакету, без циклов по пикселям и изображениям.
+"""
+
+from collections import defaultdict
+from typing import Dict, List, Union
+
+import numpy as np
+
+from .masks import is_packed_mask, load_mask, unpack_packed
+from .models import EVALUATION_METRICS as METRICS
+
+# Число единичных битов в каждом значении байта
+_POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, np.newaxis], axis=1).sum(axis=1)
+
+
+def _popcount(packed: np.ndarray) -> np.ndarray:
+    """Число единичных битов в каждом изображении пакета (N, H, W/8)."""
+    if hasattr(np, "bitwise_count"):
+        counts = np.bitwise_count(packed)
+    else:
+        counts = _POPCOUNT[packed]
+    return counts.reshape(len(packed), -1).sum(axis=1, dtype=np.int64)
+
+
+def _row_mask(width: int) -> np.ndarray:
+    """Маска значащих битов строки: хвост последнего байта - выравнивание."""
+    return np.packbits(np.ones(width, dtype=bool))
+
+
+def _shift_right(packed: np.ndarray, row_mask: np.ndarray) -> np.ndarray:
+    """Сдвиг маски на пиксель вправо (packbits хранит первый пиксель в старшем бите)."""
+    carry = np.zeros_like(packed)
+    carry[..., 1:] = (packed[..., :-1] & 1) << 7
+    return ((packed >> 1) | carry) & row_mask
+
+
+def _shift_left(packed: np.ndarray) -> np.ndarray:
+    """Сдвиг маски на пиксель влево."""
+    carry = np.zeros_like(packed)
+    carry[..., :-1] = packed[..., 1:] >> 7
+    return (packed << 1) | carry
+
+
+def _shift_down(packed: np.ndarray) -> np.ndarray:
+    shifted = np.zeros_like(packed)
+    shifted[..., 1:, :] = packed[..., :-1, :]
+    return shifted
+
+
+def _shift_up(packed: np.ndarray) -> np.ndarray:
+    shifted = np.zeros_like(packed)
+    shifted[..., :-1, :] = packed[..., 1:, :]
+    return shifted
+
+
+def boundary(packed: np.ndarray, row_mask: np.ndarray) -> np.ndarray:
+    """Граница маски: пиксели переднего плана, у которых есть соседний фон.
+
+    Соседство - 4-связное, за пределами изображения считается фон.
+
+    Args:
+        packed: Пакет упакованных масок (N, H, W/8)
+        row_mask: Маска значащих битов строки
+
+    Returns:
+        np.ndarray: Упакованные границы той же формы
+    """
+    eroded = (packed & _shift_left(packed) & _shift_right(packed, row_mask)
+              & _shift_up(packed) & _shift_down(packed))
+    return packed & ~eroded
+
+
+def dilate(packed: np.ndarray, row_mask: np.ndarray, radius: int) -> np.ndarray:
+    """Дилатация квадратом (2 * radius + 1) в упакованном виде.
+
+    Args:
+        packed: Пакет упакованных масок (N, H, W/8)
+        row_mask: Маска значащих битов строки
+        radius: Радиус в пикселях
+
+    Returns:
+        np.ndarray: Упакованный результат той же формы
+    """
+    for _ in range(radius):
+        packed = packed | _shift_left(packed) | _shift_right(packed, row_mask)
+        packed = packed | _shift_up(packed) | _shift_down(packed)
+    return packed
+
+
+def _ratio(numerator: np.ndarray, denominator: np.ndarray, empty: np.ndarray) -> np.ndarray:
+    """Поэлементное отношение; при нулевом знаменателе - значение empty."""
+    result = np.asarray(empty, dtype=np.float64).copy()
+    np.divide(numerator, denominator, out=result, where=denominator > 0)
+    return result
+
+
+def evaluate_packed(predicted: np.ndarray, truth: np.ndarray, width: int,
+                    tolerance: int = 2) -> Dict[str, np.ndarray]:
+    """Метрики для пакета упакованных масок одного размера.
+
+    Для пустых масок используются соглашения: если обе маски пустые,
+    IoU, Dice, точность, полнота и граничная F-мера равны 1.
+
+    Args:
+        predicted: Предсказанные маски (N, H, ceil(W / 8)) uint8
+        truth: Эталонные маски той же формы
+        width: Ширина масок в пикселях
+        tolerance: Допуск совпадения границ в пикселях
+
+    Returns:
+        dict: Метрики METRICS и счётчики tp, fp, fn, tn - массивы длины N
+    """
+    row_mask = _row_mask(width)
+    total = predicted.shape[1] * width
+
+    true_positive = _popcount(predicted & truth)
+    predicted_count = _popcount(predicted)
+    truth_count = _popcount(truth)
+    false_positive = predicted_count - true_positive
+    false_negative = truth_count - true_positive
+    true_negative = total - true_positive - false_positive - false_negative
+
+    both_empty = (predicted_count == 0) & (truth_count == 0)
+    union = true_positive + false_positive + false_negative
+
+    predicted_boundary = boundary(predicted, row_mask)
+    truth_boundary = boundary(truth, row_mask)
+    predicted_edges = _popcount(predicted_boundary)
+    truth_edges = _popcount(truth_boundary)
+    boundary_precision = _ratio(
+        _popcount(predicted_boundary & dilate(truth_boundary, row_mask, tolerance)),
+        predicted_edges, truth_edges == 0
+    )
+    boundary_recall = _ratio(
+        _popcount(truth_boundary & dilate(predicted_boundary, row_mask, tolerance)),
+        truth_edges, predicted_edges == 0
+    )
+
+    return {
+        "iou": _ratio(true_positive, union, both_empty),
+        "dice": _ratio(2 * true_positive, union + true_positive, both_empty),
+        "accuracy": (true_positive + true_negative) / total,
+        "precision": _ratio(true_positive, predicted_count, truth_count == 0),
+        "recall": _ratio(true_positive, truth_count, predicted_count == 0),
+        "boundary_f1": _ratio(
+            2 * boundary_precision * boundary_recall,
+            boundary_precision + boundary_recall,
+            np.zeros(len(predicted))
+        ),
+        "tp": true_positive,
+        "fp": false_positive,
+        "fn": false_negative,
+        "tn": true_negative,
+    }
+
+
+def to_packed(data: bytes) -> tuple:
+    """Упакованные биты маски из упакованного формата или изображения.
+
+    Returns:
+        tuple: Массив (H, ceil(W / 8)) uint8 и ширина маски
+
+    Raises:
+        ValueError: Если данные не удалось декодировать
+    """
+    if is_packed_mask(data):
+        return unpack_packed(data)
+    mask = load_mask(data)
+    return np.packbits(mask, axis=-1), mask.shape[1]
+
+
+def evaluate_masks(pairs: list, tolerance: int = 2,
+                   batch_size: int = 256) -> List[Union[dict, str]]:
+    """Метрики для списка пар (предсказание, эталон).
+
+    Маски группируются по размеру и считаются пакетами по batch_size
+    (ограничивает память на промежуточные массивы).
+
+    Args:
+        pairs: Пары закодированных масок (упакованные или изображения)
+        tolerance: Допуск совпадения границ в пикселях
+        batch_size: Максимум масок в одном пакете
+
+    Returns:
+        list: Для каждой пары словарь метрик или текст ошибки
+    """
+    results: List[Union[dict, str]] = [""] * len(pairs)
+    groups = defaultdict(list)
+    for index, (predicted_data, truth_data) in enumerate(pairs):
+        try:
+            predicted, width = to_packed(predicted_data)
+            truth, truth_width = to_packed(truth_data)
+        except Exception as error:  # pylint: disable=broad-except
+            results[index] = f"Cannot decode mask: {str(error)}"
+            continue
+        if predicted.shape != truth.shape or width != truth_width:
+            results[index] = (
+                f"Ground truth size {truth.shape[0]}x{truth_width} does not match "
+                f"segmentation size {predicted.shape[0]}x{width}"
+            )
+            continue
+        groups[(predicted.shape[0], width)].append((index, predicted, truth))
+
+    for (_, width), members in groups.items():
+        for start in range(0, len(members), batch_size):
+            batch = members[start:start + batch_size]
+            scores = evaluate_packed(
+                np.stack([predicted for _, predicted, _ in batch]),
+                np.stack([truth for _, _, truth in batch]),
+                width, tolerance
+            )
+            for position, (index, _, _) in enumerate(batch):
+                results[index] = {name: float(scores[name][position]) for name in METRICS}
+    return results
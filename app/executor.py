@@ -0,0 +1,183 @@
+"""Модуль исполнителя задач сегментации.
+
+Содержит:
+- Ограниченный пул потоков или процессов для CPU-ёмкой обработки изображений
+- Ограничение очереди с обратным давлением (backpressure)
+- Таймауты задач и корректное завершение работы пула
+"""
+
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from . import telemetry
+from .config import settings
+
+
+def _picklable(arg: Any) -> Any:
+    """Копия буферов (в том числе в списках), которые не сериализуются pickle."""
+    if isinstance(arg, memoryview):
+        return bytes(arg)
+    if isinstance(arg, (list, tuple)):
+        return type(arg)(_picklable(item) for item in arg)
+    return arg
+
+
+class ExecutorBusyError(Exception):
+    """Очередь исполнителя заполнена, задача не принята.
+
+    Attributes:
+        retry_after: Рекомендуемая пауза перед повтором в секундах
+    """
+
+    def __init__(self, retry_after: int):
+        super().__init__("Segmentation queue is full")
+        self.retry_after = retry_after
+
+
+class ExecutorTimeoutError(Exception):
+    """Задача не завершилась за отведённое время."""
+
+
+class SegmentationExecutor:
+    """Ограниченный исполнитель для тяжёлых синхронных функций.
+
+    Пул выполняет не более ``max_workers`` задач одновременно и держит
+    в очереди не более ``queue_size`` ожидающих. При переполнении новая
+    задача сразу отклоняется, а не копится в памяти.
+
+    Attributes:
+        kind: Тип пула - "thread" или "process"
+        max_workers: Количество рабочих потоков/процессов
+        queue_size: Максимальное количество ожидающих задач
+        timeout: Таймаут выполнения одной задачи в секундах
+        retry_after: Значение заголовка Retry-After при переполнении
+    """
+
+    def __init__(
+            self,
+            kind: str = "thread",
+            max_workers: Optional[int] = None,
+            queue_size: int = 16,
+            timeout: Optional[float] = 30.0,
+            retry_after: int = 5
+    ):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unknown executor kind: {kind}")
+        self.kind = kind
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self._pool: Optional[Executor] = None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls) -> "SegmentationExecutor":
+        """Создание исполнителя по настройкам приложения.
+
+        Returns:
+            SegmentationExecutor: Новый (ещё не запущенный) исполнитель
+        """
+        return cls(
+            kind=settings.SEGMENTATION_EXECUTOR,
+            max_workers=settings.SEGMENTATION_WORKERS,
+            queue_size=settings.SEGMENTATION_QUEUE_SIZE,
+            timeout=settings.SEGMENTATION_TIMEOUT,
+            retry_after=settings.SEGMENTATION_RETRY_AFTER
+        )
+
+    @property
+    def pending(self) -> int:
+        """Количество принятых, но не завершённых задач."""
+        return self._pending
+
+    def start(self):
+        """Запуск пула, если он ещё не создан."""
+        if self._pool is not None:
+            return
+        if self.kind == "process":
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+        else:
+            # cv2 отпускает GIL на декодировании и пороговой обработке,
+            # поэтому потоки масштабируются по ядрам без накладных расходов IPC
+            self._pool = ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                thread_name_prefix="segmentation"
+            )
+
+    def shutdown(self, wait: bool = True):
+        """Остановка пула с отменой ещё не начатых задач.
+
+        Args:
+            wait: Дождаться завершения уже выполняющихся задач
+        """
+        if self._pool is None:
+            return
+        self._pool.shutdown(wait=wait, cancel_futures=True)
+        self._pool = None
+
+    def _release(self, _future):
+        with self._lock:
+            self._pending -= 1
+
+    async def run(self, func: Callable[..., Any], *args: Any,
+                  timeout: Optional[float] = None) -> Any:
+        """Выполнение функции в пуле без блокировки цикла событий.
+
+        Args:
+            func: Синхронная функция (для пула процессов - сериализуемая)
+            *args: Аргументы функции
+            timeout: Таймаут этой задачи вместо общего
+
+        Returns:
+            Any: Результат функции
+
+        Raises:
+            ExecutorBusyError: Если очередь заполнена
+            ExecutorTimeoutError: Если задача не уложилась в таймаут
+        """
+        self.start()
+        if self.kind == "process":
+            # memoryview и mmap не сериализуются pickle, передаём копию
+            args = tuple(_picklable(arg) for arg in args)
+        with self._lock:
+            if self._pending >= self.max_workers + self.queue_size:
+                raise ExecutorBusyError(self.retry_after)
+            self._pending += 1
+
+        # Замеры стадий из потока или процесса пула возвращаются вместе с результатом
+        traced = settings.METRICS_ENABLED
+        try:
+            future = self._pool.submit(
+                telemetry.Traced(func, time.time()) if traced else func, *args
+            )
+        except BaseException:
+            self._release(None)
+            raise
+        # Счётчик уменьшается по фактическому завершению задачи, а не по
+        # таймауту ожидания: зависшая задача продолжает занимать слот
+        future.add_done_callback(self._release)
+
+        timeout = timeout or self.timeout
+        try:
+            result = await asyncio.wait_for(
+                asyncio.wrap_future(future),
+                timeout=timeout
+            )
+        except asyncio.TimeoutError as timeout_error:
+            future.cancel()
+            raise ExecutorTimeoutError(
+                f"Task exceeded {timeout} seconds"
+            ) from timeout_error
+        if traced:
+            result, spans = result
+            telemetry.replay(spans)
+        return result
+
+
+segmentation_executor = SegmentationExecutor.from_settings()
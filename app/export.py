@@ -0,0 +1,267 @@
+"""Модуль потоковой выгрузки набора данных.
+
+Содержит:
+- Потоковую запись архивов tar и zip без буферизации архива целиком
+- Манифест сегментаций в CSV или JSON Lines
+- Генератор архива с оригиналами, масками и манифестом
+
+Строки читаются из БД серверным курсором пачками по yield_per, объекты
+хранилища - блоками, манифест копится во временном файле, поэтому
+память не зависит от размера выгрузки (для zip, кроме центрального
+каталога - он хранит запись на файл). Строки идут по возрастанию ID:
+прерванную выгрузку можно продолжить с ID последней полученной записи.
+"""
+
+import csv
+import io
+import json
+import mimetypes
+import tarfile
+import tempfile
+import time
+import zipfile
+from typing import Iterable, Iterator, Optional
+
+from . import crud, masks
+from .database import SessionLocal
+from .storage import blob_store
+
+ARCHIVE_MEDIA_TYPES = {"tar": "application/x-tar", "zip": "application/zip"}
+MANIFEST_FIELDS = (
+    "id", "user_id", "username", "created_at", "is_good",
+    "engine", "engine_version", "engine_params", "original", "mask",
+)
+ENTRY_CHUNK_SIZE = 1024 * 1024
+
+
+class TarStream:
+    """Потоковая запись tar: заголовок, данные блоками и выравнивание до 512 байт."""
+
+    def add(self, name: str, size: int, mtime: float, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """Байты записи архива.
+
+        Args:
+            name: Путь внутри архива
+            size: Размер содержимого (должен совпадать с суммой блоков)
+            mtime: Время изменения (unix time)
+            chunks: Содержимое блоками
+        """
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mtime = int(mtime)
+        info.mode = 0o644
+        yield info.tobuf(format=tarfile.PAX_FORMAT)
+        written = 0
+        for chunk in chunks:
+            written += len(chunk)
+            yield chunk
+        if written != size:
+            raise ValueError(f"{name}: expected {size} bytes, got {written}")
+        if size % tarfile.BLOCKSIZE:
+            yield tarfile.NUL * (tarfile.BLOCKSIZE - size % tarfile.BLOCKSIZE)
+
+    def close(self) -> Iterator[bytes]:
+        """Конец архива - два пустых блока."""
+        yield tarfile.NUL * (2 * tarfile.BLOCKSIZE)
+
+
+class _Sink(io.RawIOBase):
+    """Несдвигаемый поток, из которого записанные байты забираются частями."""
+
+    def __init__(self):
+        super().__init__()
+        self._parts = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts = []
+        return data
+
+
+class ZipStream:
+    """Потоковая запись zip через zipfile с дескрипторами данных.
+
+    Записи сохраняются без сжатия: изображения и PNG уже сжаты.
+    """
+
+    def __init__(self):
+        self._sink = _Sink()
+        self._archive = zipfile.ZipFile(self._sink, "w", zipfile.ZIP_STORED, allowZip64=True)
+
+    def add(self, name: str, size: int, mtime: float, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """Байты записи архива (см. TarStream.add)."""
+        info = zipfile.ZipInfo(name, time.localtime(mtime)[:6])
+        info.file_size = size
+        with self._archive.open(info, "w", force_zip64=size >= zipfile.ZIP64_LIMIT) as entry:
+            for chunk in chunks:
+                entry.write(chunk)
+                yield from self._drain()
+        yield from self._drain()
+
+    def close(self) -> Iterator[bytes]:
+        """Центральный каталог архива.
+
+        Каталог хранит по записи на файл, поэтому для очень больших
+        выгрузок экономнее tar.
+        """
+        self._archive.close()
+        yield from self._drain()
+
+    def _drain(self) -> Iterator[bytes]:
+        data = self._sink.drain()
+        if data:
+            yield data
+
+
+def _extension(media_type: Optional[str]) -> str:
+    if media_type == "image/jpeg":
+        return ".jpg"
+    return mimetypes.guess_extension(media_type or "") or ".bin"
+
+
+def _blob_entry(digest: str, media_type: str, mask_format: str):
+    """Содержимое записи для объекта: (расширение, размер, блоки) или None."""
+    if media_type == masks.MASK_MEDIA_TYPE and mask_format == "png":
+        try:
+            packed = blob_store.read(digest)
+        except FileNotFoundError:
+            return None
+        png = masks.render_png(masks.load_mask(packed))
+        return ".png", len(png), [png]
+    path = blob_store.local_path(digest)
+    if path is not None:
+        size = path.stat().st_size
+    elif blob_store.exists(digest):
+        size = len(blob_store.read(digest))
+    else:
+        return None
+    extension = ".mask" if media_type == masks.MASK_MEDIA_TYPE else _extension(media_type)
+    return extension, size, blob_store.iter_chunks(digest)
+
+
+class _Manifest:
+    """Манифест во временном файле (в памяти до spool_bytes)."""
+
+    def __init__(self, manifest_format: str, spool_bytes: int):
+        self.format = manifest_format
+        # max_size=0 у SpooledTemporaryFile означает "никогда не сбрасывать на диск"
+        self._file = tempfile.SpooledTemporaryFile(max_size=max(1, spool_bytes), mode="w+t",
+                                                   encoding="utf-8", newline="")
+        self._writer = None
+        if manifest_format == "csv":
+            self._writer = csv.DictWriter(self._file, fieldnames=MANIFEST_FIELDS)
+            self._writer.writeheader()
+
+    def add(self, row: dict):
+        if self._writer is not None:
+            self._writer.writerow(row)
+        else:
+            self._file.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+    def entry(self):
+        """Размер в байтах и содержимое блоками."""
+        self._file.flush()
+        self._file.seek(0)
+        size = 0
+        while chunk := self._file.read(ENTRY_CHUNK_SIZE):
+            size += len(chunk.encode("utf-8"))
+        self._file.seek(0)
+
+        def chunks():
+            try:
+                while chunk := self._file.read(ENTRY_CHUNK_SIZE):
+                    yield chunk.encode("utf-8")
+            finally:
+                self._file.close()
+        return size, chunks()
+
+
+def export_archive(user_id: Optional[int], filters: dict, archive_format: str = "tar",
+                   manifest_format: str = "csv", mask_format: str = "png",
+                   include_originals: bool = True, after: Optional[int] = None,
+                   limit: Optional[int] = None, yield_per: int = 500,
+                   spool_bytes: int = 8 * 1024 * 1024) -> Iterator[bytes]:
+    """Архив сегментаций: оригиналы, маски, манифест и сводка export.json.
+
+    Синхронный генератор: StreamingResponse выполняет его в пуле потоков,
+    так что чтение БД, файлов и отрисовка PNG не блокируют цикл событий.
+
+    Args:
+        user_id: Владелец сегментаций или None - все пользователи
+        filters: Фильтры crud.export_segmentations (feedback, engine, created_from, created_to)
+        archive_format: "tar" или "zip"
+        manifest_format: "csv" или "jsonl"
+        mask_format: "png" - маски в PNG, "packed" - как хранятся
+        include_originals: Включать оригиналы
+        after: Продолжить после записи с этим ID
+        limit: Максимум записей в архиве
+        yield_per: Строк, читаемых из курсора за раз
+        spool_bytes: Размер манифеста, после которого он пишется на диск
+
+    Yields:
+        bytes: Очередная часть архива
+    """
+    archive = ZipStream() if archive_format == "zip" else TarStream()
+    manifest = _Manifest(manifest_format, spool_bytes)
+    count, missing, last_id = 0, 0, after
+    started = time.time()
+
+    with SessionLocal() as database_session:
+        for row in crud.export_segmentations(
+                database_session, user_id, after=after, limit=limit,
+                yield_per=yield_per, **filters
+        ):
+            mtime = row.created_at.timestamp() if row.created_at else started
+            paths = {"original": "", "mask": ""}
+            sources = [("mask", "masks", row.segmented_digest, row.segmented_media_type)]
+            if include_originals:
+                sources.insert(0, ("original", "originals", row.original_digest,
+                                   row.original_media_type))
+            for field, folder, digest, media_type in sources:
+                entry = _blob_entry(digest, media_type, mask_format) if digest else None
+                if entry is None:
+                    missing += 1
+                    continue
+                extension, size, chunks = entry
+                paths[field] = f"{folder}/{row.id}{extension}"
+                yield from archive.add(paths[field], size, mtime, chunks)
+
+            manifest.add({
+                "id": row.id,
+                "user_id": row.user_id,
+                "username": row.username,
+                "created_at": row.created_at.isoformat() if row.created_at else "",
+                "is_good": "" if row.is_good is None else bool(row.is_good),
+                "engine": row.engine or "",
+                "engine_version": row.engine_version or "",
+                "engine_params": row.engine_params or "",
+                **paths,
+            })
+            count += 1
+            last_id = row.id
+
+    size, chunks = manifest.entry()
+    yield from archive.add(f"manifest.{manifest_format}", size, started, chunks)
+    summary = json.dumps({
+        "count": count,
+        "missing_blobs": missing,
+        "after": after,
+        "last_id": last_id,
+        # Архив обрезан по limit: продолжение - ?after=<next_after>
+        "next_after": last_id if limit is not None and count >= limit else None,
+        "filters": {name: str(value) for name, value in filters.items() if value is not None},
+    }, indent=2).encode()
+    yield from archive.add("export.json", len(summary), started, [summary])
+    yield from archive.close()
@@ -0,0 +1,463 @@
+"""Модуль потокового приёма загружаемых файлов.
+
+Содержит:
+- Разбор тела multipart/form-data по мере поступления блоков
+- Раннее прерывание при превышении лимита размера
+- Инкрементальный расчёт SHA-256 и проверку сигнатуры изображения
+- Буфер, который в памяти держит только небольшие файлы, а большие
+  сбрасывает во временный файл и отдаёт через mmap без копирования
+- Распаковку архивов zip/tar пакетной загрузки в список изображений
+"""
+
+import hashlib
+import mmap
+import os
+import tarfile
+import tempfile
+import zipfile
+from io import BytesIO
+from typing import Dict, List, NamedTuple, Optional
+
+from fastapi import Request
+from python_multipart.exceptions import FormParserError
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+from .config import settings
+from .storage import guess_media_type
+
+# Байт, которых достаточно для распознавания сигнатуры
+SNIFF_BYTES = 16
+# Запас на границы и заголовки частей сверх лимита файла
+FORM_OVERHEAD_BYTES = 64 * 1024
+# Максимальный размер обычного (не файлового) поля формы
+MAX_FIELD_BYTES = 64 * 1024
+# Байт, которых достаточно для распознавания архива (сигнатура tar на смещении 257)
+ARCHIVE_SNIFF_BYTES = 512
+# Медиатипы частей формы, которые в пакетной загрузке считаются архивами
+ARCHIVE_CONTENT_TYPES = (
+    b"application/zip",
+    b"application/x-zip-compressed",
+    b"application/x-tar",
+    b"application/gzip",
+    b"application/x-gzip",
+    b"application/x-gtar",
+    b"application/octet-stream",
+)
+ZIP_MEDIA_TYPE = "application/zip"
+TAR_MEDIA_TYPE = "application/x-tar"
+
+
+class UploadTooLargeError(Exception):
+    """Загрузка превышает допустимый размер."""
+
+
+class NotAnImageError(Exception):
+    """Загруженный файл не является поддерживаемым изображением."""
+
+
+class MalformedUploadError(Exception):
+    """Тело запроса не является корректной формой multipart/form-data."""
+
+
+class IngestedUpload:
+    """Принятый файл.
+
+    Attributes:
+        field_name: Имя поля формы
+        filename: Имя файла из запроса
+        media_type: Медиатип, определённый по сигнатуре
+        size: Размер в байтах
+        digest: SHA-256 содержимого
+        is_archive: Файл - архив пакетной загрузки
+    """
+
+    def __init__(self, field_name: str, filename: str, spool_bytes: int,
+                 is_archive: bool = False):
+        self.field_name = field_name
+        self.filename = filename
+        self.is_archive = is_archive
+        self.media_type: Optional[str] = None
+        self.size = 0
+        self.digest = ""
+        self._hash = hashlib.sha256()
+        self._spool_bytes = spool_bytes
+        self._memory: Optional[bytearray] = bytearray()
+        self._file = None
+        self._mmap: Optional[mmap.mmap] = None
+        self._views: List[memoryview] = []
+
+    def write(self, data: bytes):
+        """Добавление очередного блока данных."""
+        self.size += len(data)
+        self._hash.update(data)
+        if self._memory is not None and len(self._memory) + len(data) <= self._spool_bytes:
+            self._memory.extend(data)
+            return
+        if self._file is None:
+            self._file = tempfile.TemporaryFile(prefix="upload-")
+            self._file.write(self._memory)
+            self._memory = None
+        self._file.write(data)
+
+    def header(self, length: int = SNIFF_BYTES) -> bytes:
+        """Первые байты файла для проверки сигнатуры."""
+        if self._memory is not None:
+            return bytes(self._memory[:length])
+        self._file.seek(0)
+        header = self._file.read(length)
+        self._file.seek(0, os.SEEK_END)
+        return header
+
+    def open(self):
+        """Файловый объект для чтения с начала (для zipfile/tarfile).
+
+        Временный файл отдаётся сам, поэтому одновременно читать его
+        через два объекта нельзя.
+        """
+        if self._memory is not None:
+            return BytesIO(self._memory)
+        self._file.seek(0)
+        return self._file
+
+    def finish(self):
+        """Завершение приёма: фиксация хеша."""
+        self.digest = self._hash.hexdigest()
+
+    def getbuffer(self) -> memoryview:
+        """Содержимое файла без копирования.
+
+        Returns:
+            memoryview: Представление буфера в памяти или mmap временного файла
+        """
+        if self._memory is not None:
+            view = memoryview(self._memory)
+        else:
+            if self._mmap is None:
+                self._file.flush()
+                self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            view = memoryview(self._mmap)
+        self._views.append(view)
+        return view
+
+    def close(self):
+        """Освобождение памяти и временного файла."""
+        for view in self._views:
+            try:
+                view.release()
+            except BufferError:
+                pass
+        self._views = []
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # Буфер ещё используется, отображение закроется сборщиком мусора
+                pass
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._memory = None
+
+
+class IngestedForm:
+    """Разобранная форма.
+
+    Attributes:
+        fields: Обычные поля формы
+        files: Принятые файлы
+    """
+
+    def __init__(self):
+        self.fields: Dict[str, str] = {}
+        self.files: List[IngestedUpload] = []
+
+    def get_file(self, field_name: str) -> Optional[IngestedUpload]:
+        """Первый файл с указанным именем поля."""
+        for upload in self.files:
+            if upload.field_name == field_name:
+                return upload
+        return None
+
+    def close(self):
+        """Освобождение всех принятых файлов."""
+        for upload in self.files:
+            upload.close()
+
+
+class _FormBuilder:
+    """Обработчик событий MultipartParser."""
+
+    def __init__(self, form: IngestedForm, max_file_bytes: int, max_files: int, spool_bytes: int,
+                 allow_archives: bool = False):
+        self.form = form
+        self.max_file_bytes = max_file_bytes
+        self.max_files = max_files
+        self.spool_bytes = spool_bytes
+        self.allow_archives = allow_archives
+        self._header_name = b""
+        self._header_value = b""
+        self._disposition = b""
+        self._content_type = b""
+        self._field_name = ""
+        self._field_data = bytearray()
+        self._upload: Optional[IngestedUpload] = None
+
+    def callbacks(self) -> dict:
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+        }
+
+    def on_part_begin(self):
+        self._disposition = b""
+        self._content_type = b""
+        self._field_data = bytearray()
+        self._upload = None
+
+    def on_header_field(self, data: bytes, start: int, end: int):
+        self._header_name += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def on_header_end(self):
+        name = self._header_name.lower()
+        if name == b"content-disposition":
+            self._disposition = self._header_value
+        elif name == b"content-type":
+            self._content_type = self._header_value
+        self._header_name = b""
+        self._header_value = b""
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self._disposition)
+        if b"name" not in options:
+            raise MalformedUploadError("Form part without a name")
+        self._field_name = options[b"name"].decode("utf-8", "replace")
+        if b"filename" in options:
+            if len(self.form.files) >= self.max_files:
+                raise MalformedUploadError("Too many files")
+            content_type, _ = parse_options_header(self._content_type)
+            is_archive = self.allow_archives and content_type.lower() in ARCHIVE_CONTENT_TYPES
+            if not is_archive and not content_type.lower().startswith(b"image/"):
+                raise NotAnImageError("Only images are allowed")
+            self._upload = IngestedUpload(
+                self._field_name,
+                options[b"filename"].decode("utf-8", "replace"),
+                self.spool_bytes,
+                is_archive
+            )
+            self.form.files.append(self._upload)
+
+    def on_part_data(self, data: bytes, start: int, end: int):
+        chunk = data[start:end]
+        if self._upload is None:
+            if len(self._field_data) + len(chunk) > MAX_FIELD_BYTES:
+                raise MalformedUploadError("Form field is too large")
+            self._field_data.extend(chunk)
+            return
+
+        upload = self._upload
+        if upload.size + len(chunk) > self.max_file_bytes:
+            raise UploadTooLargeError("File too large")
+        sniffed_before = upload.size >= SNIFF_BYTES
+        upload.write(chunk)
+        if not upload.is_archive and not sniffed_before and upload.size >= SNIFF_BYTES:
+            self._sniff(upload)
+
+    def on_part_end(self):
+        if self._upload is None:
+            self.form.fields[self._field_name] = self._field_data.decode("utf-8", "replace")
+            return
+        if self._upload.is_archive:
+            self._sniff_archive(self._upload)
+        elif self._upload.media_type is None:
+            self._sniff(self._upload)
+        self._upload.finish()
+
+    @staticmethod
+    def _sniff_archive(upload: IngestedUpload):
+        header = upload.header(ARCHIVE_SNIFF_BYTES)
+        if header.startswith((b"PK\x03\x04", b"PK\x05\x06")):
+            upload.media_type = ZIP_MEDIA_TYPE
+        elif header.startswith(b"\x1f\x8b") or header[257:262] == b"ustar":
+            upload.media_type = TAR_MEDIA_TYPE
+        else:
+            raise MalformedUploadError("Unsupported archive format")
+
+    @staticmethod
+    def _sniff(upload: IngestedUpload):
+        upload.media_type = guess_media_type(upload.header())
+        if upload.media_type is None:
+            raise NotAnImageError("Only images are allowed")
+
+
+async def ingest_form(
+        request: Request,
+        max_file_bytes: Optional[int] = None,
+        max_files: int = 1,
+        spool_bytes: Optional[int] = None,
+        max_body_bytes: Optional[int] = None,
+        allow_archives: bool = False
+) -> IngestedForm:
+    """Потоковый разбор формы multipart/form-data.
+
+    Тело читается блоками по мере поступления. Разбор прерывается,
+    как только файл превышает лимит или его сигнатура не похожа на
+    изображение, поэтому отклонённая загрузка не буферизуется целиком.
+
+    Args:
+        request: Входящий запрос
+        max_file_bytes: Лимит размера одного файла (по умолчанию MAX_UPLOAD_BYTES)
+        max_files: Максимальное количество файлов в форме
+        spool_bytes: Размер, до которого файл держится в памяти
+        max_body_bytes: Лимит всего тела запроса (по умолчанию из лимитов файлов)
+        allow_archives: Принимать архивы zip/tar (см. collect_batch_items)
+
+    Returns:
+        IngestedForm: Поля и файлы формы (вызывающий обязан вызвать close)
+
+    Raises:
+        UploadTooLargeError: Если файл превышает лимит
+        NotAnImageError: Если файл не является изображением
+        MalformedUploadError: Если тело запроса не является корректной формой
+    """
+    max_file_bytes = max_file_bytes or settings.MAX_UPLOAD_BYTES
+    spool_bytes = spool_bytes or settings.UPLOAD_SPOOL_BYTES
+
+    content_type, options = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in options:
+        raise MalformedUploadError("Expected multipart/form-data")
+
+    max_body_bytes = max_body_bytes or max_file_bytes * max_files + FORM_OVERHEAD_BYTES
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_body_bytes:
+        raise UploadTooLargeError("File too large")
+
+    form = IngestedForm()
+    builder = _FormBuilder(form, max_file_bytes, max_files, spool_bytes, allow_archives)
+    parser = MultipartParser(options[b"boundary"], builder.callbacks())
+    received = 0
+    try:
+        async for chunk in request.stream():
+            # Content-Length может отсутствовать (chunked), считаем сами
+            received += len(chunk)
+            if received > max_body_bytes:
+                raise UploadTooLargeError("File too large")
+            parser.write(chunk)
+        parser.finalize()
+    except FormParserError as parse_error:
+        form.close()
+        raise MalformedUploadError(str(parse_error)) from parse_error
+    except BaseException:
+        form.close()
+        raise
+    return form
+
+
+class BatchItem(NamedTuple):
+    """Изображение пакетной загрузки.
+
+    Attributes:
+        name: Имя файла или путь внутри архива
+        data: Содержимое (bytes или буфер) или None при ошибке
+        digest: SHA-256 содержимого
+        media_type: Медиатип, определённый по сигнатуре
+        error: Причина, по которой элемент не может быть обработан
+    """
+    name: str
+    data: object
+    digest: str
+    media_type: Optional[str]
+    error: Optional[str] = None
+
+
+def _batch_item(name: str, data: bytes) -> BatchItem:
+    media_type = guess_media_type(data[:SNIFF_BYTES])
+    if media_type is None:
+        return BatchItem(name, None, "", None, "Only images are allowed")
+    return BatchItem(name, data, hashlib.sha256(data).hexdigest(), media_type)
+
+
+def _iter_archive(upload: IngestedUpload, max_item_bytes: int):
+    """Файлы архива: (имя, содержимое или None, если файл слишком большой)."""
+    if upload.media_type == ZIP_MEDIA_TYPE:
+        with zipfile.ZipFile(upload.open()) as archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                if info.file_size > max_item_bytes:
+                    yield info.filename, None
+                    continue
+                with archive.open(info) as member:
+                    data = member.read(max_item_bytes + 1)
+                yield info.filename, data if len(data) <= max_item_bytes else None
+        return
+
+    with tarfile.open(fileobj=upload.open(), mode="r:*") as archive:
+        for info in archive:
+            if not info.isfile():
+                continue
+            if info.size > max_item_bytes:
+                yield info.name, None
+                continue
+            yield info.name, archive.extractfile(info).read()
+
+
+def collect_batch_items(form: IngestedForm, max_item_bytes: int, max_items: int,
+                        max_total_bytes: int) -> List[BatchItem]:
+    """Список изображений пакетной загрузки с распаковкой архивов.
+
+    Служебные файлы архивов (скрытые, __MACOSX) пропускаются. Слишком
+    большие и не являющиеся изображениями файлы попадают в список с
+    ошибкой, чтобы клиент получил по ним ответ.
+
+    Args:
+        form: Разобранная форма
+        max_item_bytes: Лимит размера одного изображения
+        max_items: Максимум изображений в пакете
+        max_total_bytes: Лимит суммарного размера распакованных изображений
+
+    Returns:
+        list: Элементы пакета в порядке следования в запросе
+
+    Raises:
+        MalformedUploadError: Если архив повреждён или лимиты пакета превышены
+    """
+    items: List[BatchItem] = []
+    total_bytes = 0
+    for upload in form.files:
+        if not upload.is_archive:
+            if upload.size > max_item_bytes:
+                items.append(BatchItem(upload.filename, None, "", None, "File too large"))
+            else:
+                items.append(BatchItem(
+                    upload.filename, upload.getbuffer(), upload.digest, upload.media_type
+                ))
+            total_bytes += upload.size
+        else:
+            try:
+                for name, data in _iter_archive(upload, max_item_bytes):
+                    base_name = os.path.basename(name)
+                    if not base_name or base_name.startswith(".") or "__MACOSX" in name:
+                        continue
+                    if data is None:
+                        items.append(BatchItem(name, None, "", None, "File too large"))
+                        continue
+                    total_bytes += len(data)
+                    if total_bytes > max_total_bytes:
+                        raise MalformedUploadError("Batch is too large")
+                    items.append(_batch_item(name, data))
+                    if len(items) > max_items:
+                        raise MalformedUploadError("Too many files in batch")
+            except (zipfile.BadZipFile, tarfile.TarError, EOFError, OSError) as archive_error:
+                raise MalformedUploadError(f"Cannot read archive: {archive_error}") from archive_error
+        if len(items) > max_items:
+            raise MalformedUploadError("Too many files in batch")
+    return items
@@ -0,0 +1,204 @@
+"""Модуль асинхронной обработки загрузок через очередь заданий.
+
+Содержит:
+- Постановку загрузки в очередь с ограничением на пользователя
+- Воркеры, забирающие задания из таблицы jobs с арендой
+- Уведомления подписчиков (SSE) о смене состояния задания
+"""
+
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Set
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import crud, engines, models, pipeline
+from .config import settings
+from .database import AsyncSessionLocal
+from .executor import ExecutorBusyError
+from .storage import blob_store
+
+logger = logging.getLogger(__name__)
+
+FINAL_STATUSES = (models.JOB_DONE, models.JOB_FAILED)
+
+
+class JobLimitError(Exception):
+    """У пользователя слишком много незавершённых заданий.
+
+    Attributes:
+        retry_after: Рекомендуемая пауза перед повтором в секундах
+    """
+
+    def __init__(self, retry_after: int):
+        super().__init__("Too many active jobs")
+        self.retry_after = retry_after
+
+
+def utcnow() -> datetime:
+    """Текущее время в UTC."""
+    return datetime.now(timezone.utc)
+
+
+class JobRunner:
+    """Воркеры очереди заданий сегментации.
+
+    Очередь хранится в таблице jobs, поэтому задания переживают
+    перезапуск: задание, чья аренда истекла (процесс упал во время
+    обработки), снова становится доступным. Воркеры просыпаются сразу
+    после постановки задания в этом процессе и раз в poll_interval -
+    для заданий, поставленных другими процессами.
+
+    Attributes:
+        workers: Количество воркеров
+        user_concurrency: Максимум одновременно выполняющихся заданий пользователя
+        max_active_per_user: Максимум незавершённых заданий пользователя
+        poll_interval: Период опроса таблицы в секундах
+        max_attempts: Максимум попыток выполнения задания
+    """
+
+    def __init__(self, workers: int = 2, user_concurrency: int = 1,
+                 max_active_per_user: int = 20, poll_interval: float = 1.0,
+                 max_attempts: int = 3):
+        self.workers = workers
+        self.user_concurrency = user_concurrency
+        self.max_active_per_user = max_active_per_user
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._listeners: Dict[int, Set[asyncio.Event]] = {}
+
+    @classmethod
+    def from_settings(cls) -> "JobRunner":
+        """Создание воркеров по настройкам приложения."""
+        return cls(
+            workers=settings.JOB_WORKERS,
+            user_concurrency=settings.JOB_USER_CONCURRENCY,
+            max_active_per_user=settings.JOB_MAX_ACTIVE_PER_USER,
+            poll_interval=settings.JOB_POLL_INTERVAL,
+            max_attempts=settings.JOB_MAX_ATTEMPTS
+        )
+
+    def start(self):
+        """Запуск воркеров в текущем цикле событий."""
+        if self._tasks:
+            return
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def shutdown(self):
+        """Остановка воркеров; прерванные задания вернутся по истечении аренды."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, database_session: AsyncSession, user_id: int, contents,
+                     input_digest: str, media_type: str, engine: engines.SegmentationEngine,
+                     params: dict, tiled: bool = False) -> models.Job:
+        """Сохранение оригинала и постановка задания в очередь.
+
+        Raises:
+            JobLimitError: Если у пользователя слишком много незавершённых заданий
+        """
+        active = await database_session.run_sync(crud.count_active_jobs, user_id)
+        if active >= self.max_active_per_user:
+            raise JobLimitError(settings.SEGMENTATION_RETRY_AFTER)
+
+        await run_in_threadpool(blob_store.put, contents, input_digest)
+        job = await database_session.run_sync(
+            crud.create_job, user_id, input_digest, media_type, engine.name,
+            pipeline.encode_params(params), tiled
+        )
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job
+
+    def subscribe(self, job_id: int) -> asyncio.Event:
+        """Подписка на изменения задания в этом процессе."""
+        event = asyncio.Event()
+        self._listeners.setdefault(job_id, set()).add(event)
+        return event
+
+    def unsubscribe(self, job_id: int, event: asyncio.Event):
+        """Отмена подписки."""
+        listeners = self._listeners.get(job_id)
+        if listeners is not None:
+            listeners.discard(event)
+            if not listeners:
+                del self._listeners[job_id]
+
+    def _notify(self, job_id: int):
+        for event in self._listeners.get(job_id, ()):
+            event.set()
+
+    @staticmethod
+    def _lease_for(job) -> datetime:
+        timeout = settings.SEGMENTATION_TILED_TIMEOUT if job.tiled else settings.SEGMENTATION_TIMEOUT
+        return utcnow() + timedelta(seconds=timeout + settings.JOB_LEASE_MARGIN)
+
+    async def _claim(self) -> Optional[models.Job]:
+        async with AsyncSessionLocal() as database_session:
+            return await database_session.run_sync(
+                crud.claim_job, utcnow(), self._lease_for, self.user_concurrency
+            )
+
+    async def _finish(self, job_id: int, status: str, **values):
+        async with AsyncSessionLocal() as database_session:
+            await database_session.run_sync(crud.finish_job, job_id, status, utcnow(), **values)
+        self._notify(job_id)
+
+    async def _worker(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                job = await self._claim()
+            except asyncio.CancelledError:
+                raise
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Cannot claim a job")
+                job = None
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run(job)
+
+    async def _run(self, job: models.Job):
+        self._notify(job.id)
+        stored = None
+        try:
+            engine, params = engines.resolve(job.engine, job.engine_params)
+            stored = await run_in_threadpool(blob_store.open_view, job.input_digest)
+            async with AsyncSessionLocal() as database_session:
+                segmentation, cache_hit = await pipeline.segment_upload(
+                    database_session, job.user_id, stored.view, job.input_digest,
+                    job.input_media_type, engine, params, job.tiled
+                )
+            await self._finish(job.id, models.JOB_DONE,
+                               segmentation_id=segmentation.id, cached=cache_hit)
+        except asyncio.CancelledError:
+            raise
+        except ExecutorBusyError as busy_error:
+            # Пул занят синхронными загрузками: вернуть задание и подождать
+            await self._finish(job.id, models.JOB_QUEUED)
+            await asyncio.sleep(busy_error.retry_after)
+        except (ValueError, FileNotFoundError) as input_error:
+            await self._finish(job.id, models.JOB_FAILED, error=str(input_error))
+        except Exception as job_error:  # pylint: disable=broad-except
+            logger.exception("Job %s failed", job.id)
+            if job.attempts >= self.max_attempts:
+                await self._finish(job.id, models.JOB_FAILED, error=str(job_error) or "Job failed")
+            else:
+                await self._finish(job.id, models.JOB_QUEUED)
+        finally:
+            if stored is not None:
+                stored.close()
+
+
+job_runner = JobRunner.from_settings()
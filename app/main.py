@@ -4,46 +4,88 @@
 - Маршруты для аутентификации и работы с пользователями
 - API для загрузки и обработки изображений
 - Middleware для проверки авторизации
+- Фабрику приложения create_app
+
+Импорт модуля не обращается к БД и файлам и не загружает cv2/numpy:
+схема создаётся миграцией (python -m app.migrate или AUTO_MIGRATE),
+фоновые воркеры запускаются в lifespan, библиотеки обработки
+изображений - при первой обработке.
 """
 
-from fastapi import (Depends, FastAPI, File, Form, HTTPException, Request,
-                     Response, UploadFile, status)
+import asyncio
+import base64
+import json
+import os
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from typing import Optional
+
+from fastapi import (APIRouter, Depends, FastAPI, Form, HTTPException, Query,
+                     Request, Response, status)
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse
+from fastapi.responses import (FileResponse, HTMLResponse, JSONResponse,
+                               PlainTextResponse, RedirectResponse,
+                               StreamingResponse)
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from jose import JWTError, jwt
 from pydantic import ValidationError
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import Session
-
-from . import auth, crud, models, schemas
-from .config import settings
-from .database import SessionLocal, engine, get_db
-from .segmentation import segment_image
-
-# Инициализация базы данных
-models.Base.metadata.create_all(bind=engine)
-
-# Создание приложения FastAPI
-app = FastAPI()
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import (auth, credentials, crud, engines, export, masks, migrate,
+               models, pipeline, schemas, telemetry, tiling)
+from .config import BASE_DIR, settings
+from .database import AsyncSessionLocal, async_engine, get_db
+from .deletions import user_deletions
+from .derivatives import derivative_queue
+from .executor import (ExecutorBusyError, ExecutorTimeoutError,
+                       segmentation_executor)
+from .ingest import (MalformedUploadError, NotAnImageError,
+                     UploadTooLargeError, collect_batch_items, ingest_form)
+from .jobs import FINAL_STATUSES, JobLimitError, job_runner
+from .segmentation import working_megapixels
+from .storage import blob_store
+from .writes import write_batcher
+
+STATIC_DIR = BASE_DIR / "static"
+TEMPLATES_DIR = BASE_DIR / "templates"
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    """Запуск и остановка фоновых ресурсов приложения."""
+    if settings.AUTO_MIGRATE:
+        await run_in_threadpool(migrate.migrate)
+    segmentation_executor.start()
+    derivative_queue.start()
+    write_batcher.start()
+    job_runner.start()
+    user_deletions.start()
+    yield
+    await user_deletions.shutdown()
+    await job_runner.shutdown()
+    await write_batcher.shutdown()
+    await derivative_queue.shutdown()
+    segmentation_executor.shutdown()
+    tiling.shutdown()
+    credentials.shutdown()
+    await async_engine.dispose()
+
+
+# Маршруты приложения; подключаются к экземпляру в create_app
+router = APIRouter()
+templates = Jinja2Templates(directory=TEMPLATES_DIR)
+
+
+# Состояние удаления доступно по токену из ответа и после удаления аккаунта
+USER_DELETIONS_PATH = "/api/user/deletions/"
 
-# Настройка статических файлов и шаблонов
-app.mount("/static", StaticFiles(directory="static"), name="static")
-templates = Jinja2Templates(directory="templates")
 
-# Настройки CORS
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-
-@app.middleware("http")
 async def auth_middleware(request: Request, call_next):
     """Middleware для проверки аутентификации пользователя.
 
@@ -53,11 +95,14 @@ async def auth_middleware(request: Request, call_next):
     - Валидацию JWT токена
     """
     if request.method == "OPTIONS" or request.url.path.startswith(
-            ("/static", "/login", "/register")
+            ("/static", "/login", "/register", USER_DELETIONS_PATH)
     ):
         return await call_next(request)
+    # С METRICS_TOKEN /metrics проверяет свой токен сам; без него - обычный вход
+    if request.url.path == "/metrics" and settings.METRICS_TOKEN:
+        return await call_next(request)
 
-    is_api_request = request.url.path.startswith('/api/')
+    is_api_request = request.url.path.startswith(('/api/', '/metrics'))
 
     try:
         token = None
@@ -88,18 +133,13 @@ async def auth_middleware(request: Request, call_next):
             if not username:
                 raise JWTError("Invalid token payload")
 
-            database_session = SessionLocal()
-            try:
-                user = crud.get_user(database_session, username=username)
-                if not user:
-                    raise HTTPException(
-                        status_code=status.HTTP_401_UNAUTHORIZED,
-                        detail="User not found"
-                    )
+            with telemetry.span("auth_lookup"):
+                user = await auth.get_principal(username, token, payload.get("exp"))
+            if not user or not user.is_active:
+                # Деактивированный (удаляемый) пользователь теряет доступ сразу
+                raise JWTError("User not found or inactive")
 
-                request.state.user = user
-            finally:
-                database_session.close()
+            request.state.user = user
 
         except JWTError as jwt_error:
             response = (
@@ -124,13 +164,47 @@ async def auth_middleware(request: Request, call_next):
         return RedirectResponse(url="/login")
 
 
-@app.get("/", response_class=HTMLResponse)
+if settings.METRICS_ENABLED:
+    telemetry.register_collectors({
+        "imageseg_segmentation_queue_depth": (
+            "Segmentation tasks accepted and not finished",
+            lambda: {(): segmentation_executor.pending}
+        ),
+        "imageseg_derivative_queue_depth": (
+            "Images waiting for thumbnail generation",
+            lambda: {(): derivative_queue.depth}
+        ),
+        "imageseg_write_queue_depth": (
+            "Writes waiting for a group commit",
+            lambda: {(): write_batcher.depth}
+        ),
+    })
+    telemetry.register_collectors({
+        "imageseg_result_cache_lookups_total": (
+            "Segmentation result lookups by outcome",
+            lambda: {
+                ("memory_hit",): pipeline.result_cache_counters["memory_hits"],
+                ("db_hit",): pipeline.result_cache_counters["db_hits"],
+                ("miss",): pipeline.result_cache_counters["misses"],
+            }
+        ),
+        "imageseg_user_cache_lookups_total": (
+            "Authentication cache lookups by outcome",
+            lambda: {
+                ("hit",): auth.user_cache.hits,
+                ("miss",): auth.user_cache.misses,
+            }
+        ),
+    }, kind="counter", labelnames=("result",))
+
+
+@router.get("/", response_class=HTMLResponse)
 async def home(request: Request):
     """Главная страница приложения."""
     return templates.TemplateResponse("index.html", {"request": request})
 
 
-@app.get("/login", response_class=HTMLResponse)
+@router.get("/login", response_class=HTMLResponse)
 async def login_page(request: Request, error: int = 0):
     """Страница входа в систему."""
     return templates.TemplateResponse("login.html", {
@@ -139,14 +213,21 @@ async def login_page(request: Request, error: int = 0):
     })
 
 
-@app.post("/login")
+@router.post("/login")
 async def login(
         form_data: OAuth2PasswordRequestForm = Depends(),
-        database_session: Session = Depends(get_db)
+        database_session: AsyncSession = Depends(get_db)
 ):
     """Обработка входа пользователя."""
-    user = auth.authenticate_user(database_session, form_data.username,
-                                  form_data.password)
+    try:
+        user = await auth.authenticate_user(database_session, form_data.username,
+                                            form_data.password)
+    except credentials.PasswordHashBusyError as busy_error:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many login attempts in progress",
+            headers={"Retry-After": str(busy_error.retry_after)}
+        ) from busy_error
     if not user:
         return RedirectResponse(
             url="/login?error=1",
@@ -171,20 +252,20 @@ async def login(
     return response
 
 
-@app.get("/register", response_class=HTMLResponse)
+@router.get("/register", response_class=HTMLResponse)
 async def register_page(request: Request):
     """Страница регистрации нового пользователя."""
     return templates.TemplateResponse("register.html", {"request": request})
 
 
-@app.post("/register", response_class=HTMLResponse)
+@router.post("/register", response_class=HTMLResponse)
 async def register(
         request: Request,
         username: str = Form(...),
         email: str = Form(...),
         password: str = Form(...),
         password_confirm: str = Form(...),
-        database_session: Session = Depends(get_db)
+        database_session: AsyncSession = Depends(get_db)
 ):
     """Обработка регистрации нового пользователя."""
     try:
@@ -195,9 +276,17 @@ async def register(
             password_confirm=password_confirm
         )
 
-        crud.create_user(database_session=database_session, user=user_data)
+        hashed_password = await credentials.hash_password(user_data.password)
+        await database_session.run_sync(crud.create_user, user_data, hashed_password)
         return RedirectResponse(url="/login", status_code=303)
 
+    except credentials.PasswordHashBusyError as busy_error:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many registrations in progress",
+            headers={"Retry-After": str(busy_error.retry_after)}
+        ) from busy_error
+
     except ValidationError as validation_error:
         error_msg = validation_error.errors()[0]['msg']
         return templates.TemplateResponse("register.html", {
@@ -230,7 +319,7 @@ async def register(
         })
 
 
-@app.get("/profile", response_class=HTMLResponse)
+@router.get("/profile", response_class=HTMLResponse)
 async def profile(request: Request):
     """Страница профиля пользователя."""
     if not hasattr(request.state, 'user'):
@@ -248,7 +337,7 @@ async def profile(request: Request):
     })
 
 
-@app.post("/logout")
+@router.post("/logout")
 async def logout():
     """Выход пользователя из системы."""
     response = RedirectResponse(
@@ -259,100 +348,988 @@ async def logout():
     return response
 
 
-@app.post("/api/upload")
+UPLOAD_REQUEST_BODY = {
+    "content": {
+        "multipart/form-data": {
+            "schema": {
+                "type": "object",
+                "properties": {
+                    "file": {"type": "string", "format": "binary"},
+                    "algorithm": {"type": "string", "description": "Движок сегментации"},
+                    "params": {"type": "string", "description": "Параметры движка (JSON)"},
+                },
+                "required": ["file"],
+            }
+        }
+    },
+    "required": True,
+}
+
+
+@router.post("/api/upload", openapi_extra={"requestBody": UPLOAD_REQUEST_BODY})
 async def upload_image(
         request: Request,
-        file: UploadFile = File(...),
-        database_session: Session = Depends(get_db)
+        tiled: bool = Query(False, description="Потайловая обработка больших изображений"),
+        mode: str = Query("sync", pattern="^(sync|async)$",
+                          description="async - поставить в очередь и сразу ответить 202"),
+        database_session: AsyncSession = Depends(get_db)
 ):
-    """Загрузка и обработка изображения."""
+    """Загрузка и обработка изображения.
+
+    Тело запроса разбирается потоково (см. ingest.ingest_form),
+    поэтому слишком большой файл отклоняется до полного чтения.
+    Необязательные поля algorithm и params выбирают движок сегментации
+    и его параметры (см. /api/engines). С tiled=true изображение
+    обрабатывается тайлами с ограниченной памятью и действует лимит
+    MAX_TILED_UPLOAD_BYTES. С mode=async загрузка сохраняется, ставится
+    в очередь заданий и подтверждается ответом 202 со ссылкой на задание.
+    """
     if not hasattr(request.state, 'user'):
         raise HTTPException(status_code=401, detail="Not authenticated")
 
-    if not file.content_type.startswith('image/'):
-        raise HTTPException(400, "Only images are allowed")
+    try:
+        with telemetry.span("ingest"):
+            form = await ingest_form(
+                request,
+                max_file_bytes=settings.MAX_TILED_UPLOAD_BYTES if tiled else None
+            )
+    except UploadTooLargeError as size_error:
+        raise HTTPException(413, "File too large") from size_error
+    except NotAnImageError as media_error:
+        raise HTTPException(400, "Only images are allowed") from media_error
+    except MalformedUploadError as form_error:
+        raise HTTPException(400, str(form_error)) from form_error
 
-    contents = await file.read()
-    if len(contents) > 10 * 1024 * 1024:  # 10MB
-        raise HTTPException(413, "File too large")
+    try:
+        upload = form.get_file("file")
+        if upload is None:
+            raise HTTPException(400, "File is required")
+        try:
+            engine, params = engines.resolve(
+                form.fields.get("algorithm") or settings.SEGMENTATION_DEFAULT_ENGINE,
+                form.fields.get("params")
+            )
+        except ValueError as params_error:
+            raise HTTPException(400, str(params_error)) from params_error
+        if tiled and engine.tile_halo(params) is None:
+            raise HTTPException(400, f"Algorithm {engine.name} does not support tiled mode")
+
+        if mode == "async":
+            try:
+                job = await job_runner.submit(
+                    database_session, request.state.user.id, upload.getbuffer(),
+                    upload.digest, upload.media_type, engine, params, tiled
+                )
+            except JobLimitError as limit_error:
+                raise HTTPException(
+                    status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                    detail="Too many active jobs",
+                    headers={"Retry-After": str(limit_error.retry_after)}
+                ) from limit_error
+            return JSONResponse(
+                status_code=status.HTTP_202_ACCEPTED,
+                content=job_payload(job),
+                headers={"Location": f"/api/jobs/{job.id}"}
+            )
+
+        try:
+            db_image, cache_hit = await pipeline.segment_upload(
+                database_session,
+                request.state.user.id,
+                upload.getbuffer(),
+                upload.digest,
+                upload.media_type,
+                engine,
+                params,
+                tiled
+            )
+        except ExecutorBusyError as busy_error:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Segmentation queue is full",
+                headers={"Retry-After": str(busy_error.retry_after)}
+            ) from busy_error
+        except ExecutorTimeoutError as timeout_error:
+            raise HTTPException(
+                status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+                detail="Segmentation timed out"
+            ) from timeout_error
+        except ValueError as input_error:
+            # Сигнатура изображения верна, но содержимое не декодируется
+            await database_session.rollback()
+            raise HTTPException(400, str(input_error)) from input_error
+        except Exception as upload_error:
+            await database_session.rollback()
+            raise HTTPException(500, f"Internal error: {str(upload_error)}") from upload_error
+
+        return segmentation_payload(db_image, cache_hit)
+    finally:
+        form.close()
+
+
+BATCH_REQUEST_BODY = {
+    "content": {
+        "multipart/form-data": {
+            "schema": {
+                "type": "object",
+                "properties": {
+                    "files": {
+                        "type": "array",
+                        "items": {"type": "string", "format": "binary"},
+                        "description": "Изображения и/или архивы zip, tar, tar.gz",
+                    },
+                    "algorithm": {"type": "string", "description": "Движок сегментации"},
+                    "params": {"type": "string", "description": "Параметры движка (JSON)"},
+                },
+                "required": ["files"],
+            }
+        }
+    },
+    "required": True,
+}
+
+
+@router.post("/api/upload/batch", openapi_extra={"requestBody": BATCH_REQUEST_BODY})
+async def upload_batch(request: Request):
+    """Пакетная загрузка нескольких изображений или архива.
+
+    Все изображения обрабатываются одним движком. Ответ - поток NDJSON:
+    строка type=item для каждого изображения по мере готовности (в
+    произвольном порядке, index - позиция в пакете) и завершающая строка
+    type=summary с созданными сегментациями, которые записываются одной
+    транзакцией после обработки всего пакета. Ошибки отдельных
+    изображений не прерывают пакет.
+    """
+    if not hasattr(request.state, 'user'):
+        raise HTTPException(status_code=401, detail="Not authenticated")
 
     try:
-        segmented_img = segment_image(contents)
-        db_image = models.Segmentation(
-            user_id=request.state.user.id,
-            original_image=contents,
-            segmented_image=segmented_img
+        form = await ingest_form(
+            request,
+            max_file_bytes=settings.BATCH_MAX_BYTES,
+            max_files=settings.BATCH_MAX_FILES,
+            max_body_bytes=settings.BATCH_MAX_BYTES,
+            allow_archives=True
         )
-        database_session.add(db_image)
-        database_session.commit()
-
-        return {
-            "id": db_image.id,
-            "original_id": db_image.id,
-            "segmented_id": db_image.id,
-            "message": "File uploaded successfully"
-        }
+    except UploadTooLargeError as size_error:
+        raise HTTPException(413, "Batch too large") from size_error
+    except NotAnImageError as media_error:
+        raise HTTPException(400, "Only images and archives are allowed") from media_error
+    except MalformedUploadError as form_error:
+        raise HTTPException(400, str(form_error)) from form_error
 
-    except Exception as upload_error:
-        database_session.rollback()
-        raise HTTPException(500, f"Internal error: {str(upload_error)}") from upload_error
+    try:
+        try:
+            engine, params = engines.resolve(
+                form.fields.get("algorithm") or settings.SEGMENTATION_DEFAULT_ENGINE,
+                form.fields.get("params")
+            )
+            items = await run_in_threadpool(
+                collect_batch_items, form, settings.MAX_UPLOAD_BYTES,
+                settings.BATCH_MAX_FILES, settings.BATCH_MAX_BYTES
+            )
+        except (ValueError, MalformedUploadError) as batch_error:
+            raise HTTPException(400, str(batch_error)) from batch_error
+        if not items:
+            raise HTTPException(400, "No images in batch")
+    except BaseException:
+        form.close()
+        raise
 
+    user_id = request.state.user.id
 
-@app.get("/api/segmented/{image_id}")
-async def get_segmented_image(
-        image_id: int,
-        database_session: Session = Depends(get_db)
+    async def stream():
+        try:
+            async for event, payload in pipeline.segment_batch(user_id, items, engine, params):
+                if event == "item":
+                    yield json.dumps({"type": "item", **payload}) + "\n"
+                    continue
+                succeeded = [
+                    {
+                        "index": index,
+                        "id": row["id"],
+                        "original_url": image_url("original", row["id"], row["original_digest"]),
+                        "segmented_url": image_url(
+                            "segmented", row["id"], row["segmented_digest"]
+                        ),
+                    }
+                    for index, row in payload
+                ]
+                yield json.dumps({
+                    "type": "summary",
+                    "total": len(items),
+                    "succeeded": len(succeeded),
+                    "failed": len(items) - len(succeeded),
+                    "engine": engine.name,
+                    "engine_version": engine.version,
+                    "params": params,
+                    "segmentations": succeeded,
+                }) + "\n"
+        finally:
+            form.close()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+def segmentation_payload(segmentation: models.Segmentation, cache_hit: bool) -> dict:
+    """Описание сегментации для ответа API."""
+    return {
+        "id": segmentation.id,
+        "original_id": segmentation.id,
+        "segmented_id": segmentation.id,
+        "original_url": image_url("original", segmentation.id, segmentation.original_digest),
+        "segmented_url": image_url("segmented", segmentation.id, segmentation.segmented_digest),
+        "original_thumb_url": thumb_url(
+            "original", segmentation.id, segmentation.original_digest,
+            max(settings.THUMBNAIL_SIZES)
+        ),
+        "segmented_thumb_url": thumb_url(
+            "segmented", segmentation.id, segmentation.segmented_digest,
+            max(settings.THUMBNAIL_SIZES)
+        ),
+        "engine": segmentation.engine,
+        "engine_version": segmentation.engine_version,
+        "params": json.loads(segmentation.engine_params) if segmentation.engine_params else None,
+        "cached": cache_hit,
+        "message": "File uploaded successfully"
+    }
+
+
+def job_payload(job: models.Job, segmentation: Optional[models.Segmentation] = None) -> dict:
+    """Описание задания для ответа API."""
+    def timestamp(value):
+        return value.isoformat() if value else None
+
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "engine": job.engine,
+        "tiled": bool(job.tiled),
+        "attempts": job.attempts,
+        "error": job.error,
+        "created_at": timestamp(job.created_at),
+        "started_at": timestamp(job.started_at),
+        "finished_at": timestamp(job.finished_at),
+        "status_url": f"/api/jobs/{job.id}",
+        "events_url": f"/api/jobs/{job.id}/events",
+        "result": segmentation_payload(segmentation, job.cached) if segmentation else None,
+    }
+
+
+async def load_job_payload(database_session: AsyncSession, job_id: int,
+                           user_id: int) -> Optional[dict]:
+    """Описание задания пользователя (None, если задание не найдено или чужое)."""
+    database_session.expire_all()
+    job = await database_session.run_sync(crud.get_job, job_id)
+    if job is None or job.user_id != user_id:
+        return None
+    segmentation = None
+    if job.status == models.JOB_DONE and job.segmentation_id:
+        segmentation = await database_session.get(models.Segmentation, job.segmentation_id)
+    return job_payload(job, segmentation)
+
+
+@router.get("/api/jobs/{job_id}")
+async def get_job_status(
+        job_id: int,
+        request: Request,
+        database_session: AsyncSession = Depends(get_db)
+):
+    """Состояние задания и, после завершения, результат сегментации."""
+    payload = await load_job_payload(database_session, job_id, request.state.user.id)
+    if payload is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return payload
+
+
+# Период комментариев-пингов в потоке SSE, чтобы прокси не закрывали соединение
+SSE_KEEPALIVE_SECONDS = 15.0
+
+
+@router.get("/api/jobs/{job_id}/events")
+async def job_events(
+        job_id: int,
+        request: Request,
+        database_session: AsyncSession = Depends(get_db)
 ):
-    """Получение сегментированного изображения по ID."""
-    image = database_session.query(models.Segmentation).filter(
-        models.Segmentation.id == image_id
-    ).first()
+    """Поток Server-Sent Events с изменениями состояния задания.
+
+    Событие status отправляется при каждом изменении; поток закрывается
+    после done или failed. Изменения в этом процессе приходят сразу,
+    из других процессов - с периодом JOB_POLL_INTERVAL.
+    """
+    user_id = request.state.user.id
+    if await load_job_payload(database_session, job_id, user_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def stream():
+        changed = job_runner.subscribe(job_id)
+        last_payload = None
+        last_sent = time.monotonic()
+        try:
+            while not await request.is_disconnected():
+                changed.clear()
+                async with AsyncSessionLocal() as events_session:
+                    payload = await load_job_payload(events_session, job_id, user_id)
+                if payload is None:
+                    return
+                if payload != last_payload:
+                    yield f"event: status\ndata: {json.dumps(payload)}\n\n"
+                    last_payload, last_sent = payload, time.monotonic()
+                    if payload["status"] in FINAL_STATUSES:
+                        return
+                elif time.monotonic() - last_sent > SSE_KEEPALIVE_SECONDS:
+                    yield ": keepalive\n\n"
+                    last_sent = time.monotonic()
+                try:
+                    await asyncio.wait_for(changed.wait(), settings.JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            job_runner.unsubscribe(job_id, changed)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+# Результаты неизменяемы, поэтому URL с версией (?v=<digest>) кешируется навсегда
+IMMUTABLE_CACHE_CONTROL = "private, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "private, no-cache"
+
+
+def image_url(kind: str, image_id: int, digest: str) -> str:
+    """Кешируемый URL изображения с версией по хешу содержимого."""
+    return f"/api/{kind}/{image_id}?v={digest}"
+
+
+def thumb_url(kind: str, image_id: int, digest: str, size: int) -> str:
+    """Кешируемый URL миниатюры с версией по хешу исходного объекта."""
+    return f"/api/thumb/{image_id}/{size}?kind={kind}&v={digest}"
+
+
+def thumb_etag(source_digest: str, size: int) -> str:
+    """ETag миниатюры: она однозначно определяется исходным объектом и размером."""
+    return f"{source_digest}-{size}"
+
+
+def etag_matches(request: Request, digest: str) -> bool:
+    """Проверка заголовка If-None-Match по хешу содержимого."""
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match or not digest:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == f'"{digest}"':
+            return True
+    return False
+
+
+def cache_headers(digest: str, version: Optional[str]) -> dict:
+    """Заголовки валидации и кеширования для объекта."""
+    return {
+        "ETag": f'"{digest}"',
+        "Cache-Control": (
+            IMMUTABLE_CACHE_CONTROL if version == digest else REVALIDATE_CACHE_CONTROL
+        ),
+    }
+
+
+def not_modified_response(digest: str, version: Optional[str]) -> Response:
+    """Ответ 304 Not Modified."""
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED,
+                    headers=cache_headers(digest, version))
+
+
+def read_mask(digest: str):
+    """Чтение маски результата из хранилища."""
+    return masks.load_mask(blob_store.read(digest))
+
+
+async def blob_response(request: Request, digest: str, media_type: str,
+                        version: Optional[str] = None, etag: Optional[str] = None) -> Response:
+    """Ответ с содержимым объекта из хранилища.
+
+    Локальные объекты отдаются через FileResponse (sendfile) с поддержкой
+    Range, остальные - потоком блоками. Упакованные маски отрисовываются
+    в PNG по запросу. Сильный ETag по умолчанию равен хешу содержимого,
+    поэтому повторный запрос с If-None-Match получает 304.
+    """
+    if not digest:
+        raise HTTPException(status_code=404, detail="Image not found")
+    etag = etag or digest
+    if etag_matches(request, etag):
+        return not_modified_response(etag, version)
+
+    headers = cache_headers(etag, version)
+    if media_type == masks.MASK_MEDIA_TYPE:
+        with telemetry.span("mask_render"):
+            mask = await run_in_threadpool(read_mask, digest)
+            png = await run_in_threadpool(masks.render_png, mask)
+        return Response(content=png, media_type="image/png", headers=headers)
+    path = blob_store.local_path(digest)
+    if path is not None:
+        return FileResponse(path, media_type=media_type, headers=headers)
+    if not blob_store.exists(digest):
+        raise HTTPException(status_code=404, detail="Image not found")
+    return StreamingResponse(blob_store.iter_chunks(digest), media_type=media_type,
+                             headers=headers)
+
+
+async def image_response(request: Request, database_session: AsyncSession, image_id: int,
+                         kind: str, version: Optional[str]) -> Response:
+    """Ответ с изображением сегментации с учётом условных заголовков.
+
+    Если клиент прислал ETag, совпадающий с версией из URL, ответ 304
+    формируется без обращения к БД.
+    """
+    if version and etag_matches(request, version):
+        return not_modified_response(version, version)
+
+    with telemetry.span("image_ref"):
+        image = await database_session.run_sync(crud.get_image_ref, image_id, kind)
     if not image:
         raise HTTPException(status_code=404, detail="Image not found")
+    return await blob_response(request, image.digest, image.media_type, version)
 
-    return Response(content=image.segmented_image, media_type="image/jpeg")
 
+async def thumbnail_response(request: Request, database_session: AsyncSession, image_id: int,
+                             kind: str, size: int, version: Optional[str]) -> Response:
+    """Ответ с миниатюрой изображения сегментации.
+
+    Миниатюры обычно уже построены фоновой очередью после загрузки;
+    если нет - строятся при первом запросе. ETag зависит только от
+    исходного объекта и размера, поэтому 304 отдаётся без обращения к БД.
+    """
+    if size not in settings.THUMBNAIL_SIZES:
+        raise HTTPException(status_code=400, detail="Unsupported thumbnail size")
+    if version and etag_matches(request, thumb_etag(version, size)):
+        tag = thumb_etag(version, size)
+        return not_modified_response(tag, tag)
+
+    image = await database_session.run_sync(crud.get_image_ref, image_id, kind)
+    if not image or not image.digest:
+        raise HTTPException(status_code=404, detail="Image not found")
+    tag = thumb_etag(image.digest, size)
+    # Миниатюра кешируется навсегда, если URL закреплён за версией оригинала
+    pinned = tag if version == image.digest else None
+    if etag_matches(request, tag):
+        return not_modified_response(tag, pinned)
 
-@app.get("/api/original/{image_id}")
+    try:
+        thumbnail = await derivative_queue.get(
+            database_session, image.digest, image.media_type, size
+        )
+    except ValueError as render_error:
+        raise HTTPException(status_code=404, detail="Thumbnail not available") from render_error
+    return await blob_response(request, thumbnail.digest, thumbnail.media_type,
+                               pinned, etag=tag)
+
+
+@router.get("/api/segmented/{image_id}")
+async def get_segmented_image(
+        image_id: int,
+        request: Request,
+        v: Optional[str] = None,
+        size: Optional[int] = Query(None, description="Миниатюра из THUMBNAIL_SIZES"),
+        database_session: AsyncSession = Depends(get_db)
+):
+    """Получение сегментированного изображения по ID (или его миниатюры)."""
+    if size is not None:
+        return await thumbnail_response(request, database_session, image_id, "segmented", size, v)
+    return await image_response(request, database_session, image_id, "segmented", v)
+
+
+@router.get("/api/original/{image_id}")
 async def get_original_image(
         image_id: int,
-        database_session: Session = Depends(get_db)
+        request: Request,
+        v: Optional[str] = None,
+        size: Optional[int] = Query(None, description="Миниатюра из THUMBNAIL_SIZES"),
+        database_session: AsyncSession = Depends(get_db)
 ):
-    """Получение оригинального изображения по ID."""
-    image = database_session.query(models.Segmentation).filter(
-        models.Segmentation.id == image_id
-    ).first()
-    if not image:
-        raise HTTPException(status_code=404, detail="Image not found")
-    return Response(content=image.original_image, media_type="image/jpeg")
+    """Получение оригинального изображения по ID (или его миниатюры)."""
+    if size is not None:
+        return await thumbnail_response(request, database_session, image_id, "original", size, v)
+    return await image_response(request, database_session, image_id, "original", v)
 
 
-@app.post("/api/feedback/{image_id}")
-async def save_feedback(
+@router.get("/api/thumb/{image_id}/{size}")
+async def get_thumbnail(
         image_id: int,
-        feedback: schemas.FeedbackRequest,
-        database_session: Session = Depends(get_db)
+        size: int,
+        request: Request,
+        kind: str = Query("original", pattern="^(original|segmented)$"),
+        v: Optional[str] = None,
+        database_session: AsyncSession = Depends(get_db)
 ):
-    """Сохранение оценки качества сегментации."""
-    image = database_session.query(models.Segmentation).filter(
-        models.Segmentation.id == image_id
-    ).first()
-    if not image:
+    """Миниатюра WebP оригинала или результата сегментации."""
+    return await thumbnail_response(request, database_session, image_id, kind, size, v)
+
+
+@router.get("/api/mask/{image_id}")
+async def get_mask(
+        image_id: int,
+        request: Request,
+        mask_format: str = Query("rle", alias="format", pattern="^(rle|packed)$"),
+        v: Optional[str] = None,
+        database_session: AsyncSession = Depends(get_db)
+):
+    """Получение маски сегментации для внешних инструментов.
+
+    Форматы: ``rle`` - JSON с несжатым RLE формата COCO,
+    ``packed`` - упакованная маска (см. masks.pack_mask).
+    """
+    if v and etag_matches(request, v):
+        return not_modified_response(v, v)
+
+    image = await database_session.run_sync(crud.get_image_ref, image_id, "segmented")
+    if not image or not image.digest:
         raise HTTPException(status_code=404, detail="Image not found")
+    if etag_matches(request, image.digest):
+        return not_modified_response(image.digest, v)
+
+    headers = cache_headers(image.digest, v)
+    data = await run_in_threadpool(blob_store.read, image.digest)
+    if mask_format == "packed":
+        if not masks.is_packed_mask(data):
+            data = await run_in_threadpool(lambda: masks.pack_mask(masks.load_mask(data)))
+        return Response(content=data, media_type=masks.MASK_MEDIA_TYPE, headers=headers)
+
+    rle = await run_in_threadpool(lambda: masks.encode_rle(masks.load_mask(data)))
+    return JSONResponse(content=rle, headers=headers)
 
-    image.is_good = feedback.is_good
-    database_session.commit()
+
+@router.post("/api/feedback/{image_id}")
+async def save_feedback(image_id: int, feedback: schemas.FeedbackRequest):
+    """Сохранение оценки качества сегментации (групповой фиксацией, см. writes)."""
+    if not await write_batcher.set_feedback(image_id, feedback.is_good):
+        raise HTTPException(status_code=404, detail="Image not found")
 
     return {"status": "success", "image_id": image_id}
 
 
-@app.delete("/api/user/by-username/{username}")
+def encode_cursor(created_at: datetime, segmentation_id: int) -> str:
+    """Непрозрачный курсор истории из ключа последней строки страницы."""
+    raw = json.dumps([created_at.isoformat(), segmentation_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    """Ключ (created_at, id) из курсора истории.
+
+    Raises:
+        ValueError: Если курсор повреждён
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, segmentation_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), int(segmentation_id)
+    except (TypeError, ValueError) as cursor_error:
+        raise ValueError("Invalid cursor") from cursor_error
+
+
+@router.get("/api/segmentations", response_model=schemas.SegmentationPage)
+async def list_segmentations(
+        request: Request,
+        limit: int = Query(50, ge=1, le=200),
+        cursor: Optional[str] = Query(None, description="next_cursor предыдущей страницы"),
+        feedback: Optional[str] = Query(None, pattern="^(good|bad|unrated)$"),
+        created_from: Optional[datetime] = Query(None, description="Не раньше (ISO 8601)"),
+        created_to: Optional[datetime] = Query(None, description="Раньше (ISO 8601)"),
+        database_session: AsyncSession = Depends(get_db)
+):
+    """История загрузок пользователя от новых к старым.
+
+    Страницы выбираются по курсору (created_at, id), а не по смещению,
+    поэтому время ответа не растёт с глубиной страницы и размером истории.
+    Содержимое изображений не читается: в ответе только метаданные и URL.
+    """
+    try:
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError as cursor_error:
+        raise HTTPException(status_code=400, detail=str(cursor_error)) from cursor_error
+
+    rows = await database_session.run_sync(
+        crud.list_segmentations, request.state.user.id, limit + 1, after,
+        feedback, created_from, created_to
+    )
+    page, has_more = rows[:limit], len(rows) > limit
+    thumb_size = min(settings.THUMBNAIL_SIZES)
+    return {
+        "items": [
+            {
+                **row._asdict(),
+                "original_url": image_url("original", row.id, row.original_digest),
+                "segmented_url": image_url("segmented", row.id, row.segmented_digest),
+                "original_thumb_url": thumb_url("original", row.id, row.original_digest, thumb_size),
+                "segmented_thumb_url": thumb_url(
+                    "segmented", row.id, row.segmented_digest, thumb_size
+                ),
+            }
+            for row in page
+        ],
+        "next_cursor": encode_cursor(page[-1].created_at, page[-1].id) if has_more else None,
+    }
+
+
+def evaluation_payload(evaluation: models.Evaluation) -> dict:
+    """Описание оценки сегментации для ответа API."""
+    return {
+        "segmentation_id": evaluation.segmentation_id,
+        "metrics": {metric: getattr(evaluation, metric) for metric in models.EVALUATION_METRICS},
+        "boundary_tolerance": evaluation.boundary_tolerance,
+        "truth_digest": evaluation.truth_digest,
+        "created_at": evaluation.created_at.isoformat() if evaluation.created_at else None,
+    }
+
+
+def ground_truth_id(filename: str) -> Optional[int]:
+    """ID сегментации из имени файла эталона пакета ("123.png" -> 123)."""
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    return int(stem) if stem.isdigit() else None
+
+
+async def ingest_ground_truth(request: Request, batch: bool):
+    """Разбор формы с эталонными масками (ошибки приёма переводятся в HTTP)."""
+    try:
+        if batch:
+            return await ingest_form(
+                request,
+                max_file_bytes=settings.BATCH_MAX_BYTES,
+                max_files=settings.BATCH_MAX_FILES,
+                max_body_bytes=settings.BATCH_MAX_BYTES,
+                allow_archives=True
+            )
+        return await ingest_form(request)
+    except UploadTooLargeError as size_error:
+        raise HTTPException(413, "File too large") from size_error
+    except NotAnImageError as media_error:
+        raise HTTPException(400, "Only images are allowed") from media_error
+    except MalformedUploadError as form_error:
+        raise HTTPException(400, str(form_error)) from form_error
+
+
+@router.post("/api/eval/batch", openapi_extra={"requestBody": BATCH_REQUEST_BODY})
+async def evaluate_batch(
+        request: Request,
+        database_session: AsyncSession = Depends(get_db)
+):
+    """Пакетная загрузка эталонных масок.
+
+    Поля files - изображения масок и/или архивы zip/tar; имя каждого
+    файла без расширения - ID сегментации ("123.png"). Метрики всех
+    масок считаются пакетами и записываются одной транзакцией.
+    """
+    form = await ingest_ground_truth(request, batch=True)
+    try:
+        try:
+            items = await run_in_threadpool(
+                collect_batch_items, form, settings.MAX_UPLOAD_BYTES,
+                settings.BATCH_MAX_FILES, settings.BATCH_MAX_BYTES
+            )
+        except MalformedUploadError as batch_error:
+            raise HTTPException(400, str(batch_error)) from batch_error
+
+        results = [
+            {"filename": item.name, "segmentation_id": ground_truth_id(item.name)}
+            for item in items
+        ]
+        truths, positions = [], []
+        for position, (item, result) in enumerate(zip(items, results)):
+            if item.error:
+                result["error"] = item.error
+            elif result["segmentation_id"] is None:
+                result["error"] = "File name must be a segmentation ID"
+            else:
+                truths.append(pipeline.GroundTruth(result["segmentation_id"], item.data, item.digest))
+                positions.append(position)
+
+        outputs = await pipeline.evaluate_segmentations(
+            database_session, request.state.user.id, truths
+        )
+        for position, output in zip(positions, outputs):
+            if isinstance(output, str):
+                results[position]["error"] = output
+            else:
+                results[position]["metrics"] = output
+    finally:
+        form.close()
+
+    evaluated = sum("metrics" in result for result in results)
+    return {
+        "evaluated": evaluated,
+        "failed": len(results) - evaluated,
+        "boundary_tolerance": settings.EVAL_BOUNDARY_TOLERANCE,
+        "results": results,
+    }
+
+
+@router.get("/api/eval/summary")
+async def evaluation_summary(
+        request: Request,
+        engine: Optional[str] = None,
+        database_session: AsyncSession = Depends(get_db)
+):
+    """Сводка оценок пользователя по движкам: число, среднее, минимум и максимум метрик."""
+    rows = await database_session.run_sync(
+        crud.evaluation_summary, request.state.user.id, engine
+    )
+    return {
+        "groups": [
+            {
+                "engine": row.engine,
+                "engine_version": row.engine_version,
+                "count": row.count,
+                "metrics": {
+                    metric: {
+                        "mean": getattr(row, f"mean_{metric}"),
+                        "min": getattr(row, f"min_{metric}"),
+                        "max": getattr(row, f"max_{metric}"),
+                    }
+                    for metric in models.EVALUATION_METRICS
+                },
+            }
+            for row in rows
+        ],
+    }
+
+
+@router.post("/api/eval/{segmentation_id}", openapi_extra={"requestBody": UPLOAD_REQUEST_BODY})
+async def evaluate_segmentation(
+        segmentation_id: int,
+        request: Request,
+        database_session: AsyncSession = Depends(get_db)
+):
+    """Загрузка эталонной маски сегментации и расчёт метрик.
+
+    Поле file - изображение маски того же размера, что и оригинал
+    (ненулевые пиксели - передний план). Повторная загрузка заменяет оценку.
+    """
+    form = await ingest_ground_truth(request, batch=False)
+    try:
+        upload = form.get_file("file")
+        if upload is None:
+            raise HTTPException(400, "File is required")
+        (output,) = await pipeline.evaluate_segmentations(
+            database_session, request.state.user.id,
+            [pipeline.GroundTruth(segmentation_id, upload.getbuffer(), upload.digest)]
+        )
+    finally:
+        form.close()
+
+    if output == pipeline.SEGMENTATION_NOT_FOUND:
+        raise HTTPException(status_code=404, detail="Image not found")
+    if isinstance(output, str):
+        raise HTTPException(status_code=400, detail=output)
+    evaluation = await database_session.run_sync(
+        crud.get_evaluation, segmentation_id, request.state.user.id
+    )
+    return evaluation_payload(evaluation)
+
+
+@router.get("/api/eval/{segmentation_id}")
+async def get_evaluation(
+        segmentation_id: int,
+        request: Request,
+        database_session: AsyncSession = Depends(get_db)
+):
+    """Сохранённая оценка сегментации."""
+    evaluation = await database_session.run_sync(
+        crud.get_evaluation, segmentation_id, request.state.user.id
+    )
+    if evaluation is None:
+        raise HTTPException(status_code=404, detail="Evaluation not found")
+    return evaluation_payload(evaluation)
+
+
+def feedback_counts(row) -> dict:
+    """Счётчики оценок строки статистики с долями."""
+    total, good, bad = row.total or 0, row.good or 0, row.bad or 0
+    unrated = total - good - bad
+    return {
+        "total": total,
+        "good": good,
+        "bad": bad,
+        "unrated": unrated,
+        "good_share": good / total if total else None,
+        "bad_share": bad / total if total else None,
+        "unrated_share": unrated / total if total else None,
+    }
+
+
+@router.get("/api/stats")
+async def get_stats(
+        request: Request,
+        days: int = Query(30, ge=1, le=366, description="Глубина разбивки по дням"),
+        scope: str = Query("user", pattern="^(user|all)$",
+                           description="all - по всем пользователям (только администратор)"),
+        database_session: AsyncSession = Depends(get_db)
+):
+    """Доли хороших, плохих и неоценённых сегментаций по движкам и дням.
+
+    Ответ строится из счётчиков feedback_stats, которые обновляются при
+    загрузке и оценке, поэтому время ответа не зависит от размера истории.
+    """
+    user = request.state.user
+    if scope == "all" and not user.is_admin:
+        raise HTTPException(status_code=403, detail="Admin access required")
+
+    since = (datetime.now(timezone.utc) - timedelta(days=days - 1)).date()
+    stats = await database_session.run_sync(
+        crud.feedback_stats, None if scope == "all" else user.id, since
+    )
+    by_engine = [
+        {"engine": row.engine or None, **feedback_counts(row)} for row in stats["by_engine"]
+    ]
+    totals = {
+        name: sum(getattr(row, name) or 0 for row in stats["by_engine"])
+        for name in ("total", "good", "bad")
+    }
+    payload = {
+        "scope": scope,
+        "since": since.isoformat(),
+        "totals": feedback_counts(SimpleNamespace(**totals)),
+        "by_engine": by_engine,
+        "by_day": [
+            {"day": str(row.day), **feedback_counts(row)} for row in stats["by_day"]
+        ],
+    }
+    if scope == "all":
+        payload["by_user"] = [
+            {"user_id": row.user_id, **feedback_counts(row)} for row in stats["by_user"]
+        ]
+    return payload
+
+
+@router.get("/api/export")
+async def export_dataset(
+        request: Request,
+        archive: str = Query("tar", pattern="^(tar|zip)$"),
+        manifest: str = Query("csv", pattern="^(csv|jsonl)$"),
+        mask_format: str = Query("png", pattern="^(png|packed)$",
+                                 description="packed - маски в формате хранения"),
+        originals: bool = Query(True, description="Включать оригиналы"),
+        feedback: Optional[str] = Query(None, pattern="^(good|bad|unrated|rated)$"),
+        engine: Optional[str] = None,
+        created_from: Optional[datetime] = Query(None, description="Не раньше (ISO 8601)"),
+        created_to: Optional[datetime] = Query(None, description="Раньше (ISO 8601)"),
+        after: Optional[int] = Query(None, ge=0, description="Продолжить после ID"),
+        limit: Optional[int] = Query(None, ge=1),
+        scope: str = Query("user", pattern="^(user|all)$",
+                           description="all - по всем пользователям (только администратор)")
+):
+    """Потоковая выгрузка сегментаций архивом tar или zip.
+
+    Архив содержит originals/<id>.<ext>, masks/<id>.png, манифест
+    manifest.csv (или .jsonl) и сводку export.json. Записи идут по
+    возрастанию ID, поэтому прерванную выгрузку можно продолжить с
+    after=<ID последней полной записи>; при заданном limit следующее
+    значение after есть в export.json (next_after).
+    """
+    user = request.state.user
+    if scope == "all" and not user.is_admin:
+        raise HTTPException(status_code=403, detail="Admin access required")
+
+    filters = {
+        "feedback": feedback,
+        "engine": engine,
+        "created_from": created_from,
+        "created_to": created_to,
+    }
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
+    return StreamingResponse(
+        export.export_archive(
+            None if scope == "all" else user.id, filters,
+            archive_format=archive,
+            manifest_format=manifest,
+            mask_format=mask_format,
+            include_originals=originals,
+            after=after,
+            limit=limit,
+            yield_per=settings.EXPORT_YIELD_PER,
+            spool_bytes=settings.EXPORT_MANIFEST_SPOOL_BYTES
+        ),
+        media_type=export.ARCHIVE_MEDIA_TYPES[archive],
+        headers={"Content-Disposition": f'attachment; filename="export-{stamp}.{archive}"'}
+    )
+
+
+@router.get("/api/engines")
+async def list_engines():
+    """Доступные движки сегментации, их параметры, версии и классы стоимости."""
+    return {
+        "default": settings.SEGMENTATION_DEFAULT_ENGINE,
+        "engines": [
+            {
+                **description,
+                "working_megapixels": working_megapixels(engines.get_engine(description["name"])),
+            }
+            for description in engines.list_engines()
+        ],
+    }
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics(request: Request):
+    """Метрики в текстовом формате Prometheus.
+
+    При заданном METRICS_TOKEN нужен заголовок Authorization: Bearer <токен>
+    (вход не требуется); без токена метрики доступны только администратору.
+    """
+    if not settings.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    if settings.METRICS_TOKEN:
+        if not telemetry.metrics_token_valid(request.headers.get("authorization")):
+            raise HTTPException(status_code=401, detail="Invalid metrics token")
+    elif not request.state.user.is_admin:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return PlainTextResponse(
+        telemetry.registry.render(),
+        media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+@router.get("/api/cache/stats")
+async def cache_stats():
+    """Статистика кешей результатов сегментации и пользователей."""
+    return {
+        "results": pipeline.result_cache_stats(),
+        "users": auth.user_cache.stats(),
+    }
+
+
+def deletion_payload(deletion: models.UserDeletion) -> dict:
+    """Описание удаления пользователя для ответа API."""
+    def timestamp(value):
+        return value.isoformat() if value else None
+
+    return {
+        "username": deletion.username,
+        "status": deletion.status,
+        "total": deletion.total,
+        "deleted": deletion.deleted,
+        "blobs_deleted": deletion.blobs_deleted,
+        "error": deletion.error,
+        "created_at": timestamp(deletion.created_at),
+        "finished_at": timestamp(deletion.finished_at),
+        "status_url": f"{USER_DELETIONS_PATH}{deletion.token}",
+    }
+
+
+@router.delete("/api/user/by-username/{username}")
 async def delete_user_by_username(
         username: str,
         request: Request,
-        database_session: Session = Depends(get_db)
+        database_session: AsyncSession = Depends(get_db)
 ):
-    """Удаление пользователя по username."""
+    """Удаление пользователя по username.
+
+    Аккаунт деактивируется сразу, данные удаляются в фоне пачками.
+    Ответ 202 содержит status_url для отслеживания прогресса.
+    """
     if not hasattr(request.state, 'user'):
         raise HTTPException(status_code=401, detail="Not authenticated")
 
@@ -361,27 +1338,62 @@ async def delete_user_by_username(
     if current_user.username != username and not current_user.is_admin:
         raise HTTPException(status_code=403, detail="No permission to delete")
 
-    db_user = crud.get_user(database_session, username=username)
+    db_user = await database_session.run_sync(crud.get_user, username)
     if not db_user:
         raise HTTPException(status_code=404, detail="User not found")
 
     try:
-        database_session.query(models.Segmentation).filter(
-            models.Segmentation.user_id == db_user.id
-        ).delete()
-        database_session.delete(db_user)
-        database_session.commit()
-
-        if current_user.username == username:
-            response = JSONResponse(
-                content={"message": "User deleted successfully"},
-                status_code=200
-            )
-            response.delete_cookie("access_token")
-            return response
-
-        return db_user
-
+        deletion = await user_deletions.request(database_session, db_user)
     except Exception as delete_error:
-        database_session.rollback()
+        await database_session.rollback()
         raise HTTPException(status_code=500, detail=str(delete_error)) from delete_error
+    auth.invalidate_user(username)
+
+    response = JSONResponse(
+        content=deletion_payload(deletion),
+        status_code=status.HTTP_202_ACCEPTED
+    )
+    if current_user.username == username:
+        response.delete_cookie("access_token")
+    return response
+
+
+@router.get(USER_DELETIONS_PATH + "{token}")
+async def get_user_deletion(token: str, database_session: AsyncSession = Depends(get_db)):
+    """Состояние удаления пользователя по токену из ответа DELETE."""
+    deletion = await database_session.run_sync(crud.get_user_deletion, token)
+    if deletion is None:
+        raise HTTPException(status_code=404, detail="Deletion not found")
+    return deletion_payload(deletion)
+
+
+def create_app() -> FastAPI:
+    """Создание экземпляра приложения.
+
+    Собирает маршруты, статику и middleware; к БД и файлам не обращается,
+    так что вызов дёшев (например, ``uvicorn --factory app.main:create_app``).
+
+    Returns:
+        FastAPI: Новое приложение
+    """
+    application = FastAPI(lifespan=lifespan)
+    application.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
+    application.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    application.middleware("http")(auth_middleware)
+    # Метрики подключаются последними, чтобы замерять и проверку аутентификации
+    if settings.METRICS_ENABLED:
+        application.add_middleware(
+            telemetry.TelemetryMiddleware,
+            profiler=telemetry.SamplingProfiler.from_settings()
+        )
+    application.include_router(router)
+    return application
+
+
+app = create_app()
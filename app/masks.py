@@ -0,0 +1,258 @@
+"""Модуль представления бинарных масок сегментации.
+
+Содержит функции для:
+- компактного хранения маски (1 бит на пиксель, сжатие zlib)
+- прореживания упакованной маски без распаковки целиком
+- кодирования маски в RLE формата COCO
+- отрисовки маски в PNG без потерь
+"""
+
+from __future__ import annotations
+
+import struct
+import zlib
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import numpy as np
+
+MASK_MEDIA_TYPE = "application/x-imageseg-mask"
+
+# Заголовок: сигнатура, высота, ширина
+_HEADER = struct.Struct("<4sII")
+_MAGIC = b"MSK1"
+# Порция сжатых и распакованных данных при потоковом чтении маски
+_STREAM_CHUNK = 64 * 1024
+
+
+def pack_mask(mask: np.ndarray) -> bytes:
+    """Упаковка маски: биты строк через np.packbits, затем zlib.
+
+    Args:
+        mask: Двумерный массив, ненулевые элементы - передний план
+
+    Returns:
+        bytes: Упакованная маска
+    """
+    import numpy as np
+
+    height, width = mask.shape
+    packed = np.packbits(mask.astype(bool, copy=False), axis=-1)
+    return pack_packed(packed, height, width)
+
+
+def pack_packed(packed: np.ndarray, height: int, width: int) -> bytes:
+    """Упаковка маски, биты которой уже упакованы по строкам.
+
+    Args:
+        packed: Массив uint8 формы (height, ceil(width / 8))
+        height: Высота маски
+        width: Ширина маски
+
+    Returns:
+        bytes: Упакованная маска
+    """
+    import numpy as np
+
+    return _HEADER.pack(_MAGIC, height, width) + zlib.compress(
+        np.ascontiguousarray(packed).data, 1
+    )
+
+
+def is_packed_mask(data: bytes) -> bool:
+    """Проверка, что данные - упакованная маска."""
+    return bytes(data[:4]) == _MAGIC
+
+
+def unpack_packed(data: bytes) -> tuple:
+    """Распаковка до массива упакованных битов без развёртки в байты.
+
+    Args:
+        data: Упакованная маска
+
+    Returns:
+        tuple: Массив uint8 формы (height, ceil(width / 8)) и ширина маски
+
+    Raises:
+        ValueError: Если данные не являются упакованной маской
+    """
+    import numpy as np
+
+    magic, height, width = _HEADER.unpack_from(data)
+    if magic != _MAGIC:
+        raise ValueError("Not a packed mask")
+    packed = np.frombuffer(zlib.decompress(data[_HEADER.size:]), dtype=np.uint8)
+    return packed.reshape(height, (width + 7) // 8), width
+
+
+def mask_dimensions(data: bytes) -> tuple:
+    """Размеры упакованной маски (высота, ширина) по заголовку.
+
+    Raises:
+        ValueError: Если данные не являются упакованной маской
+    """
+    magic, height, width = _HEADER.unpack_from(data)
+    if magic != _MAGIC:
+        raise ValueError("Not a packed mask")
+    return height, width
+
+
+def sample_mask(data: bytes, step: int) -> np.ndarray:
+    """Каждая step-я строка и каждый step-й столбец упакованной маски.
+
+    Маска распаковывается потоково порциями: в памяти одновременно
+    только порция упакованных строк и выбранные строки, а не вся маска.
+
+    Args:
+        data: Упакованная маска
+        step: Шаг прореживания (1 - без прореживания)
+
+    Returns:
+        np.ndarray: Булев массив формы (ceil(h / step), ceil(w / step))
+
+    Raises:
+        ValueError: Если данные не являются упакованной маской или повреждены
+    """
+    import numpy as np
+
+    height, width = mask_dimensions(data)
+    row_bytes = (width + 7) // 8
+    source = memoryview(data)[_HEADER.size:]
+    decompressor = zlib.decompressobj()
+    pending = bytearray()
+    parts, row = [], 0
+
+    def take_rows():
+        nonlocal row
+        count = len(pending) // row_bytes
+        if not count:
+            return
+        block = np.frombuffer(pending, np.uint8, count=count * row_bytes).reshape(count, row_bytes)
+        first = -row % step
+        if first < count:
+            unpacked = np.unpackbits(block[first::step], axis=-1, count=width)
+            parts.append(np.ascontiguousarray(unpacked[:, ::step]))
+        # bytearray нельзя укоротить, пока на него есть представление
+        del block
+        del pending[:count * row_bytes]
+        row += count
+
+    try:
+        for start in range(0, len(source), _STREAM_CHUNK):
+            chunk = source[start:start + _STREAM_CHUNK]
+            while chunk:
+                pending += decompressor.decompress(chunk, _STREAM_CHUNK)
+                chunk = decompressor.unconsumed_tail
+                take_rows()
+        pending += decompressor.flush()
+        take_rows()
+    except zlib.error as error:
+        raise ValueError("Corrupted packed mask") from error
+    if row < height:
+        raise ValueError("Corrupted packed mask")
+    sampled = np.concatenate(parts) if parts else np.zeros((0, -(-width // step)), np.uint8)
+    return sampled[:-(-height // step)].view(bool)
+
+
+def unpack_mask(data: bytes) -> np.ndarray:
+    """Распаковка маски.
+
+    Args:
+        data: Упакованная маска
+
+    Returns:
+        np.ndarray: Булев массив формы (height, width)
+    """
+    import numpy as np
+
+    packed, width = unpack_packed(data)
+    return np.unpackbits(packed, axis=-1, count=width).view(bool)
+
+
+def load_mask(data: bytes) -> np.ndarray:
+    """Загрузка маски из упакованного вида или из изображения.
+
+    Изображения (например, JPEG-маски, сохранённые до перехода на
+    упакованный формат) бинаризуются по порогу 127.
+
+    Args:
+        data: Упакованная маска или закодированное изображение
+
+    Returns:
+        np.ndarray: Булев массив формы (height, width)
+
+    Raises:
+        ValueError: Если данные не удалось декодировать
+    """
+    import cv2
+    import numpy as np
+
+    if is_packed_mask(data):
+        return unpack_mask(data)
+    image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        raise ValueError("Cannot decode mask image")
+    return image > 127
+
+
+def encode_rle(mask: np.ndarray) -> dict:
+    """Кодирование маски в несжатый RLE формата COCO.
+
+    Пиксели обходятся по столбцам (порядок Fortran), первая длина
+    серии всегда относится к фону и может быть нулевой.
+
+    Args:
+        mask: Булев массив формы (height, width)
+
+    Returns:
+        dict: {"size": [height, width], "counts": [...]}
+    """
+    import numpy as np
+
+    height, width = mask.shape
+    flat = mask.ravel(order="F").astype(np.int8, copy=False)
+    boundaries = np.flatnonzero(np.diff(flat)) + 1
+    edges = np.concatenate(([0], boundaries, [flat.size]))
+    counts = np.diff(edges)
+    if flat.size and flat[0]:
+        counts = np.concatenate(([0], counts))
+    return {"size": [height, width], "counts": counts.tolist()}
+
+
+def decode_rle(rle: dict) -> np.ndarray:
+    """Декодирование несжатого RLE формата COCO.
+
+    Args:
+        rle: Словарь с полями size и counts
+
+    Returns:
+        np.ndarray: Булев массив формы (height, width)
+
+    Raises:
+        ValueError: Если сумма длин серий не совпадает с размером
+    """
+    import numpy as np
+
+    height, width = rle["size"]
+    counts = np.asarray(rle["counts"], dtype=np.int64)
+    if counts.sum() != height * width:
+        raise ValueError("RLE counts do not match mask size")
+    values = np.arange(counts.size) % 2 == 1
+    return np.repeat(values, counts).reshape((height, width), order="F")
+
+
+def render_png(mask: np.ndarray) -> bytes:
+    """Отрисовка маски в однобитный PNG (0 - фон, 255 - объект).
+
+    Args:
+        mask: Булев массив формы (height, width)
+
+    Returns:
+        bytes: PNG-изображение
+    """
+    import cv2
+    import numpy as np
+
+    image = mask.astype(np.uint8) * 255
+    _, encoded = cv2.imencode(".png", image, [cv2.IMWRITE_PNG_BILEVEL, 1])
+    return encoded.tobytes()
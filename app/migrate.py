@@ -0,0 +1,228 @@
+"""Модуль миграции схемы базы данных.
+
+Запуск: ``python -m app.migrate``
+
+Содержит функции для:
+- создания недостающих таблиц, колонок и индексов, пересоздания изменённых индексов
+- переноса изображений из колонок LargeBinary в хранилище объектов
+- первичного заполнения счётчиков feedback_stats
+- перевода SQLite в режим auto_vacuum=INCREMENTAL
+"""
+
+from sqlalchemy import inspect, select, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from . import crud, models
+from .database import engine
+from .storage import blob_store, guess_media_type
+
+# Устаревшие колонки с содержимым изображений и префиксы новых колонок
+LEGACY_BLOB_COLUMNS = {
+    "original_image": "original",
+    "segmented_image": "segmented",
+}
+BATCH_SIZE = 50
+
+
+def add_missing_columns(connection: Connection) -> list:
+    """Добавление колонок, которые есть в моделях, но отсутствуют в БД.
+
+    Args:
+        connection: Подключение к БД внутри транзакции
+
+    Returns:
+        list: Добавленные колонки в виде "таблица.колонка"
+    """
+    inspector = inspect(connection)
+    added = []
+    for table in models.Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            column_type = column.type.compile(dialect=connection.dialect)
+            connection.execute(text(
+                f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"
+            ))
+            added.append(f"{table.name}.{column.name}")
+    return added
+
+
+def _index_definition(index, dialect_name: str) -> tuple:
+    """Колонки, уникальность и покрываемые колонки (INCLUDE, только PostgreSQL) индекса."""
+    include = []
+    if dialect_name == "postgresql":
+        include = index.dialect_options["postgresql"]["include"] or []
+    return (
+        [column.name for column in index.columns],
+        bool(index.unique),
+        [getattr(column, "name", column) for column in include],
+    )
+
+
+def _reflected_definition(reflected: dict, dialect_name: str) -> tuple:
+    """То же для индекса, прочитанного из БД (см. _index_definition)."""
+    include = []
+    if dialect_name == "postgresql":
+        include = reflected.get("dialect_options", {}).get(
+            "postgresql_include", reflected.get("include_columns") or []
+        )
+    return list(reflected["column_names"]), bool(reflected.get("unique")), list(include)
+
+
+def create_missing_indexes(connection: Connection) -> list:
+    """Создание индексов, объявленных в моделях.
+
+    Индекс с тем же именем, но другим определением (колонки, уникальность,
+    INCLUDE) пересоздаётся: иначе после изменения модели в уже
+    мигрированной БД остался бы старый индекс.
+
+    Args:
+        connection: Подключение к БД внутри транзакции
+
+    Returns:
+        list: Имена пересозданных индексов
+    """
+    inspector = inspect(connection)
+    dialect_name = connection.dialect.name
+    recreated = []
+    for table in models.Base.metadata.sorted_tables:
+        existing = {
+            reflected["name"]: reflected for reflected in inspector.get_indexes(table.name)
+        }
+        for index in table.indexes:
+            reflected = existing.get(index.name)
+            if reflected is None:
+                index.create(connection)
+                continue
+            if _reflected_definition(reflected, dialect_name) != _index_definition(index, dialect_name):
+                index.drop(connection)
+                index.create(connection)
+                recreated.append(index.name)
+    return recreated
+
+
+def _legacy_columns() -> list:
+    existing = {
+        column["name"] for column in inspect(engine).get_columns("segmentations")
+    }
+    return [column for column in LEGACY_BLOB_COLUMNS if column in existing]
+
+
+def move_legacy_blobs() -> int:
+    """Перенос изображений из таблицы segmentations в хранилище объектов.
+
+    Строки обрабатываются пачками по BATCH_SIZE, каждая пачка в своей
+    транзакции, поэтому прерванную миграцию можно просто перезапустить.
+    После переноса устаревшие колонки удаляются, а файл БД сжимается.
+
+    Returns:
+        int: Количество перенесённых объектов
+    """
+    legacy_columns = _legacy_columns()
+    if not legacy_columns:
+        return 0
+
+    pending_condition = " OR ".join(f"{column} IS NOT NULL" for column in legacy_columns)
+    moved = 0
+    while True:
+        with engine.begin() as connection:
+            rows = connection.execute(text(
+                f"SELECT id, {', '.join(legacy_columns)} FROM segmentations "
+                f"WHERE {pending_condition} LIMIT :limit"
+            ), {"limit": BATCH_SIZE}).mappings().all()
+            if not rows:
+                break
+
+            for row in rows:
+                values = {"id": row["id"]}
+                for column in legacy_columns:
+                    data = row[column]
+                    prefix = LEGACY_BLOB_COLUMNS[column]
+                    values[column] = None
+                    if data is None:
+                        continue
+                    blob = blob_store.put(data)
+                    values[f"{prefix}_digest"] = blob.digest
+                    values[f"{prefix}_size"] = blob.size
+                    values[f"{prefix}_media_type"] = (
+                        guess_media_type(data[:16]) or "application/octet-stream"
+                    )
+                    moved += 1
+                assignments = ", ".join(f"{name} = :{name}" for name in values if name != "id")
+                connection.execute(
+                    text(f"UPDATE segmentations SET {assignments} WHERE id = :id"),
+                    values
+                )
+
+    with engine.begin() as connection:
+        for column in legacy_columns:
+            connection.execute(text(f"ALTER TABLE segmentations DROP COLUMN {column}"))
+
+    if engine.dialect.name == "sqlite":
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            connection.execute(text("VACUUM"))
+    return moved
+
+
+def fill_feedback_stats() -> int:
+    """Заполнение feedback_stats по истории, если счётчики ещё пусты.
+
+    Returns:
+        int: Количество созданных строк счётчиков
+    """
+    with Session(engine) as database_session:
+        has_stats = database_session.scalar(select(models.FeedbackStat.id).limit(1))
+        has_history = database_session.scalar(select(models.Segmentation.id).limit(1))
+        if has_stats or not has_history:
+            return 0
+        return crud.rebuild_feedback_stats(database_session)
+
+
+def enable_incremental_vacuum() -> bool:
+    """Перевод существующей БД SQLite в режим auto_vacuum=INCREMENTAL.
+
+    Режим меняется только полным VACUUM, поэтому он выполняется один
+    раз - если БД ещё не в нужном режиме.
+
+    Returns:
+        bool: True, если БД была переведена
+    """
+    if engine.dialect.name != "sqlite":
+        return False
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        if connection.execute(text("PRAGMA auto_vacuum")).scalar() == 2:
+            return False
+        connection.execute(text("PRAGMA auto_vacuum=INCREMENTAL"))
+        connection.execute(text("VACUUM"))
+    return True
+
+
+def migrate():
+    """Приведение схемы БД к текущим моделям."""
+    models.Base.metadata.create_all(bind=engine)
+    with engine.begin() as connection:
+        added = add_missing_columns(connection)
+        recreated = create_missing_indexes(connection)
+    for column in added:
+        print(f"Added column {column}")
+    for index_name in recreated:
+        print(f"Recreated index {index_name}")
+
+    moved = move_legacy_blobs()
+    if moved:
+        print(f"Moved {moved} images to blob storage")
+
+    buckets = fill_feedback_stats()
+    if buckets:
+        print(f"Filled {buckets} feedback statistics rows")
+
+    if enable_incremental_vacuum():
+        print("Enabled incremental vacuum")
+
+
+if __name__ == "__main__":
+    migrate()
@@ -3,9 +3,16 @@
 Содержит модели для:
 - Пользователей (User)
 - Сегментированных изображений (Segmentation)
+- Кеша результатов сегментации (SegmentationResult)
+- Производных изображений: миниатюр (Derivative)
+- Очереди заданий асинхронной обработки (Job)
+- Оценок качества по эталонным маскам (Evaluation)
+- Счётчиков оценок пользователей по дням и движкам (FeedbackStat)
+- Фонового удаления пользователей (UserDeletion)
 """
 
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, LargeBinary, DateTime
+from sqlalchemy import (Column, Integer, String, Boolean, ForeignKey, Date, DateTime,
+                        Float, Index, UniqueConstraint)
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from .database import Base
@@ -20,6 +27,7 @@ class User(Base):
         email: Электронная почта (уникальная)
         hashed_password: Хешированный пароль
         is_active: Флаг активности аккаунта
+        is_admin: Флаг администратора
         segmentations: Связь с сегментированными изображениями пользователя
     """
     __tablename__ = "users"
@@ -29,9 +37,11 @@ class User(Base):
     email = Column(String, unique=True, index=True)
     hashed_password = Column(String)
     is_active = Column(Boolean, default=True)
+    is_admin = Column(Boolean, default=False)
 
-    # Связь с сегментациями
-    segmentations = relationship("Segmentation", back_populates="user")
+    # Связь с сегментациями; неявная загрузка всех строк запрещена,
+    # история читается постранично (см. crud.list_segmentations)
+    segmentations = relationship("Segmentation", back_populates="user", lazy="raise")
 
 
 class Segmentation(Base):
@@ -40,20 +50,278 @@ class Segmentation(Base):
     Attributes:
         id: Уникальный идентификатор
         user_id: ID пользователя, загрузившего изображение
-        original_image: Оригинальное изображение в бинарном виде
-        segmented_image: Результат сегментации в бинарном виде
+        original_digest: SHA-256 оригинала в хранилище объектов
+        original_size: Размер оригинала в байтах
+        original_media_type: Медиатип оригинала
+        segmented_digest: SHA-256 результата сегментации в хранилище объектов
+        segmented_size: Размер результата в байтах
+        segmented_media_type: Медиатип результата
+        engine: Имя движка сегментации
+        engine_version: Версия движка
+        engine_params: Параметры движка (JSON)
         is_good: Оценка качества сегментации (None - не оценено)
         created_at: Дата и время создания записи
         user: Связь с пользователем
     """
     __tablename__ = "segmentations"
+    __table_args__ = (
+        # Покрывающий индекс истории пользователя (ключ курсора created_at, id);
+        # в SQLite id - это rowid и входит в любой индекс неявно
+        Index(
+            "ix_segmentations_user_created", "user_id", "created_at", "id",
+            postgresql_include=[
+                "is_good", "engine", "engine_version", "original_digest",
+                "original_size", "original_media_type", "segmented_digest",
+            ]
+        ),
+        Index("ix_segmentations_user_feedback", "user_id", "is_good", "created_at", "id"),
+        Index("ix_segmentations_feedback_created", "is_good", "created_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
-    original_image = Column(LargeBinary)
-    segmented_image = Column(LargeBinary)
+    original_digest = Column(String(64), index=True)
+    original_size = Column(Integer)
+    original_media_type = Column(String)
+    segmented_digest = Column(String(64), index=True)
+    segmented_size = Column(Integer)
+    segmented_media_type = Column(String)
+    engine = Column(String)
+    engine_version = Column(String)
+    engine_params = Column(String)
     is_good = Column(Boolean, nullable=True)  # None - не оценено, True - хорошо, False - плохо
     created_at = Column(DateTime(timezone=True), server_default=func.now())  # func.now - специальный SQL-конструктор
 
     # Связь с пользователем
     user = relationship("User", back_populates="segmentations")
+
+
+class SegmentationResult(Base):
+    """Запомненный результат сегментации для входа и параметров.
+
+    Attributes:
+        id: Уникальный идентификатор
+        input_digest: SHA-256 входного изображения
+        params_key: Ключ алгоритма, его версии и параметров
+        result_digest: SHA-256 результата в хранилище объектов
+        result_size: Размер результата в байтах
+        result_media_type: Медиатип результата
+        created_at: Дата и время создания записи
+    """
+    __tablename__ = "segmentation_results"
+    __table_args__ = (
+        UniqueConstraint("input_digest", "params_key", name="uq_segmentation_results_input"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    input_digest = Column(String(64), nullable=False)
+    params_key = Column(String, nullable=False)
+    result_digest = Column(String(64), nullable=False, index=True)
+    result_size = Column(Integer)
+    result_media_type = Column(String)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class Derivative(Base):
+    """Производное изображение (миниатюра) объекта из хранилища.
+
+    Миниатюры привязаны к хешу исходного объекта, поэтому общие для
+    всех сегментаций с одинаковым оригиналом или результатом.
+
+    Attributes:
+        id: Уникальный идентификатор
+        source_digest: SHA-256 исходного объекта
+        size: Наибольшая сторона миниатюры в пикселях
+        digest: SHA-256 миниатюры в хранилище объектов
+        byte_size: Размер миниатюры в байтах
+        media_type: Медиатип миниатюры
+        width: Ширина миниатюры
+        height: Высота миниатюры
+        created_at: Дата и время создания записи
+    """
+    __tablename__ = "derivatives"
+    __table_args__ = (
+        UniqueConstraint("source_digest", "size", name="uq_derivatives_source_size"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    source_digest = Column(String(64), nullable=False)
+    size = Column(Integer, nullable=False)
+    digest = Column(String(64), nullable=False, index=True)
+    byte_size = Column(Integer)
+    media_type = Column(String)
+    width = Column(Integer)
+    height = Column(Integer)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+# Состояния задания
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+
+class Job(Base):
+    """Задание асинхронной сегментации в очереди на стороне БД.
+
+    Оригинал уже лежит в хранилище объектов, поэтому задание переживает
+    перезапуск приложения. Взятое в работу задание арендуется до
+    lease_expires_at; после истечения аренды его может забрать другой воркер.
+
+    Attributes:
+        id: Уникальный идентификатор
+        user_id: ID владельца
+        status: Состояние (queued, running, done, failed)
+        input_digest: SHA-256 оригинала в хранилище объектов
+        input_media_type: Медиатип оригинала
+        engine: Имя движка сегментации
+        engine_params: Параметры движка (JSON)
+        tiled: Потайловая обработка
+        attempts: Количество взятий в работу
+        lease_expires_at: Срок аренды выполняющегося задания
+        segmentation_id: ID созданной сегментации
+        cached: Результат взят из кеша
+        error: Текст ошибки для failed
+        created_at: Дата и время постановки в очередь
+        started_at: Дата и время последнего взятия в работу
+        finished_at: Дата и время завершения
+    """
+    __tablename__ = "jobs"
+    __table_args__ = (
+        Index("ix_jobs_status_id", "status", "id"),
+        Index("ix_jobs_user_status", "user_id", "status"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    status = Column(String(16), nullable=False, default=JOB_QUEUED)
+    input_digest = Column(String(64), nullable=False, index=True)
+    input_media_type = Column(String)
+    engine = Column(String, nullable=False)
+    engine_params = Column(String)
+    tiled = Column(Boolean, default=False)
+    attempts = Column(Integer, default=0)
+    lease_expires_at = Column(DateTime(timezone=True), nullable=True)
+    segmentation_id = Column(Integer, ForeignKey("segmentations.id"), nullable=True)
+    cached = Column(Boolean, nullable=True)
+    error = Column(String, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+
+# Метрики оценки, хранимые в Evaluation
+EVALUATION_METRICS = ("iou", "dice", "accuracy", "precision", "recall", "boundary_f1")
+
+
+class Evaluation(Base):
+    """Оценка сегментации по эталонной маске.
+
+    Для каждой сегментации хранится одна оценка: повторная загрузка
+    эталона заменяет её.
+
+    Attributes:
+        id: Уникальный идентификатор
+        segmentation_id: ID оцениваемой сегментации
+        user_id: ID владельца сегментации
+        truth_digest: SHA-256 эталонной маски в хранилище объектов
+        truth_size: Размер эталона в байтах
+        iou: Пересечение над объединением
+        dice: Коэффициент Dice (F1 по пикселям)
+        accuracy: Доля верно классифицированных пикселей
+        precision: Точность по пикселям переднего плана
+        recall: Полнота по пикселям переднего плана
+        boundary_f1: F-мера совпадения границ
+        boundary_tolerance: Допуск совпадения границ в пикселях
+        created_at: Дата и время расчёта
+    """
+    __tablename__ = "evaluations"
+    __table_args__ = (
+        Index("ix_evaluations_user", "user_id"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    segmentation_id = Column(Integer, ForeignKey("segmentations.id"), nullable=False, unique=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    truth_digest = Column(String(64), nullable=False, index=True)
+    truth_size = Column(Integer)
+    iou = Column(Float)
+    dice = Column(Float)
+    accuracy = Column(Float)
+    precision = Column(Float)
+    recall = Column(Float)
+    boundary_f1 = Column(Float)
+    boundary_tolerance = Column(Integer)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class FeedbackStat(Base):
+    """Счётчики сегментаций и их оценок за день по пользователю и движку.
+
+    Обновляются в той же транзакции, что и загрузка или оценка, поэтому
+    статистика читается из небольшой таблицы без просмотра segmentations.
+    Число неоценённых - total - good - bad.
+
+    Attributes:
+        id: Уникальный идентификатор
+        user_id: ID владельца сегментаций
+        day: День создания сегментаций (UTC)
+        engine: Движок сегментации ("" - неизвестен)
+        total: Число сегментаций
+        good: Оценено как хорошее
+        bad: Оценено как плохое
+    """
+    __tablename__ = "feedback_stats"
+    __table_args__ = (
+        UniqueConstraint("user_id", "day", "engine", name="uq_feedback_stats_bucket"),
+        Index("ix_feedback_stats_day", "day"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    day = Column(Date, nullable=False)
+    engine = Column(String, nullable=False, default="")
+    total = Column(Integer, nullable=False, default=0)
+    good = Column(Integer, nullable=False, default=0)
+    bad = Column(Integer, nullable=False, default=0)
+
+
+class UserDeletion(Base):
+    """Фоновое удаление пользователя и его данных.
+
+    Пользователь деактивируется сразу, а строки и объекты хранилища
+    удаляются небольшими пачками (см. deletions.UserDeletionRunner).
+    Статусы - те же, что у заданий: queued, running, done, failed.
+
+    Attributes:
+        id: Уникальный идентификатор
+        token: Случайный токен URL состояния (доступен и после удаления аккаунта)
+        user_id: ID удаляемого пользователя
+        username: Логин удаляемого пользователя
+        status: Состояние удаления
+        total: Сегментаций на момент запроса
+        deleted: Удалено сегментаций
+        blobs_deleted: Освобождено объектов хранилища (удаляются сборкой после отсрочки)
+        error: Текст ошибки для failed
+        lease_expires_at: Срок аренды выполняющегося удаления
+        created_at: Дата и время запроса
+        finished_at: Дата и время завершения
+    """
+    __tablename__ = "user_deletions"
+    __table_args__ = (
+        Index("ix_user_deletions_status", "status"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    token = Column(String(64), nullable=False, unique=True)
+    user_id = Column(Integer, nullable=False, index=True)
+    username = Column(String, nullable=False)
+    status = Column(String(16), nullable=False, default=JOB_QUEUED)
+    total = Column(Integer, nullable=False, default=0)
+    deleted = Column(Integer, nullable=False, default=0)
+    blobs_deleted = Column(Integer, nullable=False, default=0)
+    error = Column(String)
+    lease_expires_at = Column(DateTime(timezone=True))
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    finished_at = Column(DateTime(timezone=True))
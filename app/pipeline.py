@@ -0,0 +1,430 @@
+"""Модуль конвейера обработки загруженных изображений.
+
+Содержит функции для:
+- сегментации выбранным движком с запоминанием результата по SHA-256
+  входа, движку, его версии и параметрам
+- сохранения оригинала и результата в хранилище и записи сегментации в БД
+- пакетной обработки с записью всех сегментаций одной транзакцией
+- оценки сегментаций по эталонным маскам
+- постановки миниатюр в фоновую очередь
+- статистики кеша результатов
+"""
+
+import asyncio
+import json
+from datetime import datetime, timezone
+from typing import AsyncIterator, Dict, List, NamedTuple, Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from . import crud, models
+from .cache import TTLCache
+from .config import settings
+from .database import AsyncSessionLocal
+from .derivatives import derivative_queue
+from .engines import SegmentationEngine
+from .executor import (ExecutorBusyError, ExecutorTimeoutError,
+                       segmentation_executor)
+from .ingest import BatchItem
+from .segmentation import (RESULT_MEDIA_TYPE, params_key, segment_image,
+                           segment_images)
+from .storage import blob_store
+from .telemetry import span
+from .tiling import segment_tiled
+from .writes import write_batcher
+
+
+class ResultRef(NamedTuple):
+    """Ссылка на результат сегментации в хранилище.
+
+    Attributes:
+        digest: SHA-256 результата
+        size: Размер в байтах
+        media_type: Медиатип результата
+    """
+    digest: str
+    size: int
+    media_type: str
+
+
+# Быстрый слой перед таблицей segmentation_results: ключ (вход, параметры)
+result_cache = TTLCache(
+    max_entries=settings.RESULT_CACHE_SIZE,
+    ttl=settings.RESULT_CACHE_TTL
+)
+result_cache_counters = {"memory_hits": 0, "db_hits": 0, "misses": 0}
+
+
+def encode_params(params: dict) -> str:
+    """Параметры движка в каноническом JSON для записи в БД."""
+    return json.dumps(params, sort_keys=True)
+
+
+def find_cached_result(database_session: Session, input_digest: str,
+                       result_key: str) -> Optional[ResultRef]:
+    """Поиск ранее посчитанного результата сегментации.
+
+    Args:
+        database_session: Сессия подключения к БД
+        input_digest: SHA-256 входного изображения
+        result_key: Ключ движка, версии и параметров
+
+    Returns:
+        ResultRef: Ссылка на результат или None
+    """
+    key = (input_digest, result_key)
+    ref = result_cache.get(key)
+    if ref is not None:
+        if blob_store.exists(ref.digest):
+            result_cache_counters["memory_hits"] += 1
+            return ref
+        # Объект результата удалён (сборка мусора или другой процесс)
+        result_cache.discard(key)
+
+    row = crud.get_cached_result(database_session, input_digest, result_key)
+    if row is not None and blob_store.exists(row.result_digest):
+        ref = ResultRef(row.result_digest, row.result_size, row.result_media_type)
+        result_cache.set(key, ref)
+        result_cache_counters["db_hits"] += 1
+        return ref
+
+    result_cache_counters["misses"] += 1
+    return None
+
+
+async def segment_upload(
+        database_session: AsyncSession,
+        user_id: int,
+        contents,
+        input_digest: str,
+        media_type: str,
+        engine: SegmentationEngine,
+        params: dict,
+        tiled: bool = False
+) -> Tuple[models.Segmentation, bool]:
+    """Сегментация загруженного изображения и запись результата.
+
+    Для уже встречавшегося входа сегментация не выполняется: новая
+    запись ссылается на существующий результат в хранилище.
+
+    Args:
+        database_session: Сессия подключения к БД
+        user_id: ID владельца
+        contents: Содержимое изображения (bytes или буфер)
+        input_digest: SHA-256 содержимого
+        media_type: Медиатип оригинала
+        engine: Движок сегментации
+        params: Проверенные параметры движка
+        tiled: Потайловая обработка (см. tiling.segment_tiled)
+
+    Returns:
+        tuple: Созданная сегментация и признак использования кеша
+
+    Raises:
+        ExecutorBusyError: Если очередь сегментации заполнена
+        ExecutorTimeoutError: Если сегментация не уложилась в таймаут
+        ValueError: Если изображение не удалось обработать
+    """
+    result_key = params_key(engine.name, params, tiled)
+    with span("result_lookup"):
+        ref = await database_session.run_sync(find_cached_result, input_digest, result_key)
+    cache_hit = ref is not None
+    if not cache_hit:
+        if tiled:
+            segmented_bytes = await segmentation_executor.run(
+                segment_tiled, contents, engine.name, params,
+                timeout=settings.SEGMENTATION_TILED_TIMEOUT
+            )
+        else:
+            segmented_bytes = await segmentation_executor.run(
+                segment_image, contents, engine.name, params
+            )
+        with span("blob_put"):
+            blob = await run_in_threadpool(blob_store.put, segmented_bytes)
+        ref = ResultRef(blob.digest, blob.size, RESULT_MEDIA_TYPE)
+
+    with span("blob_put"):
+        original = await run_in_threadpool(blob_store.put, contents, input_digest)
+    row = {
+        "user_id": user_id,
+        "original_digest": original.digest,
+        "original_size": original.size,
+        "original_media_type": media_type,
+        "segmented_digest": ref.digest,
+        "segmented_size": ref.size,
+        "segmented_media_type": ref.media_type,
+        "engine": engine.name,
+        "engine_version": engine.version,
+        "engine_params": encode_params(params),
+        "created_at": datetime.now(timezone.utc),
+    }
+    cached_result = None if cache_hit else (
+        input_digest, result_key, ref.digest, ref.size, ref.media_type
+    )
+    with span("db_commit"):
+        # Вставка фиксируется вместе с записями других запросов (см. writes.WriteBatcher)
+        segmentation_id = await write_batcher.create_segmentation(row, cached_result)
+    segmentation = models.Segmentation(id=segmentation_id, **row)
+    if not cache_hit:
+        result_cache.set((input_digest, result_key), ref)
+    if not tiled:
+        # Миниатюры большого оригинала строятся только по запросу, а маска
+        # прореживается потоково (см. derivatives.render_thumbnails)
+        derivative_queue.enqueue(original.digest, media_type)
+    derivative_queue.enqueue(ref.digest, ref.media_type)
+    return segmentation, cache_hit
+
+
+def find_cached_results(database_session: Session, input_digests: List[str],
+                        result_key: str) -> Dict[str, ResultRef]:
+    """Ранее посчитанные результаты для набора входов (см. find_cached_result)."""
+    found = {}
+    for input_digest in input_digests:
+        if input_digest not in found:
+            ref = find_cached_result(database_session, input_digest, result_key)
+            if ref is not None:
+                found[input_digest] = ref
+    return found
+
+
+async def _run_chunk(func, items: list, *args) -> List:
+    """Обработка части пакета в пуле; при заполненной очереди ждёт слот.
+
+    Returns:
+        list: Результат func или, при таймауте, текст ошибки для каждого элемента
+    """
+    while True:
+        try:
+            return await segmentation_executor.run(
+                func, items, *args, timeout=settings.SEGMENTATION_TIMEOUT * len(items)
+            )
+        except ExecutorBusyError as busy_error:
+            await asyncio.sleep(busy_error.retry_after)
+        except ExecutorTimeoutError:
+            return ["Processing timed out"] * len(items)
+
+
+async def segment_batch(
+        user_id: int,
+        items: List[BatchItem],
+        engine: SegmentationEngine,
+        params: dict
+) -> AsyncIterator[Tuple[str, object]]:
+    """Пакетная сегментация с выдачей результатов по мере готовности.
+
+    Уникальные входы без запомненного результата делятся на части по
+    BATCH_CHUNK_SIZE; части выполняются параллельно, не более одной на
+    воркер пула, и внутри части изображения одного размера обрабатываются
+    одним вызовом движка (segmentation.segment_images). Все сегментации
+    записываются в конце одной записью групповой фиксации (см.
+    writes.WriteBatcher) - одной транзакцией вместе с записями других запросов.
+
+    Args:
+        user_id: ID владельца
+        items: Элементы пакета (см. ingest.collect_batch_items)
+        engine: Движок сегментации
+        params: Проверенные параметры движка
+
+    Yields:
+        tuple: ("item", dict) - результат элемента по готовности;
+        в конце ("committed", list) - пары (индекс элемента, созданная строка)
+    """
+    result_key = params_key(engine.name, params)
+    refs: Dict[str, ResultRef] = {}
+    errors: Dict[str, str] = {}
+    pending: Dict[str, List[int]] = {}
+
+    def item_event(index: int, cached: bool = False, error: Optional[str] = None) -> dict:
+        item = items[index]
+        event = {"index": index, "filename": item.name, "status": "error" if error else "ok"}
+        if error:
+            event["error"] = error
+        else:
+            event.update(
+                cached=cached,
+                original_digest=item.digest,
+                segmented_digest=refs[item.digest].digest
+            )
+        return event
+
+    for index, item in enumerate(items):
+        if item.error:
+            yield "item", item_event(index, error=item.error)
+
+    valid = [index for index, item in enumerate(items) if not item.error]
+    async with AsyncSessionLocal() as database_session:
+        cached = await database_session.run_sync(
+            find_cached_results, [items[index].digest for index in valid], result_key
+        )
+    refs.update(cached)
+    for index in valid:
+        if items[index].digest in refs:
+            yield "item", item_event(index, cached=True)
+        else:
+            pending.setdefault(items[index].digest, []).append(index)
+
+    # Одинаковые входы внутри пакета считаются один раз
+    unique = [items[indexes[0]] for indexes in pending.values()]
+    chunk_size = max(1, settings.BATCH_CHUNK_SIZE)
+    chunks = [unique[start:start + chunk_size] for start in range(0, len(unique), chunk_size)]
+    slots = asyncio.Semaphore(segmentation_executor.max_workers)
+
+    async def run_chunk(chunk):
+        async with slots:
+            return chunk, await _run_chunk(
+                segment_images, [item.data for item in chunk], engine.name, params
+            )
+
+    new_results = []
+    tasks = [asyncio.ensure_future(run_chunk(chunk)) for chunk in chunks]
+    try:
+        for completed in asyncio.as_completed(tasks):
+            chunk, outputs = await completed
+            for item, output in zip(chunk, outputs):
+                if isinstance(output, str):
+                    errors[item.digest] = output
+                else:
+                    with span("blob_put"):
+                        blob = await run_in_threadpool(blob_store.put, output)
+                    refs[item.digest] = ResultRef(blob.digest, blob.size, RESULT_MEDIA_TYPE)
+                    new_results.append((
+                        item.digest, result_key, blob.digest, blob.size, RESULT_MEDIA_TYPE
+                    ))
+                for index in pending[item.digest]:
+                    yield "item", item_event(index, error=errors.get(item.digest))
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    rows, row_indexes, stored = [], [], set()
+    created_at = datetime.now(timezone.utc)
+    for index in valid:
+        item = items[index]
+        if item.digest not in refs:
+            continue
+        if item.digest not in stored:
+            with span("blob_put"):
+                await run_in_threadpool(blob_store.put, item.data, item.digest)
+            stored.add(item.digest)
+        ref = refs[item.digest]
+        row_indexes.append(index)
+        rows.append({
+            "user_id": user_id,
+            "original_digest": item.digest,
+            "original_size": len(item.data),
+            "original_media_type": item.media_type,
+            "segmented_digest": ref.digest,
+            "segmented_size": ref.size,
+            "segmented_media_type": ref.media_type,
+            "engine": engine.name,
+            "engine_version": engine.version,
+            "engine_params": encode_params(params),
+            "created_at": created_at,
+        })
+
+    with span("db_commit"):
+        ids = await write_batcher.create_segmentations(rows, new_results)
+    for input_digest, key, digest, size, media_type in new_results:
+        result_cache.set((input_digest, key), ResultRef(digest, size, media_type))
+    for row in rows:
+        derivative_queue.enqueue(row["original_digest"], row["original_media_type"])
+        derivative_queue.enqueue(row["segmented_digest"], row["segmented_media_type"])
+    yield "committed", [
+        (index, dict(row, id=segmentation_id))
+        for index, row, segmentation_id in zip(row_indexes, rows, ids)
+    ]
+
+
+# Результат оценки для отсутствующей или чужой сегментации
+SEGMENTATION_NOT_FOUND = "Segmentation not found"
+
+
+class GroundTruth(NamedTuple):
+    """Эталонная маска для сегментации.
+
+    Attributes:
+        segmentation_id: ID оцениваемой сегментации
+        data: Содержимое маски (изображение или упакованная маска)
+        digest: SHA-256 содержимого
+    """
+    segmentation_id: int
+    data: object
+    digest: str
+
+
+async def evaluate_segmentations(database_session: AsyncSession, user_id: int,
+                                 truths: List[GroundTruth]) -> List:
+    """Расчёт и запись оценок сегментаций по эталонным маскам.
+
+    Метрики считаются пакетами по EVAL_BATCH_SIZE в пуле сегментации
+    (см. evaluation.evaluate_masks); все оценки записываются одной
+    транзакцией, заменяя прежние оценки тех же сегментаций.
+
+    Args:
+        database_session: Сессия подключения к БД
+        user_id: ID владельца сегментаций
+        truths: Эталонные маски
+
+    Returns:
+        list: Для каждого эталона словарь метрик или текст ошибки
+    """
+    # evaluation строит таблицы numpy при импорте - загружаем по первой оценке
+    from .evaluation import evaluate_masks
+
+    segmented = await database_session.run_sync(
+        crud.get_segmented_refs, user_id, [truth.segmentation_id for truth in truths]
+    )
+    results: List = [SEGMENTATION_NOT_FOUND] * len(truths)
+    found = [index for index, truth in enumerate(truths) if truth.segmentation_id in segmented]
+    predicted = await run_in_threadpool(
+        lambda: {digest: blob_store.read(digest) for digest in set(segmented.values())}
+    )
+    pairs = [
+        (predicted[segmented[truths[index].segmentation_id]], truths[index].data)
+        for index in found
+    ]
+
+    batch_size = max(1, settings.EVAL_BATCH_SIZE)
+    tolerance = settings.EVAL_BOUNDARY_TOLERANCE
+    chunks = [
+        (found[start:start + batch_size], pairs[start:start + batch_size])
+        for start in range(0, len(pairs), batch_size)
+    ]
+    slots = asyncio.Semaphore(segmentation_executor.max_workers)
+
+    async def run_chunk(chunk_pairs):
+        async with slots:
+            return await _run_chunk(evaluate_masks, chunk_pairs, tolerance, batch_size)
+
+    outputs = await asyncio.gather(*(run_chunk(chunk_pairs) for _, chunk_pairs in chunks))
+    rows = []
+    for (indexes, _), chunk_outputs in zip(chunks, outputs):
+        for index, output in zip(indexes, chunk_outputs):
+            results[index] = output
+            if isinstance(output, str):
+                continue
+            truth = truths[index]
+            blob = await run_in_threadpool(blob_store.put, truth.data, truth.digest)
+            rows.append({
+                "segmentation_id": truth.segmentation_id,
+                "user_id": user_id,
+                "truth_digest": blob.digest,
+                "truth_size": blob.size,
+                "boundary_tolerance": tolerance,
+                **output,
+            })
+    # Эталон для одной сегментации в пакете берётся последний
+    unique_rows = list({row["segmentation_id"]: row for row in rows}.values())
+    await database_session.run_sync(crud.save_evaluations, unique_rows)
+    return results
+
+
+def result_cache_stats() -> dict:
+    """Статистика кеша результатов сегментации.
+
+    Returns:
+        dict: Счётчики попаданий в память и БД, промахов и размер слоя в памяти
+    """
+    return {**result_cache_counters, "memory_size": result_cache.stats()["size"]}
@@ -0,0 +1,291 @@
+"""Модуль подготовки изображений к сегментации.
+
+Содержит функции для:
+- чтения размеров и цветности изображения из заголовка без декодирования
+- чтения тегов TIFF
+- декодирования сразу в оттенки серого и с уменьшением (IMREAD_REDUCED_*)
+- возврата маски к исходному размеру
+"""
+
+from __future__ import annotations
+
+import struct
+from typing import TYPE_CHECKING, NamedTuple, Optional, Tuple
+
+if TYPE_CHECKING:
+    import numpy as np
+
+# Теги TIFF, нужные для размеров и чтения несжатых полос
+_TIFF_TAGS = {
+    256: "width",
+    257: "height",
+    258: "bits_per_sample",
+    259: "compression",
+    262: "photometric",
+    273: "strip_offsets",
+    277: "samples_per_pixel",
+    278: "rows_per_strip",
+    279: "strip_byte_counts",
+    284: "planar_configuration",
+    322: "tile_width",
+}
+# Форматы целочисленных типов полей TIFF: BYTE, SHORT, LONG
+_TIFF_TYPE_FORMATS = {1: "B", 3: "H", 4: "I"}
+# Цветовые модели PNG с цветом: RGB, палитра, RGBA
+_PNG_COLOR_TYPES = frozenset((2, 3, 6))
+
+
+def _reduced_flags(color: bool) -> tuple:
+    """Флаги декодирования с уменьшением в 8, 4 и 2 раза.
+
+    Для JPEG уменьшение выполняется прямо при декодировании DCT, без
+    полноразмерного буфера.
+    """
+    import cv2
+
+    if color:
+        return ((8, cv2.IMREAD_REDUCED_COLOR_8),
+                (4, cv2.IMREAD_REDUCED_COLOR_4),
+                (2, cv2.IMREAD_REDUCED_COLOR_2))
+    return ((8, cv2.IMREAD_REDUCED_GRAYSCALE_8),
+            (4, cv2.IMREAD_REDUCED_GRAYSCALE_4),
+            (2, cv2.IMREAD_REDUCED_GRAYSCALE_2))
+
+# Маркеры JPEG SOF, в которых записаны размеры кадра
+_JPEG_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+class ImageInfo(NamedTuple):
+    """Сведения об изображении из заголовка.
+
+    Attributes:
+        height: Высота
+        width: Ширина
+        color: Есть ли в изображении цвет (иначе оттенки серого)
+    """
+    height: int
+    width: int
+    color: bool
+
+
+def _is_png(view: memoryview) -> bool:
+    return bytes(view[:8]) == b"\x89PNG\r\n\x1a\n" and len(view) >= 26
+
+
+def _jpeg_frame(view: memoryview) -> Optional[Tuple[int, int, int]]:
+    """Высота, ширина и число компонент из маркера SOF JPEG."""
+    if bytes(view[:2]) != b"\xff\xd8":
+        return None
+    offset = 2
+    while offset + 4 <= len(view):
+        if view[offset] != 0xFF:
+            return None
+        marker = view[offset + 1]
+        if marker == 0xFF:
+            offset += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD9:
+            offset += 2
+            continue
+        (length,) = struct.unpack(">H", view[offset + 2:offset + 4])
+        if marker in _JPEG_SOF_MARKERS:
+            if offset + 10 > len(view):
+                return None
+            height, width = struct.unpack(">HH", view[offset + 5:offset + 9])
+            return height, width, view[offset + 9]
+        offset += 2 + length
+    return None
+
+
+def image_dimensions(data) -> Optional[Tuple[int, int]]:
+    """Размеры изображения по заголовку PNG или JPEG.
+
+    Args:
+        data: Закодированное изображение (bytes или буфер)
+
+    Returns:
+        tuple: (высота, ширина) или None, если формат не поддерживается
+    """
+    view = memoryview(data)
+    if _is_png(view):
+        width, height = struct.unpack(">II", view[16:24])
+        return height, width
+    frame = _jpeg_frame(view)
+    return frame[:2] if frame is not None else None
+
+
+def read_tiff_tags(buffer) -> Optional[dict]:
+    """Теги первого IFD TIFF, нужные для размеров и чтения полос.
+
+    Args:
+        buffer: Закодированное изображение (bytes, memoryview или mmap)
+
+    Returns:
+        dict: Имя тега -> кортеж значений или None, если это не TIFF
+    """
+    view = memoryview(buffer)
+    order = {b"II": "<", b"MM": ">"}.get(bytes(view[:2]))
+    if order is None or len(view) < 8:
+        return None
+    try:
+        magic, ifd_offset = struct.unpack_from(f"{order}HI", view, 2)
+        if magic != 42:
+            return None
+        (count,) = struct.unpack_from(f"{order}H", view, ifd_offset)
+        tags = {}
+        for entry in range(count):
+            tag, field_type, values, value_offset = struct.unpack_from(
+                f"{order}HHI4s", view, ifd_offset + 2 + entry * 12
+            )
+            if tag not in _TIFF_TAGS or field_type not in _TIFF_TYPE_FORMATS:
+                continue
+            item = _TIFF_TYPE_FORMATS[field_type]
+            size = struct.calcsize(item) * values
+            if size <= 4:
+                data = value_offset[:size]
+            else:
+                (offset,) = struct.unpack(f"{order}I", value_offset)
+                data = view[offset:offset + size]
+            tags[_TIFF_TAGS[tag]] = struct.unpack(f"{order}{values}{item}", data)
+    except struct.error:
+        return None
+    return tags
+
+
+def image_info(data) -> Optional[ImageInfo]:
+    """Размеры и цветность изображения по заголовку без декодирования.
+
+    Поддерживаются все форматы, принимаемые при загрузке: PNG, JPEG,
+    TIFF, BMP, GIF и WebP. Цветность определяется для PNG, JPEG и TIFF;
+    остальные форматы считаются цветными.
+
+    Args:
+        data: Закодированное изображение (bytes или буфер)
+
+    Returns:
+        ImageInfo: Сведения или None, если заголовок не распознан
+    """
+    view = memoryview(data)
+    try:
+        if _is_png(view):
+            width, height = struct.unpack(">II", view[16:24])
+            return ImageInfo(height, width, view[25] in _PNG_COLOR_TYPES)
+        frame = _jpeg_frame(view)
+        if frame is not None:
+            return ImageInfo(frame[0], frame[1], frame[2] >= 3)
+        tags = read_tiff_tags(view)
+        if tags is not None:
+            if "width" not in tags or "height" not in tags:
+                return None
+            samples = tags.get("samples_per_pixel", (1,))[0]
+            photometric = tags.get("photometric", (1,))[0]
+            return ImageInfo(tags["height"][0], tags["width"][0],
+                             samples >= 3 or photometric == 3)
+        header = bytes(view[:30])
+        if header[:2] == b"BM" and len(header) >= 26:
+            (header_size,) = struct.unpack_from("<I", header, 14)
+            if header_size == 12:
+                width, height = struct.unpack_from("<HH", header, 18)
+            else:
+                width, height = struct.unpack_from("<ii", header, 18)
+            return ImageInfo(abs(height), abs(width), True)
+        if header[:6] in (b"GIF87a", b"GIF89a") and len(header) >= 10:
+            width, height = struct.unpack_from("<HH", header, 6)
+            return ImageInfo(height, width, True)
+        if header[:4] == b"RIFF" and header[8:12] == b"WEBP" and len(header) == 30:
+            return _webp_info(header)
+    except struct.error:
+        return None
+    return None
+
+
+def _webp_info(header: bytes) -> Optional[ImageInfo]:
+    chunk = header[12:16]
+    if chunk == b"VP8 " and header[23:26] == b"\x9d\x01\x2a":
+        width, height = struct.unpack_from("<HH", header, 26)
+        return ImageInfo(height & 0x3FFF, width & 0x3FFF, True)
+    if chunk == b"VP8L" and header[20] == 0x2F:
+        (bits,) = struct.unpack_from("<I", header, 21)
+        return ImageInfo(((bits >> 14) & 0x3FFF) + 1, (bits & 0x3FFF) + 1, True)
+    if chunk == b"VP8X":
+        width = int.from_bytes(header[24:27], "little") + 1
+        height = int.from_bytes(header[27:30], "little") + 1
+        return ImageInfo(height, width, True)
+    return None
+
+
+def decode_image(image_bytes, color: bool = False,
+                 max_pixels: Optional[int] = None) -> Tuple[np.ndarray, Tuple[int, int]]:
+    """Декодирование изображения для сегментации.
+
+    Изображение декодируется сразу в нужное число каналов, без
+    промежуточного цветного буфера. Если задан max_pixels, выбирается
+    наибольшее уменьшение IMREAD_REDUCED_*, после которого пикселей
+    не меньше max_pixels, и остаток добирается быстрым resize.
+
+    Args:
+        image_bytes: Закодированное изображение
+        color: Нужно ли цветное (BGR) изображение
+        max_pixels: Рабочее разрешение в пикселях (None - исходное)
+
+    Returns:
+        tuple: Изображение и исходный размер (высота, ширина)
+
+    Raises:
+        ValueError: Если изображение не удалось декодировать
+    """
+    import cv2
+    import numpy as np
+
+    buffer = np.frombuffer(image_bytes, np.uint8)
+    full_flag = cv2.IMREAD_COLOR if color else cv2.IMREAD_GRAYSCALE
+    dimensions = image_dimensions(image_bytes) if max_pixels else None
+
+    flag, factor = full_flag, 1
+    if dimensions is not None:
+        height, width = dimensions
+        for reduction, reduced_flag in _reduced_flags(color):
+            if (height // reduction) * (width // reduction) >= max_pixels:
+                flag, factor = reduced_flag, reduction
+                break
+
+    image = cv2.imdecode(buffer, flag)
+    if image is None:
+        raise ValueError("Cannot decode image")
+
+    if factor == 1:
+        dimensions = image.shape[:2]
+    else:
+        # Заголовок хранит размеры до поворота по EXIF, а декодер его применяет
+        rows, columns = image.shape[:2]
+        height, width = dimensions
+        if abs(rows * factor - width) + abs(columns * factor - height) < \
+                abs(rows * factor - height) + abs(columns * factor - width):
+            dimensions = (width, height)
+
+    if max_pixels and image.shape[0] * image.shape[1] > max_pixels:
+        scale = (max_pixels / (image.shape[0] * image.shape[1])) ** 0.5
+        size = (max(1, int(image.shape[1] * scale)), max(1, int(image.shape[0] * scale)))
+        image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+    return image, tuple(dimensions)
+
+
+def restore_mask(mask: np.ndarray, dimensions: Tuple[int, int]) -> np.ndarray:
+    """Возврат маски к исходному размеру ближайшим соседом.
+
+    Args:
+        mask: Маска в рабочем разрешении
+        dimensions: Исходный размер (высота, ширина)
+
+    Returns:
+        np.ndarray: Маска исходного размера
+    """
+    import cv2
+    import numpy as np
+
+    if mask.shape[:2] == tuple(dimensions):
+        return mask
+    if mask.dtype == bool:
+        mask = mask.view(np.uint8)
+    height, width = dimensions
+    return cv2.resize(mask, (width, height), interpolation=cv2.INTER_NEAREST)
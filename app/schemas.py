@@ -7,7 +7,7 @@
 """
 
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional
 from pydantic import BaseModel, EmailStr, validator
 
 
@@ -90,6 +90,29 @@ class SegmentationBase(BaseModel):
         from_attributes = True
 
 
+class SegmentationListItem(SegmentationBase):
+    """Запись истории загрузок: метаданные сегментации без содержимого изображений."""
+    engine: Optional[str] = None
+    engine_version: Optional[str] = None
+    original_media_type: Optional[str] = None
+    original_size: Optional[int] = None
+    original_url: str
+    segmented_url: str
+    original_thumb_url: str
+    segmented_thumb_url: str
+
+
+class SegmentationPage(BaseModel):
+    """Страница истории загрузок.
+
+    Attributes:
+        items: Сегментации от новых к старым
+        next_cursor: Курсор следующей страницы (None - это последняя)
+    """
+    items: List[SegmentationListItem]
+    next_cursor: Optional[str] = None
+
+
 class UserDeleteResponse(BaseModel):
     """Модель ответа на удаление пользователя."""
     message: str
@@ -1,39 +1,135 @@
 """Модуль для сегментации изображений.
 
 Содержит функции для:
-- Преобразования изображений
-- Бинаризации изображений
-- Обработки и кодировки/декодировки изображений
+- Декодирования изображений в рабочем разрешении
+- Бинаризации изображений выбранным движком
+- Пакетной обработки изображений одного размера
+- Упаковки масок исходного размера
+
+Сами алгоритмы зарегистрированы в модуле engines.
 """
 
-import cv2
-import numpy as np
+from collections import defaultdict
+from typing import List, Optional, Union
+
+from .config import settings
+from .engines import SegmentationEngine, get_engine
+from .masks import MASK_MEDIA_TYPE, pack_mask
+from .preprocess import decode_image, restore_mask
+from .telemetry import span
+
+# Версия формата результата: входит в ключ кеша вместе с версией движка,
+# чтобы запомненные результаты старого формата не переиспользовались
+RESULT_FORMAT_VERSION = "mask/2"
+
+# Медиатип результата segment_image
+RESULT_MEDIA_TYPE = MASK_MEDIA_TYPE
+
+
+def working_megapixels(engine: SegmentationEngine) -> Optional[float]:
+    """Рабочее разрешение движка с учётом настроек (None - исходное)."""
+    value = settings.SEGMENTATION_WORKING_MEGAPIXELS.get(engine.name, engine.working_megapixels)
+    return value or None
 
 
-def segment_image(image_bytes: bytes) -> bytes:
+def params_key(algorithm: str, params: dict, tiled: bool = False) -> str:
+    """Ключ результата в кеше: формат, движок, его версия, параметры и рабочее разрешение.
+
+    Потайловая обработка идёт в исходном разрешении и совпадает с обычной
+    в исходном разрешении, поэтому делит с ней ключ.
+    """
+    engine = get_engine(algorithm)
+    key = f"{RESULT_FORMAT_VERSION}:{engine.cache_key(params)}"
+    megapixels = None if tiled else working_megapixels(engine)
+    return f"{key}@{megapixels}mp" if megapixels else key
+
+
+def segment_image(image_bytes: bytes, algorithm: str = "threshold",
+                  params: Optional[dict] = None) -> bytes:
     """Выполняет сегментацию изображения.
 
+    Изображение декодируется сразу в оттенки серого, если движку не нужен
+    цвет, и при заданном рабочем разрешении - с уменьшением; маска затем
+    возвращается к исходному размеру.
+
     Args:
         image_bytes: Байтовое представление исходного изображения
+        algorithm: Имя движка сегментации (см. engines)
+        params: Проверенные параметры движка
 
     Returns:
-        bytes: Байтовое представление сегментированного изображения
+        bytes: Упакованная бинарная маска исходного размера (см. masks.pack_mask)
 
     Raises:
         ValueError: Если произошла ошибка при обработке изображения
     """
     try:
-        # Конвертируем bytes в numpy array
-        nparr = np.frombuffer(image_bytes, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-
-        # Пример простой сегментации (замените на вашу реальную логику)
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        _, segmented = cv2.threshold(gray, 127, 255, cv2.THRESH_BINARY)
+        engine = get_engine(algorithm)
+        megapixels = working_megapixels(engine)
+        with span("decode"):
+            image, dimensions = decode_image(
+                image_bytes,
+                color=engine.color,
+                max_pixels=int(megapixels * 1e6) if megapixels else None
+            )
+        with span("segment"):
+            segmented = engine.segment(image, **(params or {}))
 
-        # Конвертируем обратно в bytes
-        _, img_encoded = cv2.imencode('.jpg', segmented)
-        return img_encoded.tobytes()
+        # Маска строго бинарная, поэтому храним 1 бит на пиксель без потерь
+        with span("encode"):
+            return pack_mask(restore_mask(segmented, dimensions))
 
     except Exception as error:
         raise ValueError(f"Segmentation error: {str(error)}") from error
+
+
+def segment_images(images: list, algorithm: str = "threshold",
+                   params: Optional[dict] = None) -> List[Union[bytes, str]]:
+    """Сегментация пакета изображений.
+
+    Изображения одного рабочего размера складываются в один массив и
+    передаются движку целиком (SegmentationEngine.segment_batch), так что
+    поэлементные движки обрабатывают группу одним векторизованным
+    проходом. Ошибка одного изображения не прерывает остальные.
+
+    Args:
+        images: Закодированные изображения
+        algorithm: Имя движка сегментации
+        params: Проверенные параметры движка
+
+    Returns:
+        list: Для каждого изображения упакованная маска или текст ошибки
+    """
+    import numpy as np
+
+    params = params or {}
+    engine = get_engine(algorithm)
+    megapixels = working_megapixels(engine)
+    max_pixels = int(megapixels * 1e6) if megapixels else None
+
+    results: List[Union[bytes, str]] = [""] * len(images)
+    groups = defaultdict(list)
+    for index, image_bytes in enumerate(images):
+        try:
+            with span("decode"):
+                image, dimensions = decode_image(image_bytes, color=engine.color,
+                                                 max_pixels=max_pixels)
+        except Exception as error:  # pylint: disable=broad-except
+            results[index] = f"Segmentation error: {str(error)}"
+            continue
+        groups[image.shape].append((index, image, dimensions))
+
+    for members in groups.values():
+        # Стек копирует изображения, поэтому одиночное передаётся как вид
+        batch = (np.stack([image for _, image, _ in members]) if len(members) > 1
+                 else members[0][1][np.newaxis])
+        try:
+            with span("segment"):
+                segmented = engine.segment_batch(batch, **params)
+            for (index, _, dimensions), mask in zip(members, segmented):
+                with span("encode"):
+                    results[index] = pack_mask(restore_mask(mask, dimensions))
+        except Exception as error:  # pylint: disable=broad-except
+            for index, _, _ in members:
+                results[index] = f"Segmentation error: {str(error)}"
+    return results
@@ -0,0 +1,322 @@
+"""Модуль хранилища бинарных объектов (изображений).
+
+Содержит:
+- Интерфейс хранилища с адресацией по содержимому (SHA-256)
+- Локальную реализацию на файловой системе с шардированием каталогов
+- Чтение объекта без копирования в память (mmap)
+- Отложенное удаление объектов (пометка и сборка после отсрочки)
+- Определение медиатипа изображения по сигнатуре
+"""
+
+import hashlib
+import mmap
+import os
+import secrets
+import tempfile
+from pathlib import Path
+from typing import BinaryIO, Iterator, List, NamedTuple, Optional
+
+from .config import project_path, settings
+
+CHUNK_SIZE = 1024 * 1024
+
+# Сигнатуры форматов: (префикс, смещение, медиатип)
+_SIGNATURES = (
+    (b"\xff\xd8\xff", 0, "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", 0, "image/png"),
+    (b"GIF87a", 0, "image/gif"),
+    (b"GIF89a", 0, "image/gif"),
+    (b"BM", 0, "image/bmp"),
+    (b"II*\x00", 0, "image/tiff"),
+    (b"MM\x00*", 0, "image/tiff"),
+    (b"WEBP", 8, "image/webp"),
+)
+
+
+class BlobRef(NamedTuple):
+    """Ссылка на сохранённый объект.
+
+    Attributes:
+        digest: SHA-256 содержимого в шестнадцатеричном виде
+        size: Размер в байтах
+    """
+    digest: str
+    size: int
+
+
+def guess_media_type(header: bytes) -> Optional[str]:
+    """Определение медиатипа изображения по первым байтам.
+
+    Args:
+        header: Начало файла (достаточно 16 байт)
+
+    Returns:
+        str: Медиатип или None, если формат не распознан
+    """
+    for signature, offset, media_type in _SIGNATURES:
+        if header[offset:offset + len(signature)] == signature:
+            if media_type == "image/webp" and not header.startswith(b"RIFF"):
+                continue
+            return media_type
+    return None
+
+
+class BlobView:
+    """Содержимое объекта как буфер: отображение файла или прочитанные байты.
+
+    Attributes:
+        view: memoryview содержимого
+    """
+
+    def __init__(self, data=None, mapping: Optional[mmap.mmap] = None,
+                 blob_file: Optional[BinaryIO] = None):
+        self._mmap = mapping
+        self._file = blob_file
+        self.view = memoryview(mapping if mapping is not None else data)
+
+    def read_at(self, offset: int, size: int) -> bytes:
+        """Чтение участка объекта.
+
+        Для файла участок читается через pread: страницы попадают только
+        в кеш ОС, а не в память процесса, как при обращении к отображению.
+        """
+        if self._file is not None:
+            return os.pread(self._file.fileno(), size, offset)
+        return bytes(self.view[offset:offset + size])
+
+    def close(self):
+        """Освобождение буфера и закрытие отображения."""
+        if self._file is not None:
+            self._file.close()
+        try:
+            self.view.release()
+            if self._mmap is not None:
+                self._mmap.close()
+        except BufferError:
+            # Буфер ещё используется (например, обработкой, прерванной по
+            # таймауту); отображение закроется сборщиком мусора
+            pass
+
+    def __enter__(self) -> "BlobView":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class BlobStore:
+    """Базовый интерфейс хранилища с адресацией по содержимому."""
+
+    def put(self, data: bytes, digest: Optional[str] = None) -> BlobRef:
+        """Сохранение объекта.
+
+        Args:
+            data: Содержимое (bytes или любой буфер)
+            digest: Заранее посчитанный SHA-256, если известен
+
+        Returns:
+            BlobRef: Ссылка на объект
+        """
+        raise NotImplementedError
+
+    def exists(self, digest: str) -> bool:
+        """Проверка наличия объекта."""
+        raise NotImplementedError
+
+    def read(self, digest: str) -> bytes:
+        """Чтение объекта целиком."""
+        raise NotImplementedError
+
+    def iter_chunks(self, digest: str) -> Iterator[bytes]:
+        """Потоковое чтение объекта блоками."""
+        raise NotImplementedError
+
+    def open_view(self, digest: str) -> BlobView:
+        """Содержимое объекта как буфер; в памяти только прочитанные страницы.
+
+        Базовая реализация читает объект целиком.
+        """
+        return BlobView(self.read(digest))
+
+    def local_path(self, digest: str) -> Optional[Path]:
+        """Путь к файлу объекта, если хранилище локальное.
+
+        Returns:
+            Path: Путь для отдачи через sendfile или None
+        """
+        return None
+
+    def delete(self, digest: str):
+        """Удаление объекта (отсутствующий объект не ошибка)."""
+        raise NotImplementedError
+
+    def mark_deleted(self, digest: str):
+        """Пометка объекта к удалению (время пометки обновляется).
+
+        Помеченный объект остаётся доступным; put того же содержимого
+        снимает пометку.
+        """
+        raise NotImplementedError
+
+    def pending_deletions(self, marked_before: float) -> List[str]:
+        """Хеши объектов, помеченных к удалению раньше заданного времени.
+
+        Args:
+            marked_before: Граница времени пометки (time.time())
+        """
+        raise NotImplementedError
+
+    def unmark(self, digest: str):
+        """Снятие пометки к удалению."""
+        raise NotImplementedError
+
+    def sweep(self, digest: str) -> bool:
+        """Удаление помеченного объекта, если пометка не снята.
+
+        Returns:
+            bool: True, если объект удалён
+        """
+        raise NotImplementedError
+
+
+class LocalBlobStore(BlobStore):
+    """Хранилище на локальном диске.
+
+    Объект с хешем ``abcdef...`` лежит в ``<root>/ab/cd/abcdef...``.
+    Запись идёт во временный файл того же каталога с последующим
+    атомарным переименованием, поэтому читатели никогда не видят
+    частично записанный объект.
+
+    Пометки к удалению - пустые файлы ``<root>/.pending/<digest>``, время
+    пометки - их mtime. put сначала снимает пометку и только потом
+    проверяет наличие объекта, а sweep сначала убирает объект под
+    временное имя и только потом проверяет пометку. Поэтому put,
+    пересёкшийся со сборкой, либо видит снятую пометку у sweep (объект
+    возвращается на место), либо не находит файл и записывает его заново.
+
+    Attributes:
+        root: Корневой каталог хранилища
+    """
+
+    def __init__(self, root: str):
+        self.root = Path(root)
+
+    def _path(self, digest: str) -> Path:
+        return self.root / digest[:2] / digest[2:4] / digest
+
+    def _marker(self, digest: str) -> Path:
+        return self.root / ".pending" / digest
+
+    def put(self, data: bytes, digest: Optional[str] = None) -> BlobRef:
+        view = memoryview(data).cast("B")
+        if digest is None:
+            digest = hashlib.sha256(view).hexdigest()
+        self.unmark(digest)
+        path = self._path(digest)
+        if path.exists():
+            return BlobRef(digest, view.nbytes)
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        file_descriptor, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+        try:
+            with os.fdopen(file_descriptor, "wb") as tmp_file:
+                tmp_file.write(view)
+                tmp_file.flush()
+                os.fsync(tmp_file.fileno())
+            os.replace(tmp_name, path)
+        except BaseException:
+            if os.path.exists(tmp_name):
+                os.unlink(tmp_name)
+            raise
+        return BlobRef(digest, view.nbytes)
+
+    def exists(self, digest: str) -> bool:
+        return self._path(digest).exists()
+
+    def read(self, digest: str) -> bytes:
+        return self._path(digest).read_bytes()
+
+    def iter_chunks(self, digest: str) -> Iterator[bytes]:
+        with open(self._path(digest), "rb") as blob_file:
+            while chunk := blob_file.read(CHUNK_SIZE):
+                yield chunk
+
+    def open_view(self, digest: str) -> BlobView:
+        blob_file = open(self._path(digest), "rb")  # pylint: disable=consider-using-with
+        try:
+            if os.fstat(blob_file.fileno()).st_size == 0:
+                blob_file.close()
+                return BlobView(b"")
+            mapping = mmap.mmap(blob_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except BaseException:
+            blob_file.close()
+            raise
+        return BlobView(mapping=mapping, blob_file=blob_file)
+
+    def local_path(self, digest: str) -> Optional[Path]:
+        path = self._path(digest)
+        return path if path.exists() else None
+
+    def delete(self, digest: str):
+        self._path(digest).unlink(missing_ok=True)
+
+    def mark_deleted(self, digest: str):
+        marker = self._marker(digest)
+        marker.parent.mkdir(parents=True, exist_ok=True)
+        marker.touch()
+
+    def pending_deletions(self, marked_before: float) -> List[str]:
+        try:
+            with os.scandir(self.root / ".pending") as entries:
+                return [entry.name for entry in entries
+                        if entry.stat().st_mtime < marked_before]
+        except FileNotFoundError:
+            return []
+
+    def unmark(self, digest: str):
+        self._marker(digest).unlink(missing_ok=True)
+
+    def sweep(self, digest: str) -> bool:
+        marker = self._marker(digest)
+        path = self._path(digest)
+        trash = path.with_name(f".del-{secrets.token_hex(8)}")
+        try:
+            os.rename(path, trash)
+        except FileNotFoundError:
+            # Объекта уже нет (удалён вручную или другой сборкой)
+            marker.unlink(missing_ok=True)
+            return False
+        if not marker.exists():
+            # put снял пометку, пока шла сборка: объект снова нужен
+            os.replace(trash, path)
+            return False
+        trash.unlink()
+        marker.unlink(missing_ok=True)
+        return True
+
+
+_BACKENDS = {
+    "local": LocalBlobStore,
+}
+
+
+def create_blob_store(backend: str, location: str) -> BlobStore:
+    """Создание хранилища по имени бэкенда.
+
+    Args:
+        backend: Имя бэкенда (сейчас доступен "local")
+        location: Параметр расположения (для "local" - каталог)
+
+    Returns:
+        BlobStore: Экземпляр хранилища
+
+    Raises:
+        ValueError: Если бэкенд неизвестен
+    """
+    if backend not in _BACKENDS:
+        raise ValueError(f"Unknown blob storage backend: {backend}")
+    return _BACKENDS[backend](location)
+
+
+blob_store = create_blob_store(settings.BLOB_STORAGE_BACKEND,
+                               str(project_path(settings.BLOB_STORAGE_PATH)))
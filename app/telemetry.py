@@ -0,0 +1,516 @@
+"""Модуль инструментирования: замеры стадий, метрики Prometheus и профилировщик.
+
+Содержит:
+- Счётчики, гистограммы и вычисляемые метрики в текстовом формате Prometheus
+- Замеры стадий (span) с передачей из пула сегментации в процесс приложения
+- ASGI middleware с метриками запросов и заголовком Server-Timing
+- Семплирующий профилировщик медленных запросов (свёрнутые стеки для flame graph)
+
+При METRICS_ENABLED=false span возвращает общий пустой контекст, а
+middleware не подключается, так что горячий путь почти не меняется.
+"""
+
+import asyncio
+import bisect
+import contextvars
+import logging
+import os
+import secrets
+import sys
+import threading
+import time
+from collections import Counter as StackCounter
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from .config import project_path, settings
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """Монотонный счётчик с метками.
+
+    Attributes:
+        name: Имя метрики
+        documentation: Описание (строка HELP)
+        labelnames: Имена меток
+    """
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        """Увеличение значения для набора меток."""
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+                for labels, value in values]
+
+
+class Histogram:
+    """Гистограмма с фиксированными границами корзин.
+
+    Attributes:
+        name: Имя метрики
+        documentation: Описание (строка HELP)
+        labelnames: Имена меток
+        buckets: Верхние границы корзин по возрастанию
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # Для набора меток: счётчики корзин (последняя - +Inf) и сумма
+        self._values: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str):
+        """Учёт одного наблюдения."""
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = [(labels, list(counts), total) for labels, (counts, total) in self._values.items()]
+        lines = []
+        for labels, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                bucket = _format_labels(self.labelnames, labels, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{bucket} {cumulative}")
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {total}")
+            lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+
+class Collected:
+    """Метрика, вычисляемая при чтении /metrics.
+
+    Подходит для значений, которые уже ведутся в другом месте (размер
+    очереди, счётчики кешей): на горячем пути ничего не добавляется.
+
+    Attributes:
+        name: Имя метрики
+        documentation: Описание (строка HELP)
+        kind: Тип метрики Prometheus (gauge или counter)
+        labelnames: Имена меток
+        collect: Функция, возвращающая {кортеж меток: значение}
+    """
+
+    def __init__(self, name: str, documentation: str, collect: Callable[[], dict],
+                 kind: str = "gauge", labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.collect = collect
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+
+    def samples(self) -> List[str]:
+        try:
+            values = self.collect()
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Cannot collect metric %s", self.name)
+            return []
+        return [f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+                for labels, value in values.items()]
+
+
+class Registry:
+    """Набор метрик, отдаваемых на /metrics."""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        """Регистрация метрики (повторная регистрация имени заменяет её)."""
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """Текстовый формат экспозиции Prometheus 0.0.4."""
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.register(Histogram(
+    "imageseg_stage_seconds", "Duration of processing stages", ("stage",)
+))
+REQUEST_SECONDS = registry.register(Histogram(
+    "imageseg_http_request_duration_seconds", "HTTP request duration", ("method", "route")
+))
+REQUESTS = registry.register(Counter(
+    "imageseg_http_requests_total", "HTTP requests", ("method", "route", "status")
+))
+REQUEST_BYTES = registry.register(Counter(
+    "imageseg_http_request_bytes_total", "HTTP request body bytes", ("route",)
+))
+RESPONSE_BYTES = registry.register(Counter(
+    "imageseg_http_response_bytes_total", "HTTP response body bytes", ("route",)
+))
+WRITE_BATCH_SIZE = registry.register(Histogram(
+    "imageseg_write_batch_size", "Writes committed in one transaction",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256)
+))
+
+# Стадии текущего запроса (для Server-Timing и профилировщика)
+_trace: contextvars.ContextVar = contextvars.ContextVar("telemetry_trace", default=None)
+# Стадии задачи в пуле: передаются в процесс приложения вместе с результатом
+_remote: contextvars.ContextVar = contextvars.ContextVar("telemetry_remote", default=None)
+
+
+def record(stage: str, seconds: float):
+    """Учёт длительности стадии в гистограмме и в трассе текущего запроса."""
+    remote = _remote.get()
+    if remote is not None:
+        remote.append((stage, seconds))
+        return
+    STAGE_SECONDS.observe(seconds, stage)
+    trace = _trace.get()
+    if trace is not None:
+        trace.append((stage, seconds))
+
+
+class _Span:
+    __slots__ = ("stage", "started")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.started = 0.0
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *_exc):
+        record(self.stage, time.perf_counter() - self.started)
+        return False
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(stage: str):
+    """Контекстный менеджер замера стадии.
+
+    Args:
+        stage: Имя стадии (метка stage в imageseg_stage_seconds)
+    """
+    if not settings.METRICS_ENABLED:
+        return _NULL_SPAN
+    return _Span(stage)
+
+
+class Traced:
+    """Обёртка задачи пула, возвращающая результат вместе с замерами стадий.
+
+    Потоки и процессы пула не видят контекст запроса, поэтому замеры
+    копятся в самой задаче и учитываются в процессе приложения
+    (см. executor.SegmentationExecutor.run). Сериализуется pickle,
+    если сериализуема обёрнутая функция.
+
+    Attributes:
+        func: Обёрнутая функция
+        submitted: Время постановки в очередь пула (time.time)
+    """
+
+    def __init__(self, func: Callable, submitted: float):
+        self.func = func
+        self.submitted = submitted
+
+    def __call__(self, *args):
+        # Ожидание свободного воркера - отдельная стадия executor_wait
+        spans: List[Tuple[str, float]] = [("executor_wait", max(0.0, time.time() - self.submitted))]
+        token = _remote.set(spans)
+        try:
+            return self.func(*args), spans
+        finally:
+            _remote.reset(token)
+
+
+def replay(spans: List[Tuple[str, float]]):
+    """Учёт замеров, полученных из задачи пула."""
+    for stage, seconds in spans:
+        record(stage, seconds)
+
+
+# Верхние кадры простаивающих потоков: такие стеки в профиль не попадают
+IDLE_FRAMES = frozenset({
+    "threading:wait", "queue:get", "thread:_worker", "selectors:select",
+    "core:_connection_worker_thread",
+})
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{Path(code.co_filename).stem}:{code.co_name}"
+
+
+class SamplingProfiler:
+    """Семплирующий профилировщик медленных запросов.
+
+    Пока идёт хотя бы один запрос, фоновый поток раз в interval снимает
+    стеки всех потоков (sys._current_frames) и добавляет их ко всем
+    активным запросам. Поэтому при параллельных запросах в профиль
+    попадают и стеки соседей; число одновременных запросов пишется в
+    заголовок файла. Для запросов дольше threshold профиль сохраняется
+    в свёрнутом формате (``стек;кадр количество``) для flamegraph.pl
+    или speedscope.
+
+    Attributes:
+        threshold: Порог длительности запроса в секундах
+        interval: Период снятия стеков в секундах
+        directory: Каталог для профилей
+        max_depth: Максимальная глубина стека
+    """
+
+    def __init__(self, threshold: float, interval: float = 0.005,
+                 directory: str = "./profiles", max_depth: int = 64):
+        self.threshold = threshold
+        self.interval = interval
+        self.directory = Path(directory)
+        self.max_depth = max_depth
+        self._active: Dict[int, dict] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._next_id = 0
+
+    @classmethod
+    def from_settings(cls) -> Optional["SamplingProfiler"]:
+        """Профилировщик по настройкам или None, если он выключен."""
+        if not settings.PROFILE_SLOW_REQUEST_MS:
+            return None
+        return cls(
+            threshold=settings.PROFILE_SLOW_REQUEST_MS / 1000,
+            interval=settings.PROFILE_SAMPLE_INTERVAL,
+            directory=project_path(settings.PROFILE_DIR)
+        )
+
+    def begin(self) -> int:
+        """Начало профилирования запроса.
+
+        Returns:
+            int: Идентификатор для end()
+        """
+        with self._lock:
+            self._next_id += 1
+            request_id = self._next_id
+            self._active[request_id] = {"stacks": StackCounter(), "peers": len(self._active)}
+            for state in self._active.values():
+                state["peers"] = max(state["peers"], len(self._active) - 1)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._sample, name="telemetry-profiler", daemon=True
+                )
+                self._thread.start()
+        self._wakeup.set()
+        return request_id
+
+    def end(self, request_id: int, elapsed: float, label: str) -> Optional[Path]:
+        """Завершение профилирования; для медленного запроса профиль сохраняется.
+
+        Args:
+            request_id: Идентификатор из begin()
+            elapsed: Длительность запроса в секундах
+            label: Метод и маршрут для имени файла
+
+        Returns:
+            Path: Путь к сохранённому профилю или None
+        """
+        with self._lock:
+            state = self._active.pop(request_id, None)
+            if not self._active:
+                self._wakeup.clear()
+        if state is None or elapsed < self.threshold or not state["stacks"]:
+            return None
+        self.directory.mkdir(parents=True, exist_ok=True)
+        safe_label = "".join(char if char.isalnum() else "_" for char in label).strip("_")
+        path = self.directory / f"{time.strftime('%Y%m%d-%H%M%S')}-{request_id}-{safe_label}.folded"
+        with open(path, "w", encoding="utf-8") as output:
+            output.write(f"# {label} {elapsed * 1000:.1f} ms, interval {self.interval * 1000:g} ms, "
+                         f"concurrent requests {state['peers']}\n")
+            for stack, count in state["stacks"].most_common():
+                output.write(f"{stack} {count}\n")
+        return path
+
+    def _sample(self):
+        own = threading.get_ident()
+        while True:
+            self._wakeup.wait()
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            stacks = []
+            for ident, frame in sys._current_frames().items():  # pylint: disable=protected-access
+                if ident == own or _frame_name(frame) in IDLE_FRAMES:
+                    continue
+                frames = []
+                while frame is not None and len(frames) < self.max_depth:
+                    frames.append(_frame_name(frame))
+                    frame = frame.f_back
+                frames.append(names.get(ident, str(ident)))
+                stacks.append(";".join(reversed(frames)))
+            with self._lock:
+                for state in self._active.values():
+                    state["stacks"].update(stacks)
+            time.sleep(self.interval)
+
+
+class TelemetryMiddleware:
+    """ASGI middleware с метриками HTTP-запросов.
+
+    Считает запросы, длительность, байты тела запроса и ответа по
+    шаблону маршрута (а не по пути, чтобы не плодить метки), добавляет
+    заголовок Server-Timing со стадиями запроса и, если включён
+    профилировщик, сохраняет профили медленных запросов.
+
+    Attributes:
+        app: Оборачиваемое ASGI-приложение
+        profiler: Профилировщик медленных запросов или None
+    """
+
+    def __init__(self, app, profiler: Optional[SamplingProfiler] = None):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace: List[Tuple[str, float]] = []
+        token = _trace.set(trace)
+        counters = {"in": 0, "out": 0, "status": 500}
+        started = time.perf_counter()
+        profile_id = self.profiler.begin() if self.profiler else None
+
+        async def receive_counted():
+            message = await receive()
+            if message["type"] == "http.request":
+                counters["in"] += len(message.get("body", b""))
+            return message
+
+        async def send_counted(message):
+            if message["type"] == "http.response.start":
+                counters["status"] = message["status"]
+                if trace:
+                    timing = ", ".join(
+                        f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in trace
+                    )
+                    message = {**message, "headers": [
+                        *message.get("headers", []), (b"server-timing", timing.encode("latin-1"))
+                    ]}
+            elif message["type"] == "http.response.body":
+                counters["out"] += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive_counted, send_counted)
+        finally:
+            _trace.reset(token)
+            elapsed = time.perf_counter() - started
+            route = getattr(scope.get("route"), "path", None) or "other"
+            method = scope["method"]
+            REQUEST_SECONDS.observe(elapsed, method, route)
+            REQUESTS.inc(method, route, str(counters["status"]))
+            REQUEST_BYTES.inc(route, amount=counters["in"])
+            RESPONSE_BYTES.inc(route, amount=counters["out"])
+            if profile_id is not None:
+                try:
+                    path = await asyncio.to_thread(
+                        self.profiler.end, profile_id, elapsed, f"{method} {route}"
+                    )
+                    if path is not None:
+                        logger.info("Slow request %s %s (%.0f ms) profiled to %s",
+                                    method, route, elapsed * 1000, path)
+                except OSError:
+                    logger.exception("Cannot write request profile")
+
+
+def metrics_token_valid(authorization: Optional[str]) -> bool:
+    """Проверка заголовка Authorization для /metrics (METRICS_TOKEN).
+
+    Пустой METRICS_TOKEN не принимает никакой заголовок.
+    """
+    if not settings.METRICS_TOKEN:
+        return False
+    expected = f"Bearer {settings.METRICS_TOKEN}"
+    return secrets.compare_digest((authorization or "").encode(), expected.encode())
+
+
+def register_collectors(collectors: Dict[str, tuple], kind: str = "gauge",
+                        labelnames: Sequence[str] = ()):
+    """Регистрация вычисляемых метрик.
+
+    Args:
+        collectors: Имя метрики -> (описание, функция {кортеж меток: значение})
+        kind: Тип метрик Prometheus
+        labelnames: Имена меток
+    """
+    for name, (documentation, collect) in collectors.items():
+        registry.register(Collected(name, documentation, collect, kind, labelnames))
+
+
+def _resident_memory() -> dict:
+    try:
+        with open("/proc/self/statm", encoding="ascii") as statm:
+            return {(): int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")}
+    except (OSError, ValueError, AttributeError):
+        return {}
+
+
+register_collectors({
+    "imageseg_process_resident_memory_bytes": ("Resident memory size", _resident_memory),
+    "imageseg_process_threads": ("Number of threads", lambda: {(): threading.active_count()}),
+})
@@ -0,0 +1,328 @@
+"""Модуль потайловой сегментации больших изображений.
+
+Содержит:
+- Источники тайлов: несжатый TIFF читается прямо из буфера (mmap)
+  по полосам, остальные форматы декодируются один раз в оттенки серого
+- Разбиение на перекрывающиеся тайлы и их параллельную обработку
+- Сборку маски сразу в упакованном виде (1 бит на пиксель)
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Callable, NamedTuple, Optional
+
+from .config import settings
+from .engines import get_engine
+from .masks import pack_packed
+from .preprocess import read_tiff_tags
+
+if TYPE_CHECKING:
+    import numpy as np
+
+# Веса R, G, B в 14-битной фиксированной точке
+_GRAY_WEIGHTS = (4899, 9617, 1868)
+
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+class ArraySource:
+    """Источник тайлов из изображения, целиком декодированного в оттенки серого.
+
+    Attributes:
+        height: Высота изображения
+        width: Ширина изображения
+    """
+
+    def __init__(self, image: np.ndarray):
+        self._image = image
+        self.height, self.width = image.shape[:2]
+
+    def read(self, top: int, bottom: int, left: int, right: int) -> np.ndarray:
+        """Область изображения в оттенках серого."""
+        return self._image[top:bottom, left:right]
+
+
+class TiffSource:
+    """Источник тайлов из несжатого полосового TIFF без копирования файла.
+
+    Полосы отображаются на исходный буфер через np.ndarray, поэтому в
+    память попадают только страницы, нужные текущим тайлам.
+
+    Attributes:
+        height: Высота изображения
+        width: Ширина изображения
+    """
+
+    def __init__(self, buffer, height: int, width: int, samples: int,
+                 rows_per_strip: int, strip_offsets,
+                 read_at: Optional[Callable[[int, int], bytes]] = None):
+        self._buffer = buffer
+        self.height = height
+        self.width = width
+        self._samples = samples
+        self._rows_per_strip = rows_per_strip
+        self._strip_offsets = strip_offsets
+        self._read_at = read_at
+
+    def _strip(self, index: int) -> np.ndarray:
+        import numpy as np
+
+        rows = min(self._rows_per_strip, self.height - index * self._rows_per_strip)
+        return np.ndarray(
+            (rows, self.width, self._samples), dtype=np.uint8,
+            buffer=self._buffer, offset=self._strip_offsets[index]
+        )
+
+    def read(self, top: int, bottom: int, left: int, right: int) -> np.ndarray:
+        """Область изображения в оттенках серого."""
+        import numpy as np
+
+        parts = []
+        first = top // self._rows_per_strip
+        last = (bottom - 1) // self._rows_per_strip
+        for index in range(first, last + 1):
+            strip_top = index * self._rows_per_strip
+            parts.append(self._strip(index)[
+                max(top - strip_top, 0):bottom - strip_top, left:right
+            ])
+        region = parts[0] if len(parts) == 1 else np.concatenate(parts)
+        if self._samples == 1:
+            return region[:, :, 0]
+        # Те же коэффициенты и округление, что у декодера OpenCV с
+        # IMREAD_GRAYSCALE (cvtColor округляет иначе и расходится на 1)
+        weighted = region.astype(np.uint32) * np.array(_GRAY_WEIGHTS, dtype=np.uint32)
+        return ((weighted.sum(axis=2) + (1 << 13)) >> 14).astype(np.uint8)
+
+    def sample(self, step: int) -> np.ndarray:
+        """Каждая step-я строка и каждый step-й столбец в исходных каналах.
+
+        Читаются только выбранные строки полос (через read_at, если он
+        задан, - без отображения страниц файла в память процесса), поэтому
+        память - размер результата. Цветное изображение возвращается в
+        порядке BGR.
+
+        Args:
+            step: Шаг прореживания (1 - без прореживания)
+
+        Returns:
+            np.ndarray: Изображение (h / step, w / step) или (h / step, w / step, 3)
+        """
+        import numpy as np
+
+        row_bytes = self.width * self._samples
+        rows = []
+        for row in range(0, self.height, step):
+            strip, row_in_strip = divmod(row, self._rows_per_strip)
+            if self._read_at is None:
+                rows.append(self._strip(strip)[row_in_strip, ::step])
+                continue
+            data = self._read_at(self._strip_offsets[strip] + row_in_strip * row_bytes, row_bytes)
+            rows.append(np.frombuffer(data, np.uint8).reshape(self.width, self._samples)[::step])
+        image = np.stack(rows)
+        if self._samples == 1:
+            return image[:, :, 0]
+        return np.ascontiguousarray(image[:, :, ::-1])
+
+
+def parse_tiff(buffer, read_at: Optional[Callable[[int, int], bytes]] = None
+               ) -> Optional[TiffSource]:
+    """Источник полос несжатого TIFF; None, если формат не поддерживается напрямую.
+
+    Args:
+        buffer: Закодированное изображение (bytes, memoryview или mmap)
+        read_at: Чтение участка (смещение, размер) в обход буфера для
+            TiffSource.sample (см. storage.BlobView.read_at)
+
+    Returns:
+        TiffSource: Источник или None (сжатый, тайловый, не 8-битный TIFF, не TIFF)
+    """
+    view = memoryview(buffer)
+    tags = read_tiff_tags(view)
+    if tags is None:
+        return None
+
+    def first(name, default=None):
+        return tags[name][0] if name in tags else default
+
+    height, width = first("height"), first("width")
+    samples = first("samples_per_pixel", 1)
+    supported = (
+        height and width
+        and first("compression", 1) == 1
+        and "tile_width" not in tags
+        and first("planar_configuration", 1) == 1
+        and set(tags.get("bits_per_sample", (8,))) == {8}
+        and (samples, first("photometric")) in ((1, 1), (3, 2))
+        and "strip_offsets" in tags
+    )
+    if not supported:
+        return None
+
+    rows_per_strip = min(first("rows_per_strip", height), height)
+    offsets = tags["strip_offsets"]
+    strips = -(-height // rows_per_strip)
+    if len(offsets) < strips:
+        return None
+    row_bytes = width * samples
+    for index in range(strips):
+        rows = min(rows_per_strip, height - index * rows_per_strip)
+        if offsets[index] + rows * row_bytes > len(view):
+            return None
+    return TiffSource(buffer, height, width, samples, rows_per_strip, offsets, read_at)
+
+
+def open_source(image_bytes):
+    """Источник тайлов для закодированного изображения.
+
+    Несжатый TIFF читается по полосам прямо из буфера; остальные форматы
+    (PNG, JPEG, сжатый TIFF) декодируются один раз сразу в оттенки серого,
+    так как OpenCV не умеет декодировать их по частям.
+
+    Args:
+        image_bytes: Закодированное изображение (bytes, memoryview или mmap)
+
+    Returns:
+        Источник с атрибутами height, width и методом read
+
+    Raises:
+        ValueError: Если изображение не удалось декодировать
+    """
+    import cv2
+    import numpy as np
+
+    source = parse_tiff(image_bytes)
+    if source is not None:
+        return source
+    image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        raise ValueError("Cannot decode image")
+    return ArraySource(image)
+
+
+class Tile(NamedTuple):
+    """Тайл: внутренняя область и область чтения с перекрытием."""
+    top: int
+    bottom: int
+    left: int
+    right: int
+    read_top: int
+    read_bottom: int
+    read_left: int
+    read_right: int
+
+
+def plan_tiles(height: int, width: int, tile_size: int, halo: int):
+    """Разбиение изображения на тайлы.
+
+    Ширина тайла кратна 8, поэтому биты каждого тайла ложатся в
+    упакованную маску с границы байта.
+
+    Args:
+        height: Высота изображения
+        width: Ширина изображения
+        tile_size: Сторона тайла (округляется вверх до кратной 8)
+        halo: Перекрытие с соседями в пикселях
+
+    Yields:
+        Tile: Тайлы построчно
+    """
+    tile_size = max(8, -(-tile_size // 8) * 8)
+    for top in range(0, height, tile_size):
+        bottom = min(top + tile_size, height)
+        for left in range(0, width, tile_size):
+            right = min(left + tile_size, width)
+            yield Tile(
+                top, bottom, left, right,
+                max(top - halo, 0), min(bottom + halo, height),
+                max(left - halo, 0), min(right + halo, width)
+            )
+
+
+def _tile_workers() -> int:
+    return settings.TILE_WORKERS or os.cpu_count() or 1
+
+
+def _tile_pool() -> ThreadPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(
+                max_workers=_tile_workers(),
+                thread_name_prefix="tile"
+            )
+        return _pool
+
+
+def shutdown():
+    """Остановка пула обработки тайлов."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True, cancel_futures=True)
+            _pool = None
+
+
+def segment_tiled(image_bytes, algorithm: str = "threshold",
+                  params: Optional[dict] = None, tile_size: Optional[int] = None) -> bytes:
+    """Потайловая сегментация изображения.
+
+    Тайлы обрабатываются параллельно, в работе одновременно не больше
+    двух тайлов на поток, поэтому пиковая память определяется размером
+    тайла и упакованной маской (1 бит на пиксель), а не размером
+    изображения. Перекрытие берётся из движка (tile_halo), так что для
+    локальных движков результат совпадает с обработкой целиком.
+
+    Args:
+        image_bytes: Закодированное изображение
+        algorithm: Имя движка сегментации
+        params: Проверенные параметры движка
+        tile_size: Сторона тайла (по умолчанию TILE_SIZE)
+
+    Returns:
+        bytes: Упакованная бинарная маска (см. masks.pack_packed)
+
+    Raises:
+        ValueError: Если движок не поддерживает тайлы или изображение не декодируется
+    """
+    import numpy as np
+
+    params = params or {}
+    engine = get_engine(algorithm)
+    halo = engine.tile_halo(params)
+    if halo is None:
+        raise ValueError(f"Algorithm {algorithm} does not support tiled mode")
+
+    try:
+        source = open_source(image_bytes)
+        packed = np.zeros((source.height, -(-source.width // 8)), dtype=np.uint8)
+
+        def process(tile: Tile):
+            region = source.read(tile.read_top, tile.read_bottom, tile.read_left, tile.read_right)
+            mask = engine.segment(np.ascontiguousarray(region), **params)
+            inner = mask[
+                tile.top - tile.read_top:tile.bottom - tile.read_top,
+                tile.left - tile.read_left:tile.right - tile.read_left
+            ]
+            bits = np.packbits(inner.astype(bool, copy=False), axis=-1)
+            packed[tile.top:tile.bottom, tile.left // 8:tile.left // 8 + bits.shape[1]] = bits
+
+        pool = _tile_pool()
+        in_flight = deque()
+        window = 2 * _tile_workers()
+        tiles = plan_tiles(source.height, source.width, tile_size or settings.TILE_SIZE, halo)
+        for tile in tiles:
+            if len(in_flight) >= window:
+                in_flight.popleft().result()
+            in_flight.append(pool.submit(process, tile))
+        while in_flight:
+            in_flight.popleft().result()
+
+        return pack_packed(packed, source.height, source.width)
+
+    except Exception as error:
+        raise ValueError(f"Segmentation error: {str(error)}") from error
@@ -0,0 +1,216 @@
+"""Модуль групповой фиксации записей.
+
+Содержит:
+- Очередь записей сегментаций и оценок от одновременных запросов
+- Задачу-писателя, фиксирующую накопившиеся записи одной транзакцией
+- Повтор записей по одной, если пакет целиком не записался
+"""
+
+import asyncio
+import logging
+from typing import List, NamedTuple, Optional
+
+from . import crud, telemetry
+from .config import settings
+from .database import AsyncSessionLocal
+
+logger = logging.getLogger(__name__)
+
+WRITE_SEGMENTATION = "segmentation"
+WRITE_FEEDBACK = "feedback"
+
+
+class _Write(NamedTuple):
+    """Запись в очереди писателя.
+
+    Attributes:
+        kind: WRITE_SEGMENTATION или WRITE_FEEDBACK
+        args: Аргументы записи (для сегментаций - строки и их результаты)
+        future: Результат для ожидающего запроса
+    """
+    kind: str
+    args: tuple
+    future: asyncio.Future
+
+
+class WriteBatcher:
+    """Групповая фиксация вставок сегментаций и изменений оценок.
+
+    SQLite пропускает одного писателя за раз, поэтому при одновременных
+    загрузках каждый запрос ждал блокировку и платил за свой COMMIT.
+    Здесь запросы ставят запись в очередь и ждут результат, а одна
+    задача-писатель забирает накопившиеся записи (до ``max_batch``) и
+    фиксирует их одной транзакцией. Пока идёт фиксация, новые записи
+    копятся для следующего пакета; если предыдущий пакет был больше одной
+    записи (есть параллельная нагрузка), писатель дополнительно ждёт
+    следующие не дольше ``max_delay``. Одиночные записи без нагрузки
+    фиксируются без ожидания. Без запущенного писателя (или с
+    enabled=False) каждая запись фиксируется сразу своей транзакцией.
+
+    Attributes:
+        enabled: Включена ли групповая фиксация
+        max_batch: Максимум записей в одной транзакции
+        max_delay: Ожидание следующих записей после первой в секундах
+    """
+
+    def __init__(self, enabled: bool = True, max_batch: int = 64, max_delay: float = 0.002):
+        self.enabled = enabled
+        self.max_batch = max(1, max_batch)
+        self.max_delay = max_delay
+        self._queue: Optional[asyncio.Queue] = None
+        self._full: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._last_batch = 0
+
+    @classmethod
+    def from_settings(cls) -> "WriteBatcher":
+        """Создание писателя по настройкам приложения."""
+        return cls(
+            enabled=settings.WRITE_BATCH_ENABLED,
+            max_batch=settings.WRITE_BATCH_MAX_SIZE,
+            max_delay=settings.WRITE_BATCH_MAX_DELAY_MS / 1000
+        )
+
+    @property
+    def depth(self) -> int:
+        """Количество записей, ожидающих фиксации."""
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def start(self):
+        """Запуск писателя в текущем цикле событий."""
+        if not self.enabled or self._task is not None:
+            return
+        self._queue = asyncio.Queue()
+        self._full = asyncio.Event()
+        self._task = asyncio.create_task(self._writer())
+
+    async def shutdown(self):
+        """Остановка писателя после фиксации уже принятых записей."""
+        if self._task is None:
+            return
+        await self._queue.join()
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        self._queue = None
+
+    async def create_segmentation(self, row: dict, cached_result: Optional[tuple] = None) -> int:
+        """Вставка сегментации.
+
+        Args:
+            row: Значения столбцов Segmentation
+            cached_result: Аргументы crud.add_cached_result для нового результата
+
+        Returns:
+            int: ID созданной сегментации
+        """
+        ids = await self.create_segmentations([row], [cached_result] if cached_result else [])
+        return ids[0]
+
+    async def create_segmentations(self, rows: List[dict], cached_results: List[tuple]) -> List[int]:
+        """Вставка сегментаций пакетной загрузки.
+
+        Строки одного вызова - одна запись очереди: они фиксируются вместе
+        (в одной транзакции с записями других запросов) или не фиксируются.
+
+        Args:
+            rows: Значения столбцов Segmentation
+            cached_results: Аргументы crud.add_cached_result для новых результатов
+
+        Returns:
+            list: ID созданных сегментаций в порядке rows
+        """
+        if not rows and not cached_results:
+            return []
+        if self._queue is None:
+            async with AsyncSessionLocal() as database_session:
+                return await database_session.run_sync(
+                    crud.bulk_create_segmentations, rows, cached_results
+                )
+        return await self._submit(WRITE_SEGMENTATION, rows, cached_results)
+
+    async def set_feedback(self, segmentation_id: int, is_good: bool) -> bool:
+        """Изменение оценки сегментации (см. crud.update_feedback).
+
+        Returns:
+            bool: True, если сегментация найдена и обновлена
+        """
+        if self._queue is None:
+            async with AsyncSessionLocal() as database_session:
+                return await database_session.run_sync(crud.set_feedback, segmentation_id, is_good)
+        return await self._submit(WRITE_FEEDBACK, segmentation_id, is_good)
+
+    async def _submit(self, kind: str, *args):
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait(_Write(kind, args, future))
+        if self._queue.qsize() >= self.max_batch:
+            self._full.set()
+        return await future
+
+    async def _writer(self):
+        while True:
+            batch = [await self._queue.get()]
+            if self.max_delay > 0 and self._last_batch > 1 \
+                    and self._queue.qsize() + 1 < self.max_batch:
+                # Ожидание события, а не queue.get с таймаутом: отмена
+                # ожидания не может потерять уже извлечённую запись
+                self._full.clear()
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.max_delay)
+                except asyncio.TimeoutError:
+                    pass
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            self._last_batch = len(batch)
+            try:
+                await self._commit(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _commit(self, batch: list):
+        rows, cached_results, feedback = [], [], []
+        for write in batch:
+            if write.kind == WRITE_SEGMENTATION:
+                rows.extend(write.args[0])
+                cached_results.extend(write.args[1])
+            else:
+                feedback.append(write.args)
+        try:
+            async with AsyncSessionLocal() as database_session:
+                ids, updated = await database_session.run_sync(
+                    crud.apply_write_batch, rows, cached_results, feedback
+                )
+        except asyncio.CancelledError:
+            raise
+        except Exception as write_error:  # pylint: disable=broad-except
+            if len(batch) == 1:
+                _resolve(batch[0].future, error=write_error)
+                return
+            # Одна неудачная запись не должна отклонять чужие
+            logger.warning("Write batch of %d failed, retrying one by one", len(batch),
+                           exc_info=True)
+            for write in batch:
+                await self._commit([write])
+            return
+
+        telemetry.WRITE_BATCH_SIZE.observe(len(batch))
+        ids, updated = iter(ids), iter(updated)
+        for write in batch:
+            if write.kind == WRITE_SEGMENTATION:
+                _resolve(write.future, [next(ids) for _ in write.args[0]])
+            else:
+                _resolve(write.future, next(updated))
+
+
+def _resolve(future: asyncio.Future, result=None, error: Optional[Exception] = None):
+    """Передача результата запросу, если он ещё ждёт (запрос мог быть отменён)."""
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+write_batcher = WriteBatcher.from_settings()
@@ -0,0 +1,5 @@
+"""Бенчмарки производительности сервиса.
+
+Запускаются из корня репозитория как модули, например:
+``python -m benchmarks.bench_queries``
+"""
@@ -0,0 +1,90 @@
+"""Замер памяти и задержки подготовки изображения к сегментации.
+
+Запуск: ``python -m benchmarks.bench_decode [--sizes 0.3 2 12 40] [--repeat N]``
+
+Для синтетических JPEG разного размера сравниваются режимы:
+
+- ``color`` - декодирование в BGR и cvtColor, как было до preprocess;
+- ``gray`` - декодирование сразу в оттенки серого;
+- ``reduced`` - рабочее разрешение ``--working-mp`` через IMREAD_REDUCED_*
+  с возвратом маски к исходному размеру.
+
+Пиковая память считается через tracemalloc: массивы numpy, в том числе
+результаты cv2, учитываются, внутренние буферы декодера - нет.
+"""
+
+import argparse
+import time
+import tracemalloc
+
+from benchmarks.common import percentile, synthetic_image
+
+
+def _color(data, _working_pixels):
+    import cv2
+    import numpy as np
+
+    image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return cv2.threshold(gray, 127, 255, cv2.THRESH_BINARY)[1]
+
+
+def _gray(data, _working_pixels):
+    import cv2
+
+    from app.preprocess import decode_image
+
+    image, _ = decode_image(data)
+    return cv2.threshold(image, 127, 255, cv2.THRESH_BINARY)[1]
+
+
+def _reduced(data, working_pixels):
+    import cv2
+
+    from app.preprocess import decode_image, restore_mask
+
+    image, dimensions = decode_image(data, max_pixels=working_pixels)
+    return restore_mask(cv2.threshold(image, 127, 255, cv2.THRESH_BINARY)[1], dimensions)
+
+
+MODES = {"color": _color, "gray": _gray, "reduced": _reduced}
+
+
+def measure(func, data, working_pixels: int, repeat: int):
+    """Медианная задержка и пиковая память одного режима."""
+    tracemalloc.start()
+    func(data, working_pixels)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(data, working_pixels)
+        timings.append(time.perf_counter() - started)
+    return percentile(timings, 0.5), peak
+
+
+def run(sizes, repeat: int, working_megapixels: float):
+    """Запуск замеров и вывод таблицы."""
+    working_pixels = int(working_megapixels * 1e6)
+    print(f"{'MP':>6} {'mode':>8} {'p50, ms':>9} {'peak, MB':>9}")
+    for megapixels in sizes:
+        data = synthetic_image(megapixels)
+        for mode, func in MODES.items():
+            latency, peak = measure(func, data, working_pixels, repeat)
+            print(f"{megapixels:>6} {mode:>8} {latency * 1000:>9.1f} {peak / 2 ** 20:>9.1f}")
+
+
+def main():
+    """Точка входа командной строки."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=float, nargs="+", default=[0.3, 2, 12, 40])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--working-mp", type=float, default=2.0)
+    args = parser.parse_args()
+    run(args.sizes, args.repeat, args.working_mp)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Нагрузочный тест: задержка отдачи изображений во время всплеска входов.
+
+Запуск: ``python -m benchmarks.bench_login_storm [--logins N] [--inline]``
+
+Параллельно с N одновременными POST /login непрерывно запрашивается
+GET /api/original/{id}, и для него выводятся p50/p99/max задержки, а
+также число входов, отклонённых с 503 (сверх PASSWORD_HASH_CONCURRENCY).
+Флаг ``--inline`` выполняет bcrypt прямо в цикле событий, как было
+до выноса хеширования в credentials, для сравнения.
+"""
+
+import argparse
+import asyncio
+import time
+
+from benchmarks.common import isolated_workdir, percentile, synthetic_image
+
+PASSWORD = "Passw0rdStorm"
+
+
+async def _storm(app_module, logins: int):
+    import httpx
+
+    transport = httpx.ASGITransport(app=app_module.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        await client.post("/login", data={"username": "storm", "password": PASSWORD})
+        upload = await client.post(
+            "/api/upload",
+            files={"file": ("probe.jpg", synthetic_image(0.3), "image/jpeg")}
+        )
+        image_url = f"/api/original/{upload.json()['id']}"
+
+        latencies = []
+        rejected = []
+        storm_done = asyncio.Event()
+
+        async def probe():
+            while not storm_done.is_set():
+                started = time.perf_counter()
+                await client.get(image_url)
+                latencies.append(time.perf_counter() - started)
+                await asyncio.sleep(0.005)
+
+        async def login():
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as storm_client:
+                response = await storm_client.post(
+                    "/login", data={"username": "storm", "password": PASSWORD}
+                )
+                if response.status_code == 503:
+                    rejected.append(response)
+
+        probe_task = asyncio.create_task(probe())
+        started = time.perf_counter()
+        await asyncio.gather(*(login() for _ in range(logins)))
+        storm_seconds = time.perf_counter() - started
+        storm_done.set()
+        await probe_task
+    # ASGITransport не запускает lifespan, поэтому пул закрываем сами
+    await app_module.async_engine.dispose()
+    return latencies, storm_seconds, len(rejected)
+
+
+def run(logins: int, inline: bool, rounds: int):
+    """Запуск теста и вывод результатов."""
+    with isolated_workdir(BCRYPT_ROUNDS=rounds):
+        from app import credentials, crud, main, schemas
+        from app.database import SessionLocal, engine
+        from app.migrate import migrate
+
+        migrate()
+
+        if inline:
+            async def run_inline(func, *args):
+                return func(*args)
+            credentials._run = run_inline  # pylint: disable=protected-access
+
+        with SessionLocal() as session:
+            crud.create_user(
+                session,
+                schemas.UserCreate(
+                    username="storm", email="storm@example.com",
+                    password=PASSWORD, password_confirm=PASSWORD
+                ),
+                credentials.pwd_context.hash(PASSWORD)
+            )
+
+        latencies, storm_seconds, rejected = asyncio.run(_storm(main, logins))
+        main.segmentation_executor.shutdown()
+        credentials.shutdown()
+        engine.dispose()
+
+    mode = "inline" if inline else "offloaded"
+    print(f"mode={mode} logins={logins} rounds={rounds} storm={storm_seconds:.2f}s "
+          f"probes={len(latencies)} rejected={rejected}")
+    print(f"GET /api/original latency: p50={percentile(latencies, 0.5) * 1000:.1f}ms "
+          f"p99={percentile(latencies, 0.99) * 1000:.1f}ms "
+          f"max={max(latencies) * 1000:.1f}ms")
+
+
+def main():
+    """Точка входа командной строки."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--logins", type=int, default=20)
+    parser.add_argument("--rounds", type=int, default=12)
+    parser.add_argument("--inline", action="store_true")
+    args = parser.parse_args()
+    run(args.logins, args.inline, args.rounds)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""Бенчмарк объёма данных, читаемых из БД на один запрос к изображениям.
+
+Запуск: ``python -m benchmarks.bench_queries [--rows N] [--image-kb K]``
+
+Сравнивает:
+- "до": чтение строки сегментации целиком вместе с колонками LargeBinary,
+  как это делали обработчики через query(models.Segmentation).first()
+- "после": проекции crud.get_image_ref и UPDATE crud.set_feedback
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+from app import crud, models
+
+LEGACY_TABLE = """
+CREATE TABLE legacy_segmentations (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER,
+    original_image BLOB,
+    segmented_image BLOB,
+    is_good BOOLEAN,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+
+def _row_bytes(row) -> int:
+    """Оценка объёма строки: длина строк/байтов, числа - по 8 байт."""
+    return sum(
+        len(value) if isinstance(value, (bytes, str)) else 8
+        for value in row if value is not None
+    )
+
+
+def _setup(directory: str, rows: int, image_size: int):
+    legacy_engine = create_engine(f"sqlite:///{directory}/legacy.db")
+    current_engine = create_engine(f"sqlite:///{directory}/current.db")
+    payload = os.urandom(image_size)
+
+    with legacy_engine.begin() as connection:
+        connection.execute(text(LEGACY_TABLE))
+        connection.execute(
+            text("INSERT INTO legacy_segmentations (user_id, original_image, segmented_image) "
+                 "VALUES (1, :original, :segmented)"),
+            [{"original": payload, "segmented": payload[:image_size // 4]}] * rows
+        )
+
+    models.Base.metadata.create_all(bind=current_engine)
+    with current_engine.begin() as connection:
+        connection.execute(models.Segmentation.__table__.insert(), [{
+            "user_id": 1,
+            "original_digest": f"{index:064x}",
+            "original_size": image_size,
+            "original_media_type": "image/jpeg",
+            "segmented_digest": f"{index + rows:064x}",
+            "segmented_size": image_size // 4,
+            "segmented_media_type": "image/jpeg",
+        } for index in range(rows)])
+    return legacy_engine, current_engine
+
+
+def _measure(func, ids) -> tuple:
+    total_bytes = 0
+    started = time.perf_counter()
+    for segmentation_id in ids:
+        total_bytes += func(segmentation_id)
+    elapsed = time.perf_counter() - started
+    return total_bytes / len(ids), elapsed / len(ids) * 1000
+
+
+def run(rows: int, image_size: int, requests: int):
+    """Запуск бенчмарка и вывод таблицы результатов."""
+    with tempfile.TemporaryDirectory() as directory:
+        legacy_engine, current_engine = _setup(directory, rows, image_size)
+        legacy_session = sessionmaker(bind=legacy_engine)()
+        current_session = sessionmaker(bind=current_engine)()
+        rng = random.Random(0)
+        ids = [rng.randint(1, rows) for _ in range(requests)]
+
+        def legacy_get(segmentation_id):
+            row = legacy_session.execute(
+                text("SELECT * FROM legacy_segmentations WHERE id = :id"),
+                {"id": segmentation_id}
+            ).first()
+            return _row_bytes(row)
+
+        def legacy_feedback(segmentation_id):
+            read = legacy_get(segmentation_id)
+            legacy_session.execute(
+                text("UPDATE legacy_segmentations SET is_good = 1 WHERE id = :id"),
+                {"id": segmentation_id}
+            )
+            legacy_session.commit()
+            return read
+
+        def current_get(kind):
+            def handler(segmentation_id):
+                return _row_bytes(crud.get_image_ref(current_session, segmentation_id, kind))
+            return handler
+
+        def current_feedback(segmentation_id):
+            crud.set_feedback(current_session, segmentation_id, True)
+            return 0
+
+        cases = (
+            ("GET /api/original", legacy_get, current_get("original")),
+            ("GET /api/segmented", legacy_get, current_get("segmented")),
+            ("POST /api/feedback", legacy_feedback, current_feedback),
+        )
+        print(f"{'request':<22}{'bytes before':>14}{'bytes after':>14}"
+              f"{'ms before':>12}{'ms after':>12}")
+        for name, before, after in cases:
+            bytes_before, ms_before = _measure(before, ids)
+            bytes_after, ms_after = _measure(after, ids)
+            print(f"{name:<22}{bytes_before:>14.0f}{bytes_after:>14.0f}"
+                  f"{ms_before:>12.3f}{ms_after:>12.3f}")
+
+        legacy_session.close()
+        current_session.close()
+        legacy_engine.dispose()
+        current_engine.dispose()
+
+
+def main():
+    """Точка входа командной строки."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=200)
+    parser.add_argument("--image-kb", type=int, default=2048)
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+    run(args.rows, args.image_kb * 1024, args.requests)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""Замер времени импорта и запуска приложения.
+
+Запуск: ``python -m benchmarks.bench_startup [--runs N] [--max-import-ms MS] [--max-startup-ms MS]``
+
+Каждый замер выполняется в новом интерпретаторе в отдельном временном
+каталоге (см. common.isolated_workdir) - так же, как стартует воркер
+uvicorn. Замеряются:
+
+- ``import`` - ``import app.main``; после него проверяется, что импорт не
+  создал файлов (БД, хранилище) и не загрузил cv2/numpy;
+- ``startup`` - запуск lifespan (пулы, воркеры очередей) до готовности;
+- ``first_request`` - первый запрос (страница входа) после запуска;
+- ``first_segment`` - первая сегментация, включая загрузку cv2/numpy.
+
+Схема БД создаётся миграцией после замера импорта и во время не входит.
+Если медиана импорта или запуска превышает цель, скрипт завершается с
+кодом 1.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+from benchmarks.common import REPO_ROOT, isolated_workdir, percentile, synthetic_image
+
+# Выполняется в отдельном интерпретаторе; печатает результат одной строкой JSON
+CHILD = """
+import asyncio, json, os, sys, time
+
+started = time.perf_counter()
+from app import main
+imported = time.perf_counter()
+report = {
+    "import_ms": (imported - started) * 1000,
+    "files_after_import": sorted(os.listdir(".")),
+    "heavy_modules": sorted(name for name in ("cv2", "numpy") if name in sys.modules),
+}
+
+started = time.perf_counter()
+main.create_app()
+report["create_app_ms"] = (time.perf_counter() - started) * 1000
+
+from app.migrate import migrate
+migrate()
+
+
+async def serve():
+    import httpx
+
+    started = time.perf_counter()
+    async with main.lifespan(main.app):
+        ready = time.perf_counter()
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            response = await client.get("/login")
+        report["startup_ms"] = (ready - started) * 1000
+        report["first_request_ms"] = (time.perf_counter() - ready) * 1000
+        report["first_request_status"] = response.status_code
+
+asyncio.run(serve())
+
+from app.segmentation import segment_image
+with open(sys.argv[1], "rb") as image_file:
+    image = image_file.read()
+started = time.perf_counter()
+segment_image(image)
+report["first_segment_ms"] = (time.perf_counter() - started) * 1000
+print(json.dumps(report))
+"""
+
+
+def measure_once(image_path: Path) -> dict:
+    """Один холодный запуск в новом интерпретаторе."""
+    with isolated_workdir(BCRYPT_ROUNDS=4) as directory:
+        output = subprocess.run(
+            [sys.executable, "-c", CHILD, str(image_path)],
+            cwd=directory, env={**os.environ, "PYTHONPATH": str(REPO_ROOT)},
+            check=True, capture_output=True, text=True
+        ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def measure(runs: int) -> dict:
+    """Медианы по нескольким холодным запускам.
+
+    Returns:
+        dict: Медианы в мс и признаки побочных эффектов импорта
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        image_path = Path(directory) / "image.jpg"
+        image_path.write_bytes(synthetic_image(2))
+        reports = [measure_once(image_path) for _ in range(runs)]
+    result = {
+        name: percentile([report[name] for report in reports], 0.5)
+        for name in ("import_ms", "create_app_ms", "startup_ms",
+                     "first_request_ms", "first_segment_ms")
+    }
+    result["files_after_import"] = sorted({
+        name for report in reports for name in report["files_after_import"]
+    })
+    result["heavy_modules"] = sorted({
+        name for report in reports for name in report["heavy_modules"]
+    })
+    result["first_request_status"] = reports[-1]["first_request_status"]
+    return result
+
+
+def main():
+    """Точка входа командной строки."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-import-ms", type=float, default=1500.0)
+    parser.add_argument("--max-startup-ms", type=float, default=200.0)
+    args = parser.parse_args()
+
+    result = measure(args.runs)
+    for name, value in result.items():
+        if name.endswith("_ms"):
+            print(f"{name:<18} {value:8.1f}")
+    print(f"files created by import: {result['files_after_import'] or 'none'}")
+    print(f"heavy modules loaded by import: {result['heavy_modules'] or 'none'}")
+
+    failures = []
+    if result["import_ms"] > args.max_import_ms:
+        failures.append(f"import {result['import_ms']:.0f} ms > {args.max_import_ms:.0f} ms")
+    if result["startup_ms"] > args.max_startup_ms:
+        failures.append(f"startup {result['startup_ms']:.0f} ms > {args.max_startup_ms:.0f} ms")
+    if result["files_after_import"]:
+        failures.append("import created files")
+    if failures:
+        print("\n".join(failures))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
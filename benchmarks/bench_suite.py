@@ -0,0 +1,336 @@
+"""Набор бенчмарков сегментации, обработчиков и записи в БД.
+
+Запуск: ``python -m benchmarks.bench_suite [--sizes 0.3 2 12 40] [--output result.json]
+[--baseline baseline.json] [--threshold 0.2]``
+
+Работает без сети, на синтетических изображениях с фиксированным зерном,
+в отдельном временном каталоге (см. common.isolated_workdir). Замеряются:
+
+- ``stage`` - декодирование, сегментация и упаковка маски по отдельности,
+  а также segmentation.segment_image целиком, с пиковой памятью (tracemalloc);
+- ``upload`` - задержка POST /api/upload через ASGI-клиент в процессе;
+- ``get`` - пропускная способность GET оригинала и маски при N параллельных запросах;
+- ``commit`` - запись объекта в хранилище и COMMIT строки сегментации по размерам объекта;
+- ``startup`` - холодный импорт, запуск lifespan, первый запрос и первая сегментация
+  в новом интерпретаторе (см. bench_startup);
+- ``process`` - пиковый RSS процесса.
+
+Результат - JSON со словарём ``metrics``: имя -> значение, единица и
+направление (``lower``/``higher`` - что лучше). С ``--baseline`` метрики
+сравниваются с сохранённым результатом, и при ухудшении больше
+``--threshold`` (доля) скрипт завершается с кодом 1; изменения задержек
+меньше ``--noise-ms`` не учитываются.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+from benchmarks.common import isolated_workdir, percentile, synthetic_image
+
+PASSWORD = "Passw0rdBench"
+COMMIT_SIZES_KB = (16, 256, 1024, 4096)
+
+
+def _metric(value: float, unit: str, better: str = "lower") -> dict:
+    return {"value": round(value, 4), "unit": unit, "better": better}
+
+
+def _timed(func, repeat: int) -> tuple:
+    """Медианная задержка (мс) и пиковая память первого вызова (МБ)."""
+    tracemalloc.start()
+    result = func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return percentile(timings, 0.5) * 1000, peak / 2 ** 20, result
+
+
+def bench_stages(sizes, repeat: int, algorithm: str) -> dict:
+    """Стадии segment_image по отдельности и целиком."""
+    from app.engines import get_engine
+    from app.masks import pack_mask
+    from app.preprocess import decode_image, restore_mask
+    from app.segmentation import segment_image, working_megapixels
+
+    engine = get_engine(algorithm)
+    megapixels = working_megapixels(engine)
+    max_pixels = int(megapixels * 1e6) if megapixels else None
+
+    metrics = {}
+    for size in sizes:
+        data = synthetic_image(size)
+        decode_ms, decode_mb, (image, dimensions) = _timed(
+            lambda: decode_image(data, color=engine.color, max_pixels=max_pixels), repeat
+        )
+        segment_ms, segment_mb, mask = _timed(lambda: engine.segment(image), repeat)
+        encode_ms, encode_mb, _ = _timed(lambda: pack_mask(restore_mask(mask, dimensions)), repeat)
+        total_ms, total_mb, _ = _timed(lambda: segment_image(data, algorithm), repeat)
+
+        prefix = f"stage.{size:g}mp"
+        metrics.update({
+            f"{prefix}.decode_ms": _metric(decode_ms, "ms"),
+            f"{prefix}.segment_ms": _metric(segment_ms, "ms"),
+            f"{prefix}.encode_ms": _metric(encode_ms, "ms"),
+            f"{prefix}.total_ms": _metric(total_ms, "ms"),
+            f"{prefix}.decode_peak_mb": _metric(decode_mb, "MB"),
+            f"{prefix}.segment_peak_mb": _metric(segment_mb, "MB"),
+            f"{prefix}.encode_peak_mb": _metric(encode_mb, "MB"),
+            f"{prefix}.total_peak_mb": _metric(total_mb, "MB"),
+        })
+        print(f"stage {size:>5g} MP: decode {decode_ms:8.1f} ms, segment {segment_ms:8.1f} ms, "
+              f"encode {encode_ms:8.1f} ms, total {total_ms:8.1f} ms, peak {total_mb:7.1f} MB")
+    return metrics
+
+
+async def _endpoints(app_module, sizes, uploads: int, get_requests: int,
+                     concurrency: int) -> dict:
+    import httpx
+
+    metrics = {}
+    transport = httpx.ASGITransport(app=app_module.app)
+    # ASGITransport не запускает lifespan, поэтому фоновые ресурсы запускаем сами
+    async with app_module.lifespan(app_module.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            await client.post("/login", data={"username": "bench", "password": PASSWORD})
+
+            image_id = None
+            for size in sizes:
+                latencies = []
+                for seed in range(uploads):
+                    # Разное зерно - иначе сработает кеш результатов по содержимому
+                    data = synthetic_image(size, seed=seed + 1)
+                    started = time.perf_counter()
+                    response = await client.post(
+                        "/api/upload", files={"file": ("bench.jpg", data, "image/jpeg")}
+                    )
+                    latencies.append(time.perf_counter() - started)
+                    response.raise_for_status()
+                    image_id = image_id or response.json()["id"]
+                median = percentile(latencies, 0.5)
+                metrics[f"upload.{size:g}mp.p50_ms"] = _metric(median * 1000, "ms")
+                metrics[f"upload.{size:g}mp.per_s"] = _metric(1 / median, "req/s", "higher")
+                print(f"upload {size:>5g} MP: p50 {median * 1000:8.1f} ms")
+
+            for kind in ("original", "segmented"):
+                url = f"/api/{kind}/{image_id}"
+                latencies = []
+
+                async def worker(count: int):
+                    for _ in range(count):
+                        started = time.perf_counter()
+                        response = await client.get(url)  # pylint: disable=cell-var-from-loop
+                        latencies.append(time.perf_counter() - started)
+                        response.raise_for_status()
+
+                started = time.perf_counter()
+                await asyncio.gather(*(
+                    worker(get_requests // concurrency) for _ in range(concurrency)
+                ))
+                elapsed = time.perf_counter() - started
+                throughput = len(latencies) / elapsed
+                metrics[f"get.{kind}.per_s"] = _metric(throughput, "req/s", "higher")
+                metrics[f"get.{kind}.p99_ms"] = _metric(percentile(latencies, 0.99) * 1000, "ms")
+                print(f"GET {kind:>9}: {throughput:8.1f} req/s, "
+                      f"p99 {percentile(latencies, 0.99) * 1000:.1f} ms")
+    return metrics
+
+
+def bench_endpoints(sizes, uploads: int, get_requests: int, concurrency: int) -> dict:
+    """Задержка загрузки и пропускная способность GET изображений."""
+    from app import credentials, crud, main, schemas
+    from app.database import SessionLocal
+    from app.migrate import migrate
+
+    migrate()
+    with SessionLocal() as session:
+        crud.create_user(
+            session,
+            schemas.UserCreate(
+                username="bench", email="bench@example.com",
+                password=PASSWORD, password_confirm=PASSWORD
+            ),
+            credentials.pwd_context.hash(PASSWORD)
+        )
+    return asyncio.run(_endpoints(main, sizes, uploads, get_requests, concurrency))
+
+
+def bench_commits(repeat: int) -> dict:
+    """Запись объекта в хранилище и COMMIT строки по размерам объекта."""
+    import numpy as np
+
+    from app import models
+    from app.database import SessionLocal, engine
+    from app.storage import blob_store
+
+    models.Base.metadata.create_all(bind=engine)
+    metrics = {}
+    rng = np.random.default_rng(0)
+    for size_kb in COMMIT_SIZES_KB:
+        put_times, commit_times = [], []
+        for _ in range(repeat):
+            payload = rng.bytes(size_kb * 1024)
+            started = time.perf_counter()
+            ref = blob_store.put(payload)
+            put_times.append(time.perf_counter() - started)
+            with SessionLocal() as session:
+                session.add(models.Segmentation(
+                    user_id=1,
+                    original_digest=ref.digest,
+                    original_size=ref.size,
+                    original_media_type="application/octet-stream",
+                    segmented_digest=ref.digest,
+                    segmented_size=ref.size,
+                    segmented_media_type="application/octet-stream",
+                ))
+                started = time.perf_counter()
+                session.commit()
+                commit_times.append(time.perf_counter() - started)
+        put_ms = percentile(put_times, 0.5) * 1000
+        commit_ms = percentile(commit_times, 0.5) * 1000
+        metrics[f"commit.{size_kb}kb.put_ms"] = _metric(put_ms, "ms")
+        metrics[f"commit.{size_kb}kb.commit_ms"] = _metric(commit_ms, "ms")
+        print(f"commit {size_kb:>5} KB: put {put_ms:7.2f} ms, commit {commit_ms:7.2f} ms")
+    return metrics
+
+
+def bench_startup(runs: int) -> dict:
+    """Холодный импорт и запуск приложения (медианы по runs запускам)."""
+    from benchmarks.bench_startup import measure
+
+    result = measure(runs)
+    metrics = {
+        f"startup.{name}": _metric(result[name], "ms")
+        for name in ("import_ms", "startup_ms", "first_request_ms", "first_segment_ms")
+    }
+    print(f"startup: import {result['import_ms']:.0f} ms, lifespan {result['startup_ms']:.1f} ms, "
+          f"first segment {result['first_segment_ms']:.0f} ms")
+    return metrics
+
+
+def _peak_rss_mb() -> float:
+    try:
+        import resource
+    except ImportError:
+        return float("nan")
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux возвращает килобайты, macOS - байты
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 1024
+
+
+def compare(metrics: dict, baseline: dict, threshold: float, noise_ms: float = 1.0) -> list:
+    """Сравнение с базовым результатом.
+
+    Args:
+        metrics: Метрики текущего запуска
+        baseline: Метрики базового запуска
+        threshold: Допустимое ухудшение (доля)
+        noise_ms: Изменения задержки меньше этого значения не считаются ухудшением
+
+    Returns:
+        list: Имена метрик, ухудшившихся больше порога
+    """
+    regressions = []
+    print(f"\n{'metric':<36} {'baseline':>10} {'current':>10} {'change':>8}")
+    for name, current in metrics.items():
+        previous = baseline.get(name)
+        if not previous or not previous["value"]:
+            continue
+        change = current["value"] / previous["value"] - 1
+        worse = change > threshold if current["better"] == "lower" else change < -threshold
+        if current["unit"] == "ms" and abs(current["value"] - previous["value"]) < noise_ms:
+            worse = False
+        if worse:
+            regressions.append(name)
+        print(f"{name:<36} {previous['value']:>10.2f} {current['value']:>10.2f} "
+              f"{change:>+7.0%}{'  REGRESSION' if worse else ''}")
+    return regressions
+
+
+def run(args) -> dict:
+    """Запуск выбранных групп бенчмарков."""
+    import cv2
+    import numpy as np
+
+    metrics = {}
+    with isolated_workdir(BCRYPT_ROUNDS=4, MAX_UPLOAD_BYTES=args.max_upload_mb * 2 ** 20):
+        if "stage" in args.groups:
+            metrics.update(bench_stages(args.sizes, args.repeat, args.algorithm))
+        if "endpoint" in args.groups:
+            metrics.update(bench_endpoints(
+                args.upload_sizes or args.sizes, args.uploads, args.get_requests, args.concurrency
+            ))
+        if "commit" in args.groups:
+            metrics.update(bench_commits(args.commits))
+    if "startup" in args.groups:
+        metrics.update(bench_startup(args.startup_runs))
+    metrics["process.peak_rss_mb"] = _metric(_peak_rss_mb(), "MB")
+
+    return {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+        },
+        "parameters": {
+            "sizes": args.sizes,
+            "repeat": args.repeat,
+            "algorithm": args.algorithm,
+            "uploads": args.uploads,
+            "get_requests": args.get_requests,
+            "concurrency": args.concurrency,
+            "startup_runs": args.startup_runs,
+        },
+        "metrics": metrics,
+    }
+
+
+def main():
+    """Точка входа командной строки."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=float, nargs="+", default=[0.3, 2, 12, 40])
+    parser.add_argument("--upload-sizes", type=float, nargs="+",
+                        help="Размеры для POST /api/upload (по умолчанию --sizes)")
+    parser.add_argument("--groups", nargs="+", default=["stage", "endpoint", "commit", "startup"],
+                        choices=["stage", "endpoint", "commit", "startup"])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--algorithm", default="threshold")
+    parser.add_argument("--uploads", type=int, default=3)
+    parser.add_argument("--get-requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--commits", type=int, default=20)
+    parser.add_argument("--startup-runs", type=int, default=3)
+    parser.add_argument("--max-upload-mb", type=int, default=256)
+    parser.add_argument("--output", help="Файл для сохранения результата в JSON")
+    parser.add_argument("--baseline", help="Базовый результат для сравнения")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    parser.add_argument("--noise-ms", type=float, default=1.0)
+    args = parser.parse_args()
+
+    result = run(args)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump(result, output, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as baseline_file:
+            baseline = json.load(baseline_file)["metrics"]
+        regressions = compare(result["metrics"], baseline, args.threshold, args.noise_ms)
+        if regressions:
+            print(f"\n{len(regressions)} metrics regressed by more than {args.threshold:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""Замер пропускной способности записи сегментаций с групповой фиксацией и без неё.
+
+Запуск: ``python -m benchmarks.bench_writes [--concurrency 1 8 32 64] [--writes N]``
+
+N параллельных "запросов" вставляют сегментации (с записью результата
+в segmentation_results и счётчиков feedback_stats, как POST /api/upload)
+и ставят им оценку, как POST /api/feedback. Сравниваются режимы:
+
+- ``direct`` - каждая запись своей транзакцией (WriteBatcher без писателя);
+- ``batched`` - групповая фиксация с окном ``--delay-ms``;
+- ``batched-0`` - групповая фиксация без окна: пакет - записи, накопившиеся
+  за время предыдущей фиксации.
+
+Для каждого режима выводятся записей в секунду и задержка записи (p50, p99).
+"""
+
+import argparse
+import asyncio
+import os
+import time
+from datetime import datetime, timezone
+
+from benchmarks.common import isolated_workdir, percentile
+
+
+def _row(user_id: int, index: int) -> dict:
+    digest = os.urandom(32).hex()
+    return {
+        "user_id": user_id,
+        "original_digest": digest,
+        "original_size": 100_000 + index,
+        "original_media_type": "image/jpeg",
+        "segmented_digest": digest[::-1],
+        "segmented_size": 2_000,
+        "segmented_media_type": "application/x-imageseg-mask",
+        "engine": "threshold",
+        "engine_version": "2",
+        "engine_params": '{"threshold": 127}',
+        "created_at": datetime.now(timezone.utc),
+    }
+
+
+async def _run_mode(batcher, user_id: int, concurrency: int, writes: int) -> tuple:
+    latencies = []
+
+    async def client(worker: int):
+        for index in range(writes):
+            row = _row(user_id, worker * writes + index)
+            started = time.perf_counter()
+            segmentation_id = await batcher.create_segmentation(
+                row, (row["original_digest"], "threshold:2", row["segmented_digest"],
+                      row["segmented_size"], row["segmented_media_type"])
+            )
+            latencies.append(time.perf_counter() - started)
+            started = time.perf_counter()
+            await batcher.set_feedback(segmentation_id, index % 2 == 0)
+            latencies.append(time.perf_counter() - started)
+
+    batcher.start()
+    started = time.perf_counter()
+    await asyncio.gather(*(client(worker) for worker in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    await batcher.shutdown()
+    return len(latencies) / elapsed, latencies
+
+
+def run(concurrency_levels, writes: int, delay_ms: float, max_batch: int):
+    """Запуск замеров и вывод результатов."""
+    with isolated_workdir():
+        from app import credentials, crud, schemas
+        from app.database import SessionLocal, async_engine
+        from app.migrate import migrate
+        from app.writes import WriteBatcher
+
+        migrate()
+        with SessionLocal() as session:
+            user = crud.create_user(
+                session,
+                schemas.UserCreate(
+                    username="writer", email="writer@example.com",
+                    password="Passw0rdBench", password_confirm="Passw0rdBench"
+                ),
+                credentials.pwd_context.hash("Passw0rdBench")
+            )
+            user_id = user.id
+
+        modes = {
+            "direct": lambda: WriteBatcher(enabled=False),
+            "batched": lambda: WriteBatcher(max_batch=max_batch, max_delay=delay_ms / 1000),
+            "batched-0": lambda: WriteBatcher(max_batch=max_batch, max_delay=0),
+        }
+
+        async def measure():
+            results = []
+            for concurrency in concurrency_levels:
+                for mode, factory in modes.items():
+                    throughput, latencies = await _run_mode(factory(), user_id, concurrency, writes)
+                    results.append((concurrency, mode, throughput, latencies))
+            await async_engine.dispose()
+            return results
+
+        results = asyncio.run(measure())
+
+    print(f"{'clients':>7} {'mode':<10} {'writes/s':>10} {'p50 ms':>8} {'p99 ms':>8}")
+    for concurrency, mode, throughput, latencies in results:
+        print(f"{concurrency:>7} {mode:<10} {throughput:>10.0f} "
+              f"{percentile(latencies, 0.5) * 1000:>8.2f} {percentile(latencies, 0.99) * 1000:>8.2f}")
+
+
+def main():
+    """Точка входа командной строки."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32, 64])
+    parser.add_argument("--writes", type=int, default=50, help="Вставок на клиента")
+    parser.add_argument("--delay-ms", type=float, default=2.0)
+    parser.add_argument("--max-batch", type=int, default=64)
+    args = parser.parse_args()
+    run(args.concurrency, args.writes, args.delay_ms, args.max_batch)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Общие утилиты бенчмарков.
+
+Содержит функции для:
+- запуска приложения во временном каталоге с отдельной БД и хранилищем
+- генерации синтетических изображений с фиксированным зерном
+- расчёта перцентилей
+"""
+
+import os
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+@contextmanager
+def isolated_workdir(**env):
+    """Временный рабочий каталог для приложения.
+
+    БД, хранилище и профили направляются во временный каталог через
+    переменные окружения (относительные пути в настройках отсчитываются
+    от корня проекта), поэтому приложение не трогает рабочие данные.
+    Схема БД не создаётся: бенчмарк вызывает migrate сам.
+
+    Args:
+        **env: Переменные окружения (настройки) на время работы
+
+    Yields:
+        Path: Путь к временному каталогу
+    """
+    previous_cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        env = {
+            "DATABASE_URL": f"sqlite:///{Path(directory) / 'sql_app.db'}",
+            "BLOB_STORAGE_PATH": str(Path(directory) / "blobs"),
+            "PROFILE_DIR": str(Path(directory) / "profiles"),
+            **env,
+        }
+        previous_env = {name: os.environ.get(name) for name in env}
+        os.environ.update({name: str(value) for name, value in env.items()})
+        os.chdir(directory)
+        try:
+            yield Path(directory)
+        finally:
+            os.chdir(previous_cwd)
+            for name, value in previous_env.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+
+
+def synthetic_image(megapixels: float, seed: int = 0, extension: str = ".jpg") -> bytes:
+    """Синтетическое изображение с плавными градиентами и шумом.
+
+    Args:
+        megapixels: Размер изображения в мегапикселях (соотношение 4:3)
+        seed: Зерно генератора случайных чисел
+        extension: Формат кодирования для cv2.imencode
+
+    Returns:
+        bytes: Закодированное изображение
+    """
+    import cv2
+    import numpy as np
+
+    height = int((megapixels * 1e6 * 3 / 4) ** 0.5)
+    width = int(height * 4 / 3)
+    rng = np.random.default_rng(seed)
+    low = rng.integers(0, 256, size=(max(height // 64, 2), max(width // 64, 2), 3), dtype=np.uint8)
+    image = cv2.resize(low, (width, height), interpolation=cv2.INTER_CUBIC)
+    noise = rng.integers(-12, 13, size=image.shape, dtype=np.int16)
+    image = np.clip(image.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+    _, encoded = cv2.imencode(extension, image)
+    return encoded.tobytes()
+
+
+def percentile(values, fraction: float) -> float:
+    """Перцентиль по отсортированной выборке (ближайший ранг)."""
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))
+    return ordered[index]
@@ -123,8 +123,107 @@ function showFeedbackMessage(text, isSuccess) {
 }
 
 
+// Заполнение списка алгоритмов сегментации
+async function loadEngines() {
+    const select = document.getElementById('algorithmSelect');
+    if (!select) return;
+    try {
+        const response = await fetch('/api/engines', {credentials: 'include'});
+        if (!response.ok) return;
+        const data = await response.json();
+        for (const engine of data.engines) {
+            const option = document.createElement('option');
+            option.value = engine.name;
+            option.textContent = engine.name;
+            option.selected = engine.name === data.default;
+            select.appendChild(option);
+        }
+    } catch (error) {
+        console.error('Ошибка загрузки алгоритмов:', error);
+    }
+}
+
+loadEngines();
+
+
+// История загрузок в профиле: страницы подгружаются по курсору
+const historyState = {cursor: null, filters: new URLSearchParams()};
+
+function historyRow(item) {
+    const row = document.createElement('tr');
+    const feedback = item.is_good === null ? '—' : (item.is_good ? 'Хорошо' : 'Плохо');
+    const cells = [
+        [item.original_url, item.original_thumb_url],
+        [item.segmented_url, item.segmented_thumb_url],
+    ];
+    for (const [url, thumb] of cells) {
+        const cell = document.createElement('td');
+        const link = document.createElement('a');
+        link.href = url;
+        link.target = '_blank';
+        const image = document.createElement('img');
+        image.src = thumb;
+        image.loading = 'lazy';
+        image.className = 'history-thumb';
+        link.appendChild(image);
+        cell.appendChild(link);
+        row.appendChild(cell);
+    }
+    for (const text of [new Date(item.created_at).toLocaleString(), item.engine || '—', feedback]) {
+        const cell = document.createElement('td');
+        cell.textContent = text;
+        row.appendChild(cell);
+    }
+    return row;
+}
+
+async function loadHistory(reset = false) {
+    const body = document.getElementById('historyBody');
+    if (!body) return;
+    const more = document.getElementById('historyMore');
+    if (reset) {
+        body.innerHTML = '';
+        historyState.cursor = null;
+    }
+    const params = new URLSearchParams(historyState.filters);
+    if (historyState.cursor) params.set('cursor', historyState.cursor);
+    try {
+        const response = await fetch(`/api/segmentations?${params}`, {credentials: 'include'});
+        if (!response.ok) throw new Error('Ошибка сервера');
+        const data = await response.json();
+        data.items.forEach(item => body.appendChild(historyRow(item)));
+        historyState.cursor = data.next_cursor;
+        more.style.display = data.next_cursor ? 'inline-block' : 'none';
+        document.getElementById('historyEmpty').style.display = body.children.length ? 'none' : 'block';
+    } catch (error) {
+        showFeedbackMessage(`Ошибка загрузки истории: ${error.message}`, false);
+    }
+}
+
+document.getElementById('historyMore')?.addEventListener('click', () => loadHistory());
+
+document.getElementById('historyFilters')?.addEventListener('submit', function(e) {
+    e.preventDefault();
+    historyState.filters = new URLSearchParams();
+    for (const [name, value] of new FormData(this)) {
+        if (!value) continue;
+        if (name === 'created_to') {
+            // Граница API не включительная, а в форме выбирается последний день
+            const next = new Date(value);
+            next.setDate(next.getDate() + 1);
+            historyState.filters.set(name, next.toISOString().slice(0, 10));
+        } else {
+            historyState.filters.set(name, value);
+        }
+    }
+    loadHistory(true);
+});
+
+loadHistory(true);
+
+
 // Обработчик формы загрузки
-document.getElementById('uploadForm').addEventListener('submit', async function(e) {
+document.getElementById('uploadForm')?.addEventListener('submit', async function(e) {
     e.preventDefault();
     const resultContainer = document.getElementById('resultContainer');
     const fileInput = document.getElementById('imageInput');
@@ -147,8 +246,12 @@ document.getElementById('uploadForm').addEventListener('submit', async function(
 
         // Обновляем контейнер с новыми данными
         resultContainer.dataset.imageId = data.id;
-        document.getElementById('originalImage').src = `/api/original/${data.id}?t=${Date.now()}`;
-        document.getElementById('segmentedImage').src = `/api/segmented/${data.id}?t=${Date.now()}`;
+        // URL содержат хеш содержимого и кешируются браузером; на странице
+        // показываются миниатюры, полный размер открывается по ссылке
+        document.getElementById('originalImage').src = data.original_thumb_url;
+        document.getElementById('segmentedImage').src = data.segmented_thumb_url;
+        document.getElementById('originalLink').href = data.original_url;
+        document.getElementById('segmentedLink').href = data.segmented_url;
         resultContainer.style.display = 'block';
 
     } catch (error) {